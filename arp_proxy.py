@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Tuple, Dict, Optional
+import socket
+import struct
+import time
+import setting
+
+"""
+控制器代答ARP: 带有效期的 IP——>MAC 缓存, 以及未知目的IP的泛洪限速
+"""
+# 以太网头部 + ARP(以太网/IPv4) 应答
+_ARP_REPLY = struct.Struct('!6s6sHHHBBH6s4s6s4s')
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_IP = 0x0800
+ARP_HW_TYPE_ETHERNET = 1
+ARP_REPLY = 2
+
+
+def mac_to_bytes(mac: str) -> bytes:
+    return bytes.fromhex(mac.replace(':', ''))
+
+
+class ArpProxy:
+    """
+    - cache: ip ——> (mac, 过期时间), 由 NetworkAwareness.register_access_info 学习主机时写入
+    - lookup: 缓存命中且未过期时返回mac, 控制器直接生成ARP应答
+    - allow_flood: 未知目的IP的ARP请求按目的IP限定最小泛洪间隔, 并以令牌桶限制总泛洪速率
+    clock: 时间函数, 默认 time.monotonic
+    """
+    def __init__(self, ttl: float = setting.ARP_PROXY_CACHE_TTL,
+                 flood_interval: float = setting.ARP_FLOOD_INTERVAL,
+                 flood_rate: float = setting.ARP_FLOOD_RATE,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.flood_interval = flood_interval
+        self.flood_rate = flood_rate
+        self.clock = clock
+        self.cache: Dict[str, Tuple[str, float]] = {}
+        # 目的IP ——> 上次泛洪时间
+        self.last_flood: Dict[str, float] = {}
+        self.flood_tokens = float(flood_rate)
+        self.flood_tokens_time = clock()
+        self.n_replies = 0
+        self.n_floods = 0
+        self.n_suppressed = 0
+
+    def learn(self, ip: str, mac: str):
+        self.cache[ip] = (mac, self.clock() + self.ttl)
+        # 目的主机已经出现, 不再需要泛洪
+        self.last_flood.pop(ip, None)
+
+    def forget(self, ip: str):
+        self.cache.pop(ip, None)
+
+    def lookup(self, ip: str) -> Optional[str]:
+        item = self.cache.get(ip)
+        if item is None:
+            return None
+        if item[1] <= self.clock():
+            del self.cache[ip]
+            return None
+        return item[0]
+
+    def allow_flood(self, ip: str) -> bool:
+        now = self.clock()
+        last = self.last_flood.get(ip)
+        if last is not None and now - last < self.flood_interval:
+            self.n_suppressed += 1
+            return False
+        self.flood_tokens = min(float(self.flood_rate),
+                                self.flood_tokens + (now - self.flood_tokens_time) * self.flood_rate)
+        self.flood_tokens_time = now
+        if self.flood_tokens < 1:
+            self.n_suppressed += 1
+            return False
+        self.flood_tokens -= 1
+        self.last_flood[ip] = now
+        self.n_floods += 1
+        return True
+
+    def build_reply(self, target_ip: str, target_mac: str, requester_ip: str, requester_mac: str) -> bytes:
+        """
+        生成 target_ip is-at target_mac 的ARP应答帧, 发往请求方
+        """
+        self.n_replies += 1
+        requester = mac_to_bytes(requester_mac)
+        target = mac_to_bytes(target_mac)
+        return _ARP_REPLY.pack(requester, target, ETH_TYPE_ARP,
+                               ARP_HW_TYPE_ETHERNET, ETH_TYPE_IP, 6, 4, ARP_REPLY,
+                               target, socket.inet_aton(target_ip),
+                               requester, socket.inet_aton(requester_ip))
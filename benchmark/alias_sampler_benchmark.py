@@ -0,0 +1,71 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import queue
+import random
+import numpy as np
+from cpn_policy_sampler import AliasSampler
+
+"""
+对比别名表采样器与原 CPNServiceForwardingEntry 的队列取整方案:
+每秒选取次数 以及 实际选取比例与目标策略的偏差(总变差距离)
+用法: python benchmark/alias_sampler_benchmark.py
+"""
+
+N_SELECTIONS = 200000
+
+
+class RoundingQueueSampler:
+    """
+    原 CPNServiceForwardingEntry.rouding_forwarding_policy 与 update_newest_service_instance_id 的选取方式(去掉打印)
+    """
+    def __init__(self, forwarding_policy):
+        self.forwading_queue = queue.Queue()
+        n_service_instance = len(forwarding_policy)
+        rouding_forwarding_policy = np.round(n_service_instance*np.asarray(forwarding_policy))
+        while np.sum(rouding_forwarding_policy) >= 1e-6:
+            temp_list = []
+            for i in range(n_service_instance):
+                if rouding_forwarding_policy[i] >= 1:
+                    rouding_forwarding_policy[i] -= 1
+                    temp_list.append(i)
+            random.shuffle(temp_list)
+            for item in temp_list:
+                self.forwading_queue.put(item)
+
+    def sample(self):
+        index = self.forwading_queue.get()
+        self.forwading_queue.put(index)
+        return index
+
+
+def run(sampler, n_instance, n=N_SELECTIONS):
+    counts = np.zeros(n_instance, dtype=float)
+    select = sampler.sample
+    start = time.perf_counter()
+    for _ in range(n):
+        counts[select()] += 1
+    cost = time.perf_counter() - start
+    return n / cost, counts / n
+
+
+def main():
+    rsnp = np.random.RandomState(seed=68)
+    policies = {
+        'ot-row-1': np.array([0.672, 0.328, 0.0, 0.0]),
+        'ot-row-2': np.array([0.216, 0.0, 0.0, 0.784]),
+        'dirichlet-4': rsnp.dirichlet(np.ones(4)),
+        'dirichlet-16': rsnp.dirichlet(np.ones(16)),
+        'dirichlet-64': rsnp.dirichlet(np.ones(64)),
+    }
+    print('%14s %10s %16s %12s' % ('policy', 'sampler', 'selections/s', 'TV-distance'))
+    for name, policy in policies.items():
+        for sampler_name, sampler in [('queue', RoundingQueueSampler(policy)), ('alias', AliasSampler(policy))]:
+            rate, achieved = run(sampler, len(policy))
+            tv_distance = 0.5 * np.sum(np.abs(achieved - policy))
+            print('%14s %10s %16.0f %12.4f' % (name, sampler_name, rate, tv_distance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import time
+import networkx as nx
+from path_store import ParallelPathEngine, source_k_shortest_paths
+
+"""
+对比进程池并行计算与networkx串行计算(原 all_k_shortest_paths 的方式)全部交换机对k最短路径的耗时
+拓扑: fat-tree(k叉, 共 5k^2/4 个交换机) 与 随机正则图
+speedup = networkx串行耗时 / 并行耗时
+用法: python benchmark/path_engine_benchmark.py --sizes 50 100 200 500 --workers 4 --k-paths 1
+"""
+
+
+def to_switch_graph(graph: nx.Graph) -> nx.DiGraph:
+    """
+    转换为与 NetworkAwareness.graph 相同形式的有向图: 自环权重0, 链路权重1
+    """
+    digraph = nx.DiGraph()
+    for node in graph.nodes():
+        digraph.add_edge(node, node, weight=0)
+    for u, v in graph.edges():
+        digraph.add_edge(u, v, weight=1)
+        digraph.add_edge(v, u, weight=1)
+    return digraph
+
+
+def fat_tree(k: int) -> nx.DiGraph:
+    graph = nx.Graph()
+    n_core = (k // 2) ** 2
+    core = list(range(n_core))
+    next_id = n_core
+    for pod in range(k):
+        aggs = list(range(next_id, next_id + k // 2))
+        edges = list(range(next_id + k // 2, next_id + k))
+        next_id += k
+        for i, agg in enumerate(aggs):
+            for edge in edges:
+                graph.add_edge(agg, edge)
+            for j in range(k // 2):
+                graph.add_edge(agg, core[i * (k // 2) + j])
+    return to_switch_graph(graph)
+
+
+def fat_tree_k_for_size(size: int) -> int:
+    # fat-tree 交换机数量为 5k^2/4, 取最接近 size 的偶数k
+    k = 2
+    while 5 * (k + 2) ** 2 / 4 <= size:
+        k += 2
+    return k
+
+
+def random_topology(size: int, degree: int = 4, seed: int = 68) -> nx.DiGraph:
+    return to_switch_graph(nx.random_regular_graph(degree, size, seed=seed))
+
+
+def serial_paths(graph, k_paths):
+    return {src: source_k_shortest_paths(graph, src, k=k_paths)[0] for src in graph.nodes()}
+
+
+def parallel_paths(engine, graph, k_paths):
+    results = engine.compute(graph, list(graph.nodes()), k=k_paths, wait=lambda: time.sleep(0.001))
+    return {src: paths for src, (paths, dist) in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200, 500])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--k-paths', type=int, default=1)
+    args = parser.parse_args()
+
+    engine = ParallelPathEngine(n_workers=args.workers)
+    # 预热工作进程
+    parallel_paths(engine, fat_tree(4), args.k_paths)
+
+    print('%10s %10s %12s %12s %14s' % ('topology', 'switches', 'networkx(s)', 'parallel(s)', 'vs-networkx'))
+    for size in args.sizes:
+        topologies = [('fat-tree', fat_tree(fat_tree_k_for_size(size))), ('random', random_topology(size))]
+        for name, graph in topologies:
+            start = time.perf_counter()
+            serial = serial_paths(graph, args.k_paths)
+            serial_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            parallel = parallel_paths(engine, graph, args.k_paths)
+            parallel_time = time.perf_counter() - start
+            assert len(serial) == len(parallel)
+            print('%10s %10d %12.3f %12.3f %13.2fx' % (name, graph.number_of_nodes(), serial_time,
+                                                       parallel_time, serial_time / parallel_time))
+    engine.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import socket
+import struct
+import argparse
+from collections import namedtuple
+import numpy as np
+from ryu.lib.packet import ipv4, tcp
+from cpn_service_registry import CPNService, CPNServiceRegistry, CPNServiceForwardingEntry
+from packet_classifier import ClassifiedPacket
+
+"""
+多服务下 CPNRouting packet_in 处理TCP请求的开销, 每个报文按 _packet_in_handler 的路径处理:
+由合成的 Ethernet/IPv4/TCP 报文字节构造 ClassifiedPacket 分类 ——> 判断目的地址是否为任播IP ——> 完整解析得到TCP目的端口
+——> 查找 (dpid, service_id) 的服务条目 ——> 按服务策略选取服务实例
+- table: 原 CPNRouting 的方式, 每个报文由 service_id_dict 重建任播IP列表并线性判断, 再按 dpid ——> service_id 两级字典查找条目
+- registry: CPNServiceRegistry, 任播IP集合判断, 按 (dpid, service_id) 一次哈希查找条目
+covered 为原 _init_testing_setting 建表后仍能查找到的服务数量
+用法: python benchmark/service_registry_benchmark.py --services 100 200 500
+"""
+
+N_PACKETS = 100000
+# 与 SimNetworkSetUp.switchB_dpid_list 相同的接入交换机
+ACCESS_DPIDS = [5, 6, 7, 8, 9, 10]
+CLIENT_MAC = bytes.fromhex('00000000000a')
+SWITCH_MAC = bytes.fromhex('00000000000b')
+# packet_in 消息中 ClassifiedPacket 读取的部分
+PacketIn = namedtuple('PacketIn', ['data'])
+
+
+def build_services(n_services, rsnp, access_dpids=ACCESS_DPIDS):
+    services = []
+    for i in range(n_services):
+        anycast_ip = '192.168.%d.%d' % (i // 250, i % 250 + 1)
+        n_instance = rsnp.randint(2, 9)
+        instances = [('10.1.%d.%d' % (i // 250, k + 1), 8000 + k) for k in range(n_instance)]
+        policy = rsnp.dirichlet(np.ones(n_instance), size=len(access_dpids))
+        services.append(CPNService((anycast_ip, 8000), instances, access_dpids,
+                                   description='service-%d' % i, policy=policy))
+    return services
+
+
+def build_table(services, overwrite=False):
+    """
+    dpid ——> service_id ——> 条目 的两级字典
+    overwrite: 按原 _init_testing_setting 的方式每个服务都覆盖 dpid 对应的字典, 每个交换机只保留最后一个服务
+    """
+    service_id_dict = {}
+    table = {}
+    for service in services:
+        service_id_dict[service.service_id] = service.description
+        for dpid in service.access_dpids:
+            entry = CPNServiceForwardingEntry(dpid=dpid, service_id=service.service_id,
+                                              service_instance_list=service.service_instance_list,
+                                              service=service)
+            if overwrite:
+                table[dpid] = {service.service_id: entry}
+            else:
+                table.setdefault(dpid, {})[service.service_id] = entry
+    return service_id_dict, table
+
+
+def ip_checksum(header: bytes) -> int:
+    total = sum(struct.unpack('!10H', header))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def tcp_syn_frame(ip_src: str, ip_dst: str, src_port: int, dst_port: int) -> bytes:
+    """
+    客户端发往任播地址的TCP SYN报文 (Ethernet + IPv4 + TCP)
+    """
+    tcp_header = struct.pack('!HHIIBBHHH', src_port, dst_port, 1, 0, 5 << 4, tcp.TCP_SYN, 65535, 0, 0)
+    ip_header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp_header), 0, 0x4000, 64, socket.IPPROTO_TCP, 0,
+                            socket.inet_aton(ip_src), socket.inet_aton(ip_dst))
+    ip_header = ip_header[:10] + struct.pack('!H', ip_checksum(ip_header)) + ip_header[12:]
+    return SWITCH_MAC + CLIENT_MAC + struct.pack('!H', 0x0800) + ip_header + tcp_header
+
+
+def make_packets(services, n, rsnp):
+    """
+    return: List[(dpid, packet_in消息)]
+    """
+    packets = []
+    for _ in range(n):
+        service = services[rsnp.randint(len(services))]
+        dpid = service.access_dpids[rsnp.randint(len(service.access_dpids))]
+        data = tcp_syn_frame('10.0.0.%d' % rsnp.randint(1, 250), service.service_id[0],
+                             int(rsnp.randint(1024, 65536)), service.service_id[1])
+        packets.append((dpid, PacketIn(data)))
+    return packets
+
+
+def parse_service_id(classified: ClassifiedPacket):
+    """
+    与 _packet_in_handler 相同: 任播IP报文完整解析后由TCP目的端口得到 service_id
+    """
+    pkt = classified.packet
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    pkt_tcp = pkt.get_protocol(tcp.tcp)
+    return ip_pkt.dst, pkt_tcp.dst_port
+
+
+def run_table(service_id_dict, table, packets):
+    handled = 0
+    start = time.perf_counter()
+    for dpid, msg in packets:
+        classified = ClassifiedPacket(msg)
+        cpn_ip_list = [item[0] for item in service_id_dict.keys()]
+        if classified.dst_ip not in cpn_ip_list:
+            continue
+        service_id = parse_service_id(classified)
+        entries = table.get(dpid, {})
+        if service_id not in entries:
+            continue
+        entry = entries[service_id]
+        entry.update_newest_service_instance_id(entry.service.policy)
+        handled += 1
+    cost = time.perf_counter() - start
+    return len(packets) / cost, handled
+
+
+def run_registry(registry: CPNServiceRegistry, packets):
+    handled = 0
+    start = time.perf_counter()
+    for dpid, msg in packets:
+        classified = ClassifiedPacket(msg)
+        if classified.dst_ip not in registry.anycast_ips:
+            continue
+        entry = registry.get_entry(dpid, parse_service_id(classified))
+        if entry is None:
+            continue
+        entry.update_newest_service_instance_id(entry.service.policy)
+        handled += 1
+    cost = time.perf_counter() - start
+    return len(packets) / cost, handled
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--services', type=int, nargs='+', default=[10, 100, 200, 500])
+    parser.add_argument('--packets', type=int, default=N_PACKETS)
+    args = parser.parse_args()
+
+    print('%10s %10s %14s %12s %10s' % ('services', 'lookup', 'packets/s', 'handled', 'covered'))
+    for n_services in args.services:
+        rsnp = np.random.RandomState(seed=68)
+        services = build_services(n_services, rsnp)
+        packets = make_packets(services, args.packets, rsnp)
+
+        _, overwritten = build_table(services, overwrite=True)
+        covered = len({service_id for entries in overwritten.values() for service_id in entries})
+        service_id_dict, table = build_table(services)
+        rate, handled = run_table(service_id_dict, table, packets)
+        print('%10d %10s %14.0f %12d %10d' % (n_services, 'table', rate, handled, covered))
+
+        registry = CPNServiceRegistry()
+        for service in services:
+            registry.register(service)
+        rate, handled = run_registry(registry, packets)
+        print('%10d %10s %14.0f %12d %10d' % (n_services, 'registry', rate, handled, len(registry)))
+
+
+if __name__ == '__main__':
+    main()
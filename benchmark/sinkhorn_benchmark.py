@@ -0,0 +1,97 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import numpy as np
+from cpn_routing_algo import CPNRoutingAlgo
+
+"""
+对比 numpy log-domain sinkhorn (冷启动/热启动) 与原 torch 实现的单次求解耗时
+用法: python benchmark/sinkhorn_benchmark.py
+"""
+
+SIZES = [(6, 4), (50, 20), (200, 50), (500, 100), (1000, 200)]
+REG = 1e-2
+NUM_ITERS = 200
+REPEAT = 5
+
+
+def torch_sinkhorn(r, c, M, reg=1e-3, error_thres=1e-8, num_iters=200):
+    """
+    原 CPNRoutingAlgo.sinkhorn 的 torch 实现, 仅用于对比
+    """
+    import torch
+    n, d1, d2 = M.shape
+    K = (-M / reg).exp()
+    u = torch.ones_like(r) / d1
+    v = torch.ones_like(c) / d2
+    for _ in range(num_iters):
+        r0 = u
+        u = r / torch.einsum('ijk,ik->ij', [K, v])
+        v = c / torch.einsum('ikj,ik->ij', [K, u])
+        err = (u - r0).abs().mean()
+        if err.item() < error_thres:
+            break
+    T = torch.einsum('ij,ik->ijk', [u, v]) * K
+    return T, u, v
+
+
+def random_problem(rsnp, d1, d2):
+    r = rsnp.rand(d1) + 0.1
+    c = rsnp.rand(d2) + 0.1
+    M = rsnp.rand(d1, d2)
+    return r / r.sum(), c / c.sum(), M / M.max()
+
+
+def perturb(rsnp, r, c, M, scale=0.01):
+    r = r * (1 + scale * rsnp.rand(*r.shape))
+    c = c * (1 + scale * rsnp.rand(*c.shape))
+    M = M * (1 + scale * rsnp.rand(*M.shape))
+    return r / r.sum(), c / c.sum(), M / M.max()
+
+
+def timeit(func, repeat=REPEAT):
+    costs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        costs.append(time.perf_counter() - start)
+    return np.median(costs), result
+
+
+def main():
+    rsnp = np.random.RandomState(seed=68)
+    start = time.perf_counter()
+    try:
+        import torch
+        torch_import_time = time.perf_counter() - start
+    except ImportError:
+        torch = None
+        torch_import_time = None
+    if torch_import_time is not None:
+        print(f"torch import time: {torch_import_time*1e3:.1f} ms")
+    else:
+        print("torch is not installed, skip torch benchmark")
+
+    print('%12s %14s %14s %14s %12s' % ('size', 'numpy-cold(ms)', 'numpy-warm(ms)', 'torch(ms)', 'max|dT|'))
+    for d1, d2 in SIZES:
+        r, c, M = random_problem(rsnp, d1, d2)
+        cold_time, (T, f, g) = timeit(lambda: CPNRoutingAlgo.sinkhorn(r, c, M, reg=REG, num_iters=NUM_ITERS))
+
+        # 轻微扰动后使用上一次的对偶势热启动
+        r2, c2, M2 = perturb(rsnp, r, c, M)
+        warm_time, _ = timeit(lambda: CPNRoutingAlgo.sinkhorn(r2, c2, M2, reg=REG, num_iters=NUM_ITERS, f=f, g=g))
+
+        torch_time = float('nan')
+        diff = float('nan')
+        if torch is not None:
+            torch_time, (T_torch, _, _) = timeit(lambda: torch_sinkhorn(
+                r=torch.from_numpy(r).unsqueeze(dim=0), c=torch.from_numpy(c).unsqueeze(dim=0),
+                M=torch.from_numpy(M).unsqueeze(dim=0), reg=REG, num_iters=NUM_ITERS))
+            diff = np.max(np.abs(T_torch.squeeze(dim=0).numpy() - T))
+        print('%12s %14.3f %14.3f %14.3f %12.2e' % (f'{d1}x{d2}', cold_time*1e3, warm_time*1e3, torch_time*1e3, diff))
+
+
+if __name__ == '__main__':
+    main()
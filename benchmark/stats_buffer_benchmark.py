@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import argparse
+import numpy as np
+from stats_buffer import StatsRingBuffer
+
+"""
+单个交换机流统计回复的处理开销:
+- list: 原 NetworkMonitor 的方式, 排序回复后逐条 append/pop(0) 保存统计记录与速率
+- ring: StatsRingBuffer, 一次向量化差分计算所有流的速率
+只比较保存与速率计算部分, 两种方式都从相同的 (key, byte_count, duration_sec, duration_nsec) 列表读取
+用法: python benchmark/stats_buffer_benchmark.py --flows 100 1000 10000
+"""
+
+N_REPLIES = 20
+LENGTH = 5
+PERIOD = 20
+
+
+def make_replies(n_flows, n_replies, rsnp):
+    keys = [(int(rsnp.randint(1, 48)), '10.0.%d.%d' % (i // 250, i % 250 + 1), int(rsnp.randint(1, 48)))
+            for i in range(n_flows)]
+    byte_count = np.zeros(n_flows, dtype=np.int64)
+    replies = []
+    for r in range(n_replies):
+        byte_count = byte_count + rsnp.randint(0, 10 ** 7, size=n_flows)
+        replies.append([(key, int(count), PERIOD * (r + 1), int(rsnp.randint(10 ** 9)))
+                        for key, count in zip(keys, byte_count)])
+    return replies
+
+
+def save_stats(_dict, key, value, length):
+    if key not in _dict:
+        _dict[key] = []
+    _dict[key].append(value)
+    if len(_dict[key]) > length:
+        _dict[key].pop(0)
+
+
+def run_list(replies):
+    flow_stats, flow_speed = {}, {}
+    start = time.perf_counter()
+    for body in replies:
+        for key, byte_count, sec, nsec in sorted(body, key=lambda item: (item[0][0], item[0][1])):
+            save_stats(flow_stats, key, (byte_count, sec, nsec), LENGTH)
+            tmp = flow_stats[key]
+            pre, period = 0, PERIOD
+            if len(tmp) > 1:
+                pre = tmp[-2][0]
+                period = (tmp[-1][1] + tmp[-1][2] / 10 ** 9) - (tmp[-2][1] + tmp[-2][2] / 10 ** 9)
+            speed = (tmp[-1][0] - pre) / period if period else 0
+            save_stats(flow_speed, key, speed, LENGTH)
+    cost = time.perf_counter() - start
+    return len(replies) / cost, [flow_speed[item[0]][-1] for item in replies[-1]]
+
+
+def run_ring(replies):
+    flow_stats = StatsRingBuffer(length=LENGTH)
+    start = time.perf_counter()
+    for body in replies:
+        values = {}
+        for key, byte_count, sec, nsec in body:
+            values[key] = (byte_count, sec + nsec / 10 ** 9)
+        counters, times = zip(*values.values())
+        speeds = flow_stats.update(list(values), counters, times, PERIOD)
+    cost = time.perf_counter() - start
+    return len(replies) / cost, speeds.tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--replies', type=int, default=N_REPLIES)
+    args = parser.parse_args()
+
+    print('%10s %8s %12s %14s' % ('flows', 'store', 'replies/s', 'max-speed-err'))
+    for n_flows in args.flows:
+        rsnp = np.random.RandomState(seed=68)
+        replies = make_replies(n_flows, args.replies, rsnp)
+        list_rate, list_speeds = run_list(replies)
+        ring_rate, ring_speeds = run_ring(replies)
+        error = float(np.max(np.abs(np.subtract(list_speeds, ring_speeds))))
+        print('%10d %8s %12.1f %14s' % (n_flows, 'list', list_rate, '-'))
+        print('%10d %8s %12.1f %14.3g' % (n_flows, 'ring', ring_rate, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import setting
+
+"""
+cpn转发策略计算的缓存工具: JSON文件监视器 与 策略结果缓存
+"""
+class JsonFileWatcher:
+    """
+    按 (mtime, size) 监视JSON文件, 只有文件真正发生变化时才重新读取解析
+    path: JSON文件路径
+    check_interval: 两次检查文件状态的最小间隔(s), 间隔内直接返回内存中的数据
+    """
+    def __init__(self, path: str, check_interval: float = setting.RPS_FILE_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        # 最近一次成功解析的文件内容
+        self.data: Optional[Any] = None
+        # 文件内容每重新加载一次 版本号加一
+        self.version = 0
+        self._stat_key = None
+        self._last_check_time = None
+
+    def load(self) -> Optional[Any]:
+        """
+        返回文件的最新内容, 文件不存在或正在写入(解析失败)时返回上一次的内容
+        """
+        now = time.monotonic()
+        if self._last_check_time is not None and now - self._last_check_time < self.check_interval:
+            return self.data
+        self._last_check_time = now
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self.data
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key == self._stat_key:
+            return self.data
+        try:
+            with open(self.path, 'r') as json_file:
+                data = json.load(json_file)
+        except (OSError, ValueError):
+            # 文件可能正在被写入, 下次检查时重试
+            return self.data
+        self.data = data
+        self._stat_key = stat_key
+        self.version += 1
+        return self.data
+
+
+class PolicyCache:
+    """
+    转发策略LRU缓存, 以输入数组(rps向量, 带宽/时延矩阵等)的哈希值为键
+    max_size: 最多缓存的策略数量
+    """
+    def __init__(self, max_size: int = setting.POLICY_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache: Dict[bytes, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*arrays: np.ndarray) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            array = np.ascontiguousarray(array, dtype=float)
+            h.update(str(array.shape).encode())
+            h.update(array.tobytes())
+        return h.digest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        policy = self._cache.get(key)
+        if policy is None:
+            self.misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return policy
+
+    def put(self, key: bytes, policy: np.ndarray):
+        self._cache[key] = policy
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import NamedTuple
+import logging
+import time
+import numpy as np
+from ryu.lib import hub
+import setting
+from cpn_routing_algo import CPNRoutingAlgo
+
+LOG = logging.getLogger(__name__)
+
+
+class PolicySnapshot(NamedTuple):
+    """
+    不可变的转发策略快照
+    version: 策略版本号, 策略内容每变化一次加一
+    policy: 入口节点数量 * 应用数量 二维只读数组, 数组值为转发概率值
+    timestamp: 快照发布时间
+    """
+    version: int
+    policy: np.ndarray
+    timestamp: float
+
+
+class CPNPolicyEngine:
+    """
+    后台策略引擎, 在独立的hub协程中周期性调用路由算法计算转发策略, 并发布带版本号的不可变策略快照
+    packet_in 等处理路径只需通过 latest() 以O(1)读取最新快照, 不再同步执行策略计算
+    routing_algo: cpn 路由算法类实例
+    period: 策略计算周期(s)
+    """
+    def __init__(self, routing_algo: CPNRoutingAlgo, period: float = setting.CPN_POLICY_ENGINE_PERIOD):
+        self.routing_algo = routing_algo
+        self.period = period
+        self._snapshot: PolicySnapshot = PolicySnapshot(version=0, policy=None, timestamp=time.time())
+        self.publish(routing_algo.global_forwarding_policy)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = hub.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            hub.kill(self._thread)
+            self._thread = None
+
+    def latest(self) -> PolicySnapshot:
+        """
+        返回最新的策略快照, 快照一旦发布就不会被修改
+        """
+        return self._snapshot
+
+    def refresh(self) -> PolicySnapshot:
+        """
+        立即计算一次策略并发布
+        """
+        return self.publish(self.routing_algo.update_forwarding_policy())
+
+    def publish(self, policy: np.ndarray) -> PolicySnapshot:
+        """
+        发布新的策略快照, 策略未变化时保持原版本号
+        """
+        snapshot = self._snapshot
+        if policy is None:
+            return snapshot
+        if snapshot.policy is not None and np.array_equal(snapshot.policy, policy):
+            return snapshot
+        policy = np.array(policy, dtype=float, copy=True)
+        policy.setflags(write=False)
+        # 引用赋值是原子的, 读者要么看到旧快照要么看到新快照
+        self._snapshot = PolicySnapshot(version=snapshot.version + 1, policy=policy, timestamp=time.time())
+        return self._snapshot
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                LOG.exception('CPN policy engine failed to update forwarding policy')
+            hub.sleep(self.period)
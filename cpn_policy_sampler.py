@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List
+import random
+import numpy as np
+
+"""
+按转发策略(概率向量)选取服务实例的采样器
+"""
+class AliasSampler:
+    """
+    Walker/Vose 别名表采样器
+    建表 O(n), 每次选取 O(1) 且只需一次随机数, 长期选取比例与概率向量一致
+    weights: 非负权重向量(例如转发策略的某一行), 无需归一化
+    rng: 随机数生成器, 默认使用独立的 random.Random 实例
+    """
+    def __init__(self, weights, rng: random.Random = None):
+        self.rng = rng if rng is not None else random.Random()
+        self.n = 0
+        self.prob: List[float] = []
+        self.alias: List[int] = []
+        self.build(weights)
+
+    def build(self, weights):
+        """
+        根据权重向量重建别名表
+        """
+        weights = np.asarray(weights, dtype=float)
+        n = len(weights)
+        total = np.sum(weights)
+        if n == 0 or not total > 0:
+            raise ValueError('weights must contain at least one positive value: %s' % (weights,))
+        scaled = list(weights * n / total)
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # 剩余的列由于浮点误差可能略小于1 直接视为1
+        self.n = n
+        self.prob = prob
+        self.alias = alias
+
+    def sample(self) -> int:
+        """
+        按权重选取一个下标
+        """
+        u = self.rng.random() * self.n
+        i = int(u)
+        if u - i < self.prob[i]:
+            return i
+        return self.alias[i]
@@ -4,12 +4,8 @@ from typing import List, Tuple, Dict, Set
 import numpy as np
 import setting
 from setting import SimNetworkSetUp, CPNRoutingAlgoName
-import json
-import torch
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib import gridspec
-import subprocess
+from cpn_policy_cache import JsonFileWatcher, PolicyCache
+from cpu_telemetry import CgroupCPUCollector
 # from vlkit.optimal_transport import sinkhorn
 
 """
@@ -26,9 +22,15 @@ class CPNRoutingAlgo:
         self.global_forwarding_policy: np.array = None
         self.setup: SimNetworkSetUp = setup
         self.routing_algo_name = routing_algo_name
-        # 保存ot 算法参数
-        self.prime_app_rps = None
-        self.cpn_node_rps = None
+        # 监视 rps JSON 文件, 只有文件变化时才重新读取
+        self.prime_app_rps_watcher = JsonFileWatcher(setting.PRIME_APP_RPS_JSON_PATH)
+        self.cpn_node_rps_watcher = JsonFileWatcher(setting.CPN_NODE_RPS_JSON_PATH)
+        # ot 算法策略缓存 键为rps向量与带宽/时延矩阵的哈希值
+        self.ot_policy_cache = PolicyCache()
+        # 保存上一次sinkhorn求解的输入与对偶势 (r, c, M, f, g), 用于热启动
+        self.ot_warm_start: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray] = None
+        # 读取cgroup的应用容器CPU利用率采集器, 由控制器周期性调用 sample() 采样
+        self.cpu_collector = CgroupCPUCollector(n_containers=setup.numberOfPrimeApps)
         self._init_forwarding_policy()
 
     def _init_forwarding_policy(self):
@@ -69,10 +71,10 @@ class CPNRoutingAlgo:
     
     def qps_weighted_policy_algo(self, update=False)-> np.array:
         if update:
-            prime_app_rps = None
-            # 从 JSON 文件读取字典 获取各个primeApp的 rps负载能力
-            with open('/home/wwz/ryu/ryu/app/network_awareness/prime_app_rps.json', 'r') as json_file:
-                prime_app_rps: Dict[str, float] = json.load(json_file)
+            # 获取各个primeApp的 rps负载能力
+            prime_app_rps: Dict[str, float] = self.prime_app_rps_watcher.load()
+            if prime_app_rps is None:
+                return self.global_forwarding_policy
             prime_app_rps_value = np.array(list(prime_app_rps.values()))
             line_policy = prime_app_rps_value / np.sum(prime_app_rps_value)
             forwarding_policy = np.vstack([line_policy] * self.setup.numberOfCPNodes)
@@ -87,27 +89,28 @@ class CPNRoutingAlgo:
         """
         if update:
             forwarding_policy = np.zeros(shape=(self.setup.numberOfCPNodes, self.setup.numberOfPrimeApps), dtype= float)
-            prime_app_rps = None
-            cpn_node_rps = None
-            # 从 JSON 文件读取字典 获取各个primeApp的 rps负载能力
-            with open('/home/wwz/ryu/ryu/app/network_awareness/prime_app_rps.json', 'r') as json_file:
-                prime_app_rps: Dict[str, float] = json.load(json_file)
-            
+            # 获取各个primeApp的 rps负载能力
+            prime_app_rps: Dict[str, float] = self.prime_app_rps_watcher.load()
             # 用户请求到达各个cpNode 的到达率
-            # 从 JSON 文件读取字典 获取各个primeApp的 rps负载能力
-            with open('/home/wwz/ryu/ryu/app/network_awareness/cpn_node_rps.json', 'r') as json_file:
-                cpn_node_rps: Dict[str, float] = json.load(json_file)
+            cpn_node_rps: Dict[str, float] = self.cpn_node_rps_watcher.load()
+            if prime_app_rps is None or cpn_node_rps is None:
+                return self.global_forwarding_policy
 
             # 如果处理能力和请求到达率 数据和网络设置数据不符合证明这是旧的数据，
             if len(prime_app_rps) != self.setup.numberOfPrimeApps or len(cpn_node_rps) != self.setup.numberOfCPNodes :
                 return self.global_forwarding_policy
-            # 如果处理能力和请求到达率没有改变则不更新策略
-            if prime_app_rps == self.prime_app_rps and cpn_node_rps==self.cpn_node_rps:
-                return self.global_forwarding_policy
-            self.prime_app_rps = prime_app_rps
-            self.cpn_node_rps = cpn_node_rps
             prime_app_rps_value = np.array(list(prime_app_rps.values()))
             cpn_node_rps_value = np.array(list(cpn_node_rps.values()))
+            network_link_bw_array = self.setup.network_link_bw_state.to_numpy()
+            network_link_delay_array = self.setup.network_link_delay_state.to_numpy()
+
+            # 如果处理能力、请求到达率及网络状态与缓存的某次计算相同则直接使用缓存策略
+            cache_key = PolicyCache.make_key(prime_app_rps_value, cpn_node_rps_value,
+                                             network_link_bw_array, network_link_delay_array)
+            cached_policy = self.ot_policy_cache.get(cache_key)
+            if cached_policy is not None:
+                self.global_forwarding_policy = cached_policy
+                return cached_policy
 
             # 判断请求达到量 与 整网应用处理能力的关系
             # 请求达到量 < 整网应用处理能力
@@ -122,21 +125,15 @@ class CPNRoutingAlgo:
                 cpn_node_rps_value = cpn_node_rps_value/sum(cpn_node_rps_value)
 
                 # 计算代价矩阵
-                network_link_bw_array = self.setup.network_link_bw_state.to_numpy()
-                network_link_delay_array = self.setup.network_link_delay_state.to_numpy()
                 network_cost_array = (self.setup.app_api_data_in+self.setup.app_api_data_out)/network_link_bw_array + network_link_delay_array
                 # 为虚拟cpn添加代价行
                 new_row = np.zeros(shape=self.setup.numberOfPrimeApps,dtype=float)
                 network_cost_array = np.vstack([network_cost_array, new_row])
                 # 代价矩阵归一化
                 network_cost_array =  network_cost_array / np.max(network_cost_array)
-                # unsqueeze  升维度
-                T, u, v = self.sinkhorn(r=torch.from_numpy(cpn_node_rps_value).unsqueeze(dim=0), c=torch.from_numpy(prime_app_rps_value).unsqueeze(dim=0), 
-                                        reg=1e-2, M=torch.from_numpy(network_cost_array).unsqueeze(dim=0),num_iters=100)
-                result = T.squeeze(dim=0).numpy()
-                line_sum = np.sum(result, axis=1)
+                result = self._solve_ot(r=cpn_node_rps_value, c=prime_app_rps_value, M=network_cost_array, num_iters=100)
                 # 策略整理
-                forwarding_policy = result / line_sum[:, np.newaxis]
+                forwarding_policy = self._normalize_policy(result)
                 # 去除虚拟cpn的策略 即去除最后一行
                 forwarding_policy = forwarding_policy[:-1, :]
 
@@ -148,16 +145,12 @@ class CPNRoutingAlgo:
                 # 归一化请求达到率向量
                 cpn_node_rps_value = cpn_node_rps_value/sum(cpn_node_rps_value)
                 # 计算代价矩阵
-                network_link_bw_array = self.setup.network_link_bw_state.to_numpy()
-                network_link_delay_array = self.setup.network_link_delay_state.to_numpy()
                 network_cost_array = (self.setup.app_api_data_in+self.setup.app_api_data_out)/network_link_bw_array + network_link_delay_array
                 # 代价矩阵归一化
                 network_cost_array =  network_cost_array / np.max(network_cost_array)
-                T, u, v = self.sinkhorn(r=torch.from_numpy(cpn_node_rps_value).unsqueeze(dim=0), c=torch.from_numpy(prime_app_rps_value).unsqueeze(dim=0), 
-                                        reg=1e-2, M=torch.from_numpy(network_cost_array).unsqueeze(dim=0))
-                result = T.squeeze(dim=0).numpy()
-                line_sum = np.sum(result, axis=1)
-                forwarding_policy = result / line_sum[:, np.newaxis]
+                result = self._solve_ot(r=cpn_node_rps_value, c=prime_app_rps_value, M=network_cost_array)
+                forwarding_policy = self._normalize_policy(result)
+            self.ot_policy_cache.put(cache_key, forwarding_policy)
             self.global_forwarding_policy = forwarding_policy
             print(f"forwarding_policy shape: {forwarding_policy.shape}")
             return forwarding_policy
@@ -191,53 +184,88 @@ class CPNRoutingAlgo:
         else:
             return self.global_forwarding_policy
         
+    def _solve_ot(self, r: np.ndarray, c: np.ndarray, M: np.ndarray, reg=1e-2, num_iters=200)-> np.ndarray:
+        """
+        求解最优传输矩阵, 当代价矩阵和边缘分布相对上一次求解变化较小时, 使用上一次的对偶势热启动
+        """
+        f, g = None, None
+        if self.ot_warm_start is not None:
+            pre_r, pre_c, pre_M, pre_f, pre_g = self.ot_warm_start
+            if pre_M.shape == M.shape and \
+               self._relative_change(pre_M, M) < setting.SINKHORN_WARM_START_TOL and \
+               self._relative_change(pre_r, r) < setting.SINKHORN_WARM_START_TOL and \
+               self._relative_change(pre_c, c) < setting.SINKHORN_WARM_START_TOL:
+                f, g = pre_f, pre_g
+        T, f, g = self.sinkhorn(r=r, c=c, M=M, reg=reg, num_iters=num_iters, f=f, g=g)
+        self.ot_warm_start = (r, c, M, f, g)
+        return T
+
+    @staticmethod
+    def _normalize_policy(T: np.ndarray)-> np.ndarray:
+        """
+        按行归一化传输矩阵得到转发策略, 没有质量的行(请求到达率为0)使用均匀策略
+        """
+        line_sum = np.sum(T, axis=1)
+        empty = ~(line_sum > 0) | ~np.all(np.isfinite(T), axis=1)
+        policy = np.full(T.shape, 1.0 / T.shape[1])
+        policy[~empty] = T[~empty] / line_sum[~empty, np.newaxis]
+        return policy
+
     @staticmethod
-    def sinkhorn(r, c, M, reg=1e-3, error_thres=1e-8, num_iters=200):
-        # error_thres=1e-5 num_iters=100
-        """Batch sinkhorn iteration. See a blog post <https://kaizhao.net/blog/optimal-transport> (in Chinese) for explainations.
+    def _relative_change(pre: np.ndarray, now: np.ndarray)-> float:
+        return np.max(np.abs(now - pre)) / max(np.max(np.abs(pre)), 1e-12)
+
+    @staticmethod
+    def _logsumexp(a: np.ndarray, axis: int)-> np.ndarray:
+        a_max = np.max(a, axis=axis, keepdims=True)
+        a_max[~np.isfinite(a_max)] = 0
+        # 全为-inf(没有质量)的行/列结果为-inf
+        with np.errstate(divide='ignore'):
+            out = np.log(np.sum(np.exp(a - a_max), axis=axis, keepdims=True)) + a_max
+        return np.squeeze(out, axis=axis)
+
+    @staticmethod
+    def sinkhorn(r, c, M, reg=1e-3, error_thres=1e-8, num_iters=200, f=None, g=None,
+                 check_period=setting.SINKHORN_CHECK_PERIOD):
+        """Log-domain sinkhorn iteration. See a blog post <https://kaizhao.net/blog/optimal-transport> (in Chinese) for explainations.
+        r: (d1,) 源分布  c: (d2,) 目标分布  M: (d1, d2) 代价矩阵
+        f, g: 对偶势 (即 reg*log(u), reg*log(v)), 传入上一次的结果可热启动
+        check_period: 每隔 check_period 次迭代检查一次收敛误差
+        r或c中为0的项没有质量, 对应的对偶势为-inf, T中对应的行/列为0; r或c全为0时返回全0的T
+        return: T, f, g
         """
-        n, d1, d2 = M.shape
-        assert r.shape[0] == c.shape[0] == n and \
-            r.shape[1] == d1 and c.shape[1] == d2, \
-            'r.shape=%s, v=shape=%s, M.shape=%s' % (r.shape, c.shape, M.shape)
+        d1, d2 = M.shape
+        assert r.shape == (d1,) and c.shape == (d2,), \
+            'r.shape=%s, c.shape=%s, M.shape=%s' % (r.shape, c.shape, M.shape)
+        if not (np.any(r > 0) and np.any(c > 0)):
+            return np.zeros((d1, d2), dtype=float), np.zeros(d1, dtype=float), np.zeros(d2, dtype=float)
 
-        K = (-M / reg).exp()        # (n, d1, d2)
-        u = torch.ones_like(r) / d1 # (n, d1)
-        v = torch.ones_like(c) / d2 # (n, d2)
+        with np.errstate(divide='ignore'):
+            log_r = np.log(r)
+            log_c = np.log(c)
+        if f is None or g is None:
+            f = np.zeros(d1, dtype=float)
+            g = np.full(d2, -reg * np.log(d2), dtype=float)
+        # -M/reg 只需计算一次
+        neg_M = -M / reg
 
-        for _ in range(num_iters):
-            r0 = u
+        for i in range(num_iters):
             # u = r / K \cdot v
-            u = r / torch.einsum('ijk,ik->ij', [K, v])
+            f = reg * (log_r - CPNRoutingAlgo._logsumexp(neg_M + g[np.newaxis, :] / reg, axis=1))
             # v = c / K^T \cdot u
-            v = c / torch.einsum('ikj,ik->ij', [K, u])
+            g = reg * (log_c - CPNRoutingAlgo._logsumexp(neg_M + f[:, np.newaxis] / reg, axis=0))
 
-            err = (u - r0).abs().mean()
-            if err.item() < error_thres:
-                break
-        T = torch.einsum('ij,ik->ijk', [u, v]) * K
-        return T, u, v
+            # 列边缘在更新g后精确满足, 因此只需检查行边缘误差
+            if (i + 1) % check_period == 0:
+                row_sum = np.exp(CPNRoutingAlgo._logsumexp(neg_M + (f[:, np.newaxis] + g[np.newaxis, :]) / reg, axis=1))
+                err = np.abs(row_sum - r).mean()
+                if err < error_thres:
+                    break
+        T = np.exp(neg_M + (f[:, np.newaxis] + g[np.newaxis, :]) / reg)
+        return T, f, g
 
-    @staticmethod
-    def get_cpu_rate()-> np.array:
-        cpu_stats = []
-        # 使用subprocess运行docker stats命令，获取所有容器的CPU使用情况
-        cmd = 'docker stats --no-stream --format "{{.Name}}: {{.CPUPerc}}"'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-
-        # 分割输出按行解析
-        stats_output = result.stdout.strip().split('\n')
-
-        # 将每个容器的名称和CPU使用率存储在字典中
-        cpu_usage_dict = {}
-        for line in stats_output:
-            if line:
-                # 分割名称和CPU使用率
-                name, cpu_usage = line.split(': ')
-                if "mn.primeApp" in name:
-                    cpu_usage_dict[name] = cpu_usage
-        for i in range(len(cpu_usage_dict)):
-            name = f"mn.primeApp{i + 1}"
-            cpu_stats.append(float(cpu_usage_dict[name].replace("%", "")))
-        return cpu_stats
-    
\ No newline at end of file
+    def get_cpu_rate(self)-> np.array:
+        """
+        返回各个primeApp容器最近一次采样的CPU利用率(百分数)
+        """
+        return self.cpu_collector.latest_rates()
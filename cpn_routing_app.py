@@ -24,15 +24,17 @@ import shortest_forwarding
 from network_awareness import NetworkAwareness
 from shortest_forwarding import ShortestForwarding
 import setting
-from setting import SimNetworkSetUp, CPNRoutingAlgoName
+from setting import SimNetworkSetUp, CPNRoutingAlgoName, CPNSteeringMode
 import cpn_routing_algo
 from cpn_routing_algo import CPNRoutingAlgo
+from cpn_policy_engine import CPNPolicyEngine
+from cpn_service_registry import CPNService, CPNServiceRegistry, CPNServiceForwardingEntry
+from flow_reconciler import FlowReconciler, DesiredFlow
+from packet_classifier import ClassifiedPacket
 
 import time
 import numpy as np
 import pandas as pd
-import queue
-import random
 
 CONF = cfg.CONF
 
@@ -40,92 +42,6 @@ BROADCAST = 'ff:ff:ff:ff:ff:ff'
 TARGET_MAC_ADDRESS = '00:00:00:00:00:00'
 
 
-class CPNServiceForwardingEntry:
-    """
-    CPN服务条目 一条服务条目保存多个 待选服务实例ip+端口
-    cpn_service_id 暂且用 任播地址 表示
-    service_id: (anycast-ip:port)
-    """
-    def __init__(self, dpid: int, service_id: Tuple[str, int], type_of_transport_layer_proto: str = 'TCP', service_instance_list: List = [], forwarding_policy: List = [] , 
-                 setup: SimNetworkSetUp = None):
-        # 记录本服务路由条目所属的 dpid
-        self.dpid = dpid
-        # 记录本服务路由条目所属的 service_id
-        self.service_id = service_id
-        # 本服务路由条目所需的四层协议
-        self.type_of_transport_layer_proto: str = type_of_transport_layer_proto
-        # 列表元素是 （IP-Port） tuple 元组
-        self.service_instance_list: List[Tuple[str, int]] = service_instance_list
-        # 转发策略
-        self.forwarding_policy: List[float] = forwarding_policy
-        # 最新设置的服务转发ID （IP-Port） 
-        self.newest_service_instance_id: Tuple[str, int] = ()
-        # 标签位记录当前条目是否需要更新 默认需要更新
-        self.to_be_delivered_flag = True
-        # 记录此条目对应的交换机 Match类
-        self.match: ofproto_v1_3_parser.OFPMatch = None
-        # 记录此条目对应的交换机 反向条目
-        self.match_back: ofproto_v1_3_parser.OFPMatch = None
-        # 记录本路由条目上次由于 packet_in消息触发流表下发的时间
-        self.updated_by_packet_in_msg_time = None
-        # 全局设置类
-        self.setup = setup
-        # 转发队列
-        self.forwading_queue = queue.Queue()
-
-    def set_service_instance_list(self, service_instance_list):
-        self.service_instance_list = service_instance_list
-
-    def set_service_instance_list(self, forwarding_policy):
-        self.forwarding_policy = forwarding_policy
-    
-    def update_newest_service_instance_id(self, global_forwarding_policy):
-        """
-        更新服务路由条目中的服务实例id
-        routing_algo: 路由策略名称
-        policy_update: 是否重新计算路由策略, 默认不重新计算而是使用旧策略(cpn_routing_algo类实例在初始化的时候会初始化一次路由表, 只有CFN才需要每次更新都计算新得策略)
-        """
-        # 判断路由策略类型
-        policy_line_index  = self.dpid - self.setup.numberOfPrimeApps - 1
-        if np.array_equal(global_forwarding_policy[policy_line_index], self.forwarding_policy):
-            # 转发策略未更新
-            index = self.forwading_queue.get()
-            self.forwading_queue.put(index)
-        else:
-            # 转发策略更新
-            self.forwarding_policy = global_forwarding_policy[policy_line_index]
-            self.rouding_forwarding_policy(self.forwarding_policy)
-            index = self.forwading_queue.get()
-            self.forwading_queue.put(index)
-        print(f"dpid: {self.dpid} forwading_queue{self.forwading_queue.queue}")
-        self.newest_service_instance_id = self.service_instance_list[index]
-
-    def rouding_forwarding_policy(self, forwarding_policy):
-        """"
-        根据浮点转发策略生成整数转发列表
-        forwarding_policy: 本entry的转发策略
-        """
-        # 创建队列
-        q = queue.Queue()
-        n_service_instance = len(self.service_instance_list)
-        # 整数化转发策略
-        rouding_forwarding_policy = np.round(n_service_instance*forwarding_policy)
-        # 根据整数化策略生成转发队列
-        
-        while np.sum(rouding_forwarding_policy) >= 1e-6:
-            temp_list = []
-            for i in range(n_service_instance):
-                if rouding_forwarding_policy[i] >=1 :
-                    rouding_forwarding_policy[i] -= 1
-                    temp_list.append(i)
-            # 打乱temp_list
-            random.shuffle(temp_list)
-            for item in temp_list:
-                q.put(item)
-        self.forwading_queue = q
-        return q
-
-        
 class CPNRouting(app_manager.RyuApp):
     """
         CPN 路由应用, 在靠近用户集群侧的地方放置交换机, 将针对同质化应用的请求, 依概率转发
@@ -154,70 +70,92 @@ class CPNRouting(app_manager.RyuApp):
         self.name = 'cpn_routing'
         self.network_awareness: NetworkAwareness = lookup_service_brick('awareness')
         self.shortest_forwarding: ShortestForwarding = lookup_service_brick('shortest_forwarding')
-        # CPNAllForwardingTable
-        # key: dpid 第一次以交换机id为键
-        # value: Dict[key2, value2] 服务路由条目字典为键值
-        # key2: service_id(anycast_ip: port) 服务路由条目字典以服务id为键值
-        # value2: CPNForwardingServiceEntry 以服务转发条目类为键值
-        self.cpn_all_forwarding_table: Dict[int, Dict[Tuple[str, int], CPNServiceForwardingEntry]] = {}
+        # 网络设置类
+        self.sim_net_setting = SimNetworkSetUp()
 
-        # key: service_id(anycast_ip:port), value: 该IP绑定的应用描述
-        self.service_id_dict: Dict[Tuple[str, int], str] = {}
+        # CPN任播服务注册表
+        # services: service_id(anycast_ip: port) ——> CPNService 服务实例集合与策略矩阵
+        # entries: (dpid, service_id) ——> CPNServiceForwardingEntry 服务路由条目
+        self.cpn_service_registry = CPNServiceRegistry(setup=self.sim_net_setting)
 
         # 记录交换机维护的CPNServiceID 列表 用于定期更新路由条目
         # key: dpid
         # value: Set[service_id]
         self.switch_maintained_cpn_service: Dict[int, Set[Tuple[str, int]]] = {}
 
-        # 网络设置类
-        self.sim_net_setting = SimNetworkSetUp()
-
         # cpn 算法类实例 会首先初始策略
         self.cpn_routing_algo = CPNRoutingAlgo(setup=self.sim_net_setting, routing_algo_name=setting.global_cpn_routing_algo_choice)
+        # 后台策略引擎 周期性计算策略并发布快照, packet_in 处理只读取最新快照
+        self.policy_engine = CPNPolicyEngine(self.cpn_routing_algo)
+        self.policy_engine.start()
+        # CFN算法需要应用容器的CPU利用率 周期性采样cgroup
+        if setting.global_cpn_routing_algo_choice == CPNRoutingAlgoName.CFN_DYNAMIC_FEEDBACK_ALGO:
+            self.cpu_telemetry_thread = hub.spawn(self._cpu_telemetry_sample)
 
         # 初始化实验参数
         self.init_forwarding_table_thread = hub.spawn(self._init_testing_setting)
-        # 周期性更新CPN策略
-        self.cpn_switch_policy_update_thread = hub.spawn(self._cpn_switch_policy_update)
+        # 周期性更新CPN策略 按连接分配时已建立的连接保持不变, 新连接直接按最新策略选取实例
+        # 组表模式只在策略变化时修改组表桶权重
+        if setting.global_cpn_steering_mode == CPNSteeringMode.SERVICE:
+            self.cpn_switch_policy_update_thread = hub.spawn(self._cpn_switch_policy_update)
+        elif setting.global_cpn_steering_mode == CPNSteeringMode.GROUP:
+            self.cpn_group_policy_update_thread = hub.spawn(self._cpn_group_policy_update)
+        # 主动下发模式 预先下发任播改写流表(按连接分配需要由首包选取实例, 不主动下发)
+        if setting.PROACTIVE_FLOW_INSTALL and setting.global_cpn_steering_mode != CPNSteeringMode.CONNECTION:
+            self.cpn_proactive_install_thread = hub.spawn(self._cpn_proactive_install)
+        # 周期性更新时只下发与已下发流表不同的流表项
+        self.flow_reconciler = FlowReconciler(flags=ofproto_v1_3.OFPFF_SEND_FLOW_REM,
+                                              cookie=setting.FlowCookie.CPN.value)
+        # 主动下发的任播流表 单独记录, 与周期性策略更新的每轮统计互不影响
+        self.proactive_reconciler = FlowReconciler(flags=ofproto_v1_3.OFPFF_SEND_FLOW_REM,
+                                                   cookie=setting.FlowCookie.CPN.value)
+        # 组表模式 各交换机下一个可分配的组id
+        self.next_group_id: Dict[int, int] = {}
         # 记录各个目的ip被更新到的次数
-        self.record_service_instance_update_times = {item:0 for item in self.sim_net_setting.prime_apps_ip_list}
+        self.record_service_instance_update_times: Dict[str, int] = {item:0 for item in self.sim_net_setting.prime_apps_ip_list}
+        # 目的地址为任播IP的ARP与IPv4报文由本应用处理, 优先于 shortest_forwarding
+        self.network_awareness.packet_in_dispatcher.register(ether_types.ETH_TYPE_ARP, self._packet_in_handler,
+                                                             accept=self.is_cpn_packet, priority=1)
+        self.network_awareness.packet_in_dispatcher.register(ether_types.ETH_TYPE_IP, self._packet_in_handler,
+                                                             accept=self.is_cpn_packet, priority=1)
     
     def _init_testing_setting(self):
         # 等待网络感知模块等进行网络的初始化
         time.sleep(15)
-        # 添加任播IP地址 当前只测试一个应用
-        if len(self.service_id_dict) == 0:
-            self.service_id_dict = self.sim_net_setting.service_id_dict
         flag = True
         while flag:
-            if len(self.cpn_all_forwarding_table) == 0 and self.network_awareness.graph.number_of_nodes() > 0:
-                # 设置转发表
-                switchB_dpid_list = self.sim_net_setting.switchB_dpid_list
+            if len(self.cpn_service_registry) == 0 and self.network_awareness.graph.number_of_nodes() > 0:
+                # 注册实验设置中的任播服务 为每个服务的接入交换机创建服务路由条目
                 print(f"network_awareness.graph.nodes{self.network_awareness.graph.nodes()}")
-                print(f"switchB_dpid_list: {switchB_dpid_list}")
-                for dpid in switchB_dpid_list:
-                    for service_id in self.service_id_dict.keys():
-                        # 实例化CPNServiceForwardingEntry
-                        service_instance_list = []
-                        for item in self.sim_net_setting.prime_apps_ip_list:
-                            service_instance_list.append((item, self.sim_net_setting.prime_app_instance_tcp_port))
-                        # 创建服务路由条目，设置算法实例，协议类型，所属服务id等
-                        entry=CPNServiceForwardingEntry(dpid=dpid,
-                                                        service_id=service_id,
-                                                        type_of_transport_layer_proto='TCP', 
-                                                        service_instance_list=service_instance_list,
-                                                        setup=self.sim_net_setting)
-                        entry.update_newest_service_instance_id(self.cpn_routing_algo.global_forwarding_policy)
-                        self.cpn_all_forwarding_table[dpid] = {service_id: entry}
-                # 初始化switch_maintained_cpn_service
-                # for dpid in self.sim_net_setting.switchB_dpid_list:
-                #     self.switch_maintained_cpn_service[dpid] = set()
-                #     self.switch_maintained_cpn_service[dpid].add(list(self.sim_net_setting.service_id_dict.keys())[0])
-
+                print(f"switchB_dpid_list: {self.sim_net_setting.switchB_dpid_list}")
+                self.cpn_service_registry.register_setup_services(self.sim_net_setting)
+                for entry in self.cpn_service_registry.entries.values():
+                    entry.update_newest_service_instance_id(self.get_service_policy(entry.service))
                 flag = False
             else:
                 hub.sleep(20)
 
+    @property
+    def service_id_dict(self) -> Dict[Tuple[str, int], str]:
+        # key: service_id(anycast_ip:port), value: 该IP绑定的应用描述
+        return self.cpn_service_registry.service_id_dict
+
+    def get_service_policy(self, service: CPNService):
+        """
+        服务的转发策略: 服务设置了独立的策略矩阵时使用该矩阵, 否则使用策略引擎发布的最新全局策略
+        """
+        if service is None or service.policy is None:
+            return self.policy_engine.latest().policy
+        return service.policy
+
+    def record_service_instance_update(self, ip: str):
+        self.record_service_instance_update_times[ip] = self.record_service_instance_update_times.get(ip, 0) + 1
+
+    def _cpu_telemetry_sample(self):
+        while True:
+            self.cpn_routing_algo.cpu_collector.sample()
+            hub.sleep(setting.CPU_TELEMETRY_PERIOD)
+
     def _cpn_switch_policy_update(self):
         # 等待网络感知模块等进行网络的初始化
         time.sleep(20)
@@ -226,115 +164,245 @@ class CPNRouting(app_manager.RyuApp):
             if len(self.switch_maintained_cpn_service) == 0:
                 hub.sleep(10)
                 continue
-            # 更新路由策略
-            global_forwarding_policy = self.cpn_routing_algo.update_forwarding_policy()
-            # print(f"global_forwarding_policy update: {global_forwarding_policy}")
+            self.flow_reconciler.begin_tick()
+            batch = self.shortest_forwarding.flow_programmer.new_batch()
             for dpid in self.switch_maintained_cpn_service.keys():
-            # for dpid in list(self.switch_maintained_cpn_service.keys()):
+                datapath = self.shortest_forwarding.datapaths.get(dpid)
+                if datapath is None:
+                    continue
                 # 遍历交换机维护的service_id
-                # 如果没有维护则返回
                 for service_id in self.switch_maintained_cpn_service[dpid]:
-                    old_time= self.cpn_all_forwarding_table[dpid][service_id].updated_by_packet_in_msg_time
-                    new_time = time.time()
-                    # 路由表不断更新的维持时间不超过 路由条目的存续时间
-                    # if (new_time - old_time) > setting.FlowEntry_IDLET_IMEOUT:
-                    #     continue
-                    if self.cpn_all_forwarding_table[dpid][service_id].type_of_transport_layer_proto == 'TCP':
-                        # 更新转发地址
-                        self.cpn_all_forwarding_table[dpid][service_id].update_newest_service_instance_id(global_forwarding_policy)
-                        dst_ip_port = self.cpn_all_forwarding_table[dpid][service_id].newest_service_instance_id
-                        self.record_service_instance_update_times[dst_ip_port[0]] +=1
-                        # 如果更新的地址一样则不重新下发流表
-                        match_back: ofproto_v1_3_parser.OFPMatch = self.cpn_all_forwarding_table[dpid][service_id].match_back
-                        if (match_back is None) or (dst_ip_port[0] ==  match_back['ipv4_src']):
-                            continue
-                        
-                        eth_dst = None
-                        # 查找目的IP地址的目的MAC地址
-                        for ip_mac_item in self.network_awareness.access_table.values():
-                            if ip_mac_item[0] == dst_ip_port[0]:
-                                eth_dst = ip_mac_item[1]
-                        old_match: ofproto_v1_3_parser.OFPMatch = self.cpn_all_forwarding_table[dpid][service_id].match
-                        in_port = old_match['in_port']
-                        ipv4_src = old_match['ipv4_src']
-                        ipv4_dst = old_match['ipv4_dst']
-                        tcp_dst = old_match['tcp_dst']
-                        output = self.get_output_port(dpid=dpid, inport=in_port, ip_src=ipv4_src, ip_dst=dst_ip_port[0])
-                                
-                        # 生成action match action_back match_back
-                        match = ofproto_v1_3_parser.OFPMatch(in_port=in_port,
-                                                eth_type=ether.ETH_TYPE_IP,
-                                                ip_proto=inet.IPPROTO_TCP,
-                                                ipv4_src=ipv4_src,
-                                                ipv4_dst=ipv4_dst,
-                                                # tcp_src=pkt_tcp.src_port,
-                                                tcp_dst=tcp_dst)
-                        actions = [ofproto_v1_3_parser.OFPActionSetField(eth_dst=eth_dst),
-                                    ofproto_v1_3_parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
-                                    ofproto_v1_3_parser.OFPActionSetField(tcp_dst=dst_ip_port[1]),
-                                    ofproto_v1_3_parser.OFPActionOutput(output)]
-                        match_back = ofproto_v1_3_parser.OFPMatch(eth_type=ether.ETH_TYPE_IP,
-                                                    ip_proto=inet.IPPROTO_TCP,
-                                                    ipv4_src=dst_ip_port[0],
-                                                    ipv4_dst=ipv4_src,
-                                                    tcp_src=dst_ip_port[1]
-                                                    # tcp_dst=pkt_tcp.src_port
-                                                    )
-                        actions_back = [ofproto_v1_3_parser.OFPActionSetField(eth_src=setting.CPN_SERICE_REQUEST_MAC),
-                                        ofproto_v1_3_parser.OFPActionSetField(ipv4_src=ipv4_dst),
-                                        ofproto_v1_3_parser.OFPActionOutput(in_port)]
-                    elif self.cpn_all_forwarding_table[dpid][service_id].type_of_transport_layer_proto == 'UDP':
-                        # 更新路由策略
-                        global_forwarding_policy = self.cpn_routing_algo.update_forwarding_policy()
-                        # 更新转发地址
-                        self.cpn_all_forwarding_table[dpid][service_id].update_newest_service_instance_id(global_forwarding_policy)
-                        dst_ip_port = self.cpn_all_forwarding_table[dpid][service_id].newest_service_instance_id
-                        # 如果更新的地址一样则不重新下发流表
-                        match_back: ofproto_v1_3_parser.OFPMatch = self.cpn_all_forwarding_table[dpid][service_id].match_back
-                        if dst_ip_port[0] ==  match_back['ipv4_src']:
-                            continue
-                        eth_dst = None
-                        # 查找目的IP地址的目的MAC地址
-                        for ip_mac_item in self.network_awareness.access_table.values():
-                            if ip_mac_item[0] == dst_ip_port[0]:
-                                eth_dst = ip_mac_item[1]
-                        old_match: ofproto_v1_3_parser.OFPMatch = self.cpn_all_forwarding_table[dpid][service_id].match
-                        in_port = old_match['in_port']
-                        ipv4_src = old_match['ipv4_src']
-                        ipv4_dst = old_match['ipv4_dst']
-                        udp_dst = old_match['udp_dst']
-                        output = self.get_output_port(dpid=dpid, inport=in_port, ip_src=ipv4_src, ip_dst=dst_ip_port[0])
-                        match = ofproto_v1_3_parser.OFPMatch(in_port=in_port,
-                                                eth_type=ether.ETH_TYPE_IP,
-                                                ip_proto=inet.IPPROTO_UDP,
-                                                ipv4_src=ipv4_src,
-                                                ipv4_dst=ipv4_dst,
-                                                udp_dst=udp_dst)
-                        actions = [ofproto_v1_3_parser.OFPActionSetField(eth_dst=eth_dst),
-                                    ofproto_v1_3_parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
-                                    ofproto_v1_3_parser.OFPActionSetField(tcp_dst=dst_ip_port[1]),
-                                    ofproto_v1_3_parser.OFPActionOutput(output)]
-                        match_back = ofproto_v1_3_parser.OFPMatch(eth_type=ether.ETH_TYPE_IP,
-                                                    ip_proto=inet.IPPROTO_UDP,
-                                                    ipv4_src=dst_ip_port[0],
-                                                    ipv4_dst=ipv4_src,
-                                                    udp_src=dst_ip_port[1]
-                                                    # tcp_dst=pkt_tcp.src_port
-                                                    )
-                        actions_back = [ofproto_v1_3_parser.OFPActionSetField(eth_src=setting.CPN_SERICE_REQUEST_MAC),
-                                        ofproto_v1_3_parser.OFPActionSetField(ipv4_src=ipv4_dst),
-                                        ofproto_v1_3_parser.OFPActionOutput(in_port)]
-                    # 发送修改Mod
-                    # priority 高于默认优先级 0x8000
-                    self.add_flow(self.shortest_forwarding.datapaths[dpid], match=match, actions=actions,
-                            idle_timeout=setting.FlowEntry_IDLET_IMEOUT, hard_timeout=setting.FlowEntry_HARD_TIMOUT, priority=0x9000)
-                    self.add_flow(self.shortest_forwarding.datapaths[dpid], match=match_back, actions=actions_back,
-                            idle_timeout=setting.FlowEntry_IDLET_IMEOUT, hard_timeout=setting.FlowEntry_HARD_TIMOUT, priority=0x9000)
+                    entry = self.cpn_service_registry.get_entry(dpid, service_id)
+                    # 服务已注销或尚未由packet_in消息下发过流表
+                    if entry is None or entry.match is None:
+                        continue
+                    # 读取服务的最新策略 更新转发地址
+                    entry.update_newest_service_instance_id(self.get_service_policy(entry.service))
+                    dst_ip_port = entry.newest_service_instance_id
+                    if entry.type_of_transport_layer_proto == 'TCP':
+                        self.record_service_instance_update(dst_ip_port[0])
+                    flows = self.build_service_flows(entry, dst_ip_port)
+                    # 只下发与已下发状态不同的流表项: 地址与端口改写都未变化时不发送, 正向流表匹配域不变只修改动作,
+                    # 回程流表在新实例上尚未存在时才添加
+                    self.flow_reconciler.reconcile(datapath, flows, batch)
+                    entry.match_back = flows[1].match
+            if len(batch):
+                self.shortest_forwarding.flow_programmer.commit(batch)
+            self.logger.debug("cpn policy update: %d flow mods sent, %d avoided",
+                              self.flow_reconciler.mods_sent, self.flow_reconciler.mods_avoided)
             # 周期性更新策略实现策略路由机制
             hub.sleep(setting.CPN_POCLICY_UPDATE_PERIOD)
             # 打印统计信息
             # print(f"record_service_instance_update_times:{self.record_service_instance_update_times}")
 
+    def build_service_flows(self, entry: CPNServiceForwardingEntry, dst_ip_port: Tuple[str, int]) -> List[DesiredFlow]:
+        """
+        按服务条目记录的正向匹配域与新的目的服务实例 生成期望的正向与回程流表项
+        """
+        match: ofproto_v1_3_parser.OFPMatch = entry.match
+        in_port = match['in_port']
+        ipv4_src = match['ipv4_src']
+        ipv4_dst = match['ipv4_dst']
+        if entry.type_of_transport_layer_proto == 'TCP':
+            ip_proto, src_field, dst_field = inet.IPPROTO_TCP, 'tcp_src', 'tcp_dst'
+        else:
+            ip_proto, src_field, dst_field = inet.IPPROTO_UDP, 'udp_src', 'udp_dst'
+        # 查找目的IP地址的目的MAC地址
+        eth_dst = self.network_awareness.get_host_mac(dst_ip_port[0])
+        output = self.get_output_port(dpid=entry.dpid, inport=in_port, ip_src=ipv4_src, ip_dst=dst_ip_port[0])
+        actions = [ofproto_v1_3_parser.OFPActionSetField(eth_dst=eth_dst),
+                   ofproto_v1_3_parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
+                   ofproto_v1_3_parser.OFPActionSetField(**{dst_field: dst_ip_port[1]}),
+                   ofproto_v1_3_parser.OFPActionOutput(output)]
+        match_back = ofproto_v1_3_parser.OFPMatch(**{'eth_type': ether.ETH_TYPE_IP,
+                                                     'ip_proto': ip_proto,
+                                                     'ipv4_src': dst_ip_port[0],
+                                                     'ipv4_dst': ipv4_src,
+                                                     src_field: dst_ip_port[1]})
+        actions_back = [ofproto_v1_3_parser.OFPActionSetField(eth_src=setting.CPN_SERICE_REQUEST_MAC),
+                        ofproto_v1_3_parser.OFPActionSetField(ipv4_src=ipv4_dst),
+                        ofproto_v1_3_parser.OFPActionOutput(in_port)]
+        # priority 高于默认优先级 0x8000
+        return [DesiredFlow(0x9000, match, actions, setting.FlowEntry_IDLET_IMEOUT, setting.FlowEntry_HARD_TIMOUT),
+                DesiredFlow(0x9000, match_back, actions_back, setting.FlowEntry_IDLET_IMEOUT, setting.FlowEntry_HARD_TIMOUT)]
+
+    def _cpn_group_policy_update(self):
+        """
+        组表模式: 策略快照或服务独立策略的版本变化时, 只对桶权重发生变化的组表发送一次 OFPGroupMod MODIFY
+        组表安装时尚未学习到位置的服务实例, 可以计算出端口后重新生成桶并修改组表
+        """
+        version = None
+        while True:
+            snapshot = self.policy_engine.latest()
+            policy_changed = (snapshot.version, self.cpn_service_registry.policy_version) != version
+            version = (snapshot.version, self.cpn_service_registry.policy_version)
+            for (dpid, service_id), entry in list(self.cpn_service_registry.entries.items()):
+                if entry.group_id is None:
+                    continue
+                datapath = self.shortest_forwarding.datapaths.get(dpid)
+                if datapath is None:
+                    continue
+                buckets_changed = False
+                if len(entry.group_bucket_actions) < len(entry.service_instance_list):
+                    bucket_actions = self.build_group_buckets(datapath, entry)
+                    if len(bucket_actions) > len(entry.group_bucket_actions):
+                        entry.group_bucket_actions = bucket_actions
+                        buckets_changed = True
+                if not policy_changed and not buckets_changed:
+                    continue
+                weights = self.get_group_weights(entry)
+                if buckets_changed or not np.array_equal(weights, entry.group_weights):
+                    self.send_group_mod(datapath, entry, weights, datapath.ofproto.OFPGC_MODIFY)
+            hub.sleep(setting.CPN_POLICY_ENGINE_PERIOD)
+
+    def install_service_group(self, datapath, entry: CPNServiceForwardingEntry, in_port, ip_src) -> bool:
+        """
+        在交换机上安装服务条目的SELECT组表, 每个服务实例一个桶: 改写 eth_dst/ipv4_dst/tcp_dst 后转发到通往该实例的端口
+        尚未学习到位置的服务实例不加入桶(由 _cpn_group_policy_update 在可以计算出端口后加入), 没有可用的桶时返回False
+        """
+        entry.group_in_port, entry.group_ip_src = in_port, ip_src
+        bucket_actions = self.build_group_buckets(datapath, entry)
+        if not bucket_actions:
+            return False
+        # 组id不随交换机重新连接而复用, 避免与交换机上残留的组表冲突
+        entry.group_id = self.next_group_id.get(datapath.id, 1)
+        self.next_group_id[datapath.id] = entry.group_id + 1
+        entry.group_bucket_actions = bucket_actions
+        self.send_group_mod(datapath, entry, self.get_group_weights(entry), datapath.ofproto.OFPGC_ADD)
+        return True
+
+    def build_group_buckets(self, datapath, entry: CPNServiceForwardingEntry) -> List[Tuple[int, List]]:
+        """
+        服务条目组表的桶: (服务实例下标, 动作列表), 跳过尚未学习到MAC或出端口的服务实例
+        """
+        parser = datapath.ofproto_parser
+        bucket_actions = []
+        for index, (instance_ip, instance_port) in enumerate(entry.service_instance_list):
+            eth_dst = self.network_awareness.get_host_mac(instance_ip)
+            output = self.get_instance_output_port(datapath.id, instance_ip,
+                                                   inport=entry.group_in_port, ip_src=entry.group_ip_src)
+            if eth_dst is None or output is None:
+                continue
+            bucket_actions.append((index, [parser.OFPActionSetField(eth_dst=eth_dst),
+                                           parser.OFPActionSetField(ipv4_dst=instance_ip),
+                                           parser.OFPActionSetField(tcp_dst=instance_port),
+                                           parser.OFPActionOutput(output)]))
+        return bucket_actions
+
+    def get_group_weights(self, entry: CPNServiceForwardingEntry) -> np.ndarray:
+        """
+        按服务策略计算桶权重; 已加入桶的实例权重全为0时(SELECT组表没有可选的桶会丢弃所有报文)
+        保留上一次下发的权重, 首次安装时各桶权重相同
+        """
+        weights = entry.get_bucket_weights(self.get_service_policy(entry.service))
+        if any(weights[index] > 0 for index, _ in entry.group_bucket_actions):
+            return weights
+        if entry.group_weights is not None:
+            return entry.group_weights
+        return np.ones(len(entry.service_instance_list), dtype=int)
+
+    def _cpn_proactive_install(self):
+        while True:
+            hub.sleep(setting.CPN_POCLICY_UPDATE_PERIOD)
+            self.cpn_proactive_install()
+
+    def cpn_proactive_install(self):
+        """
+            主动下发任播改写流表, 匹配域不含客户端地址与入端口:
+            - 正向: 匹配 任播IP + 服务端口, 组表模式转交SELECT组表, 按服务分配时改写为本轮按策略选取的服务实例
+            - 回程: 每个(服务实例, 接入交换机上的客户端)一条, 将源地址改写为任播地址后输出到客户端端口
+            服务实例的出端口来自 shortest_forwarding 主动下发的目的地址流表, 尚未计算时跳过该实例
+            每个交换机汇总全部服务的期望流表后一次调和, 删除已离开的客户端/已注销服务的流表项
+        """
+        self.proactive_reconciler.begin_tick()
+        batch = self.shortest_forwarding.flow_programmer.new_batch()
+        prime_apps = set(self.sim_net_setting.prime_apps_ip_list)
+        priority = setting.CPN_PROACTIVE_FLOW_PRIORITY
+        # dpid ——> 该交换机的全部期望流表
+        desired_flows: Dict[int, List[DesiredFlow]] = {}
+        for (dpid, service_id), entry in list(self.cpn_service_registry.entries.items()):
+            datapath = self.shortest_forwarding.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            parser = datapath.ofproto_parser
+            if entry.type_of_transport_layer_proto == 'TCP':
+                ip_proto, src_field, dst_field = inet.IPPROTO_TCP, 'tcp_src', 'tcp_dst'
+            else:
+                ip_proto, src_field, dst_field = inet.IPPROTO_UDP, 'udp_src', 'udp_dst'
+            clients = [(ip, port) for (sw, port), (ip, mac) in self.network_awareness.access_table.items()
+                       if sw == dpid and ip not in prime_apps]
+            flows = desired_flows.setdefault(dpid, [])
+            # 回程流表
+            for instance_ip, instance_port in entry.service_instance_list:
+                for client_ip, client_port in clients:
+                    match_back = parser.OFPMatch(**{'eth_type': ether.ETH_TYPE_IP,
+                                                    'ip_proto': ip_proto,
+                                                    'ipv4_src': instance_ip,
+                                                    'ipv4_dst': client_ip,
+                                                    src_field: instance_port})
+                    actions_back = [parser.OFPActionSetField(eth_src=setting.CPN_SERICE_REQUEST_MAC),
+                                    parser.OFPActionSetField(ipv4_src=service_id[0]),
+                                    parser.OFPActionSetField(**{src_field: service_id[1]}),
+                                    parser.OFPActionOutput(client_port)]
+                    flows.append(DesiredFlow(priority, match_back, actions_back))
+            # 正向流表
+            match = parser.OFPMatch(**{'eth_type': ether.ETH_TYPE_IP,
+                                       'ip_proto': ip_proto,
+                                       'ipv4_dst': service_id[0],
+                                       dst_field: service_id[1]})
+            actions = None
+            if setting.global_cpn_steering_mode == CPNSteeringMode.GROUP and ip_proto == inet.IPPROTO_TCP:
+                if entry.group_id is not None or self.install_service_group(datapath, entry, None, None):
+                    actions = [parser.OFPActionGroup(entry.group_id)]
+            else:
+                entry.update_newest_service_instance_id(self.get_service_policy(entry.service))
+                dst_ip_port = entry.newest_service_instance_id
+                eth_dst = self.network_awareness.get_host_mac(dst_ip_port[0])
+                output = self.get_instance_output_port(dpid, dst_ip_port[0])
+                if eth_dst is not None and output is not None:
+                    actions = [parser.OFPActionSetField(eth_dst=eth_dst),
+                               parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
+                               parser.OFPActionSetField(**{dst_field: dst_ip_port[1]}),
+                               parser.OFPActionOutput(output)]
+            if actions is not None:
+                flows.append(DesiredFlow(priority, match, actions))
+            else:
+                # 本轮无法计算出端口时保留已下发的正向流表项, 不因remove_stale被删除
+                key = self.proactive_reconciler.match_key(priority, match)
+                installed = self.proactive_reconciler.installed_flows.get(dpid, {}).get(key)
+                if installed is not None:
+                    flows.append(installed)
+        for dpid in set(desired_flows) | set(self.proactive_reconciler.installed):
+            datapath = self.shortest_forwarding.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            self.proactive_reconciler.reconcile(datapath, desired_flows.get(dpid, []), batch, remove_stale=True)
+        if len(batch):
+            self.shortest_forwarding.flow_programmer.commit(batch)
+        self.logger.debug("cpn proactive install: %d flow mods sent, %d avoided",
+                          self.proactive_reconciler.mods_sent, self.proactive_reconciler.mods_avoided)
+
+    def get_instance_output_port(self, dpid, instance_ip, inport=None, ip_src=None):
+        """
+            交换机dpid通往服务实例的出端口: 优先使用主动下发的目的地址流表, 否则按客户端入端口计算路径
+        """
+        output = self.shortest_forwarding.proactive_port(dpid, instance_ip)
+        if output is None and inport is not None:
+            output = self.get_output_port(dpid=dpid, inport=inport, ip_src=ip_src, ip_dst=instance_ip)
+        return output
+
+    def send_group_mod(self, datapath, entry: CPNServiceForwardingEntry, weights, command):
+        """
+        按桶权重下发服务条目的SELECT组表 command: OFPGC_ADD / OFPGC_MODIFY
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        buckets = [parser.OFPBucket(weight=int(weights[index]), watch_port=ofproto.OFPP_ANY,
+                                    watch_group=ofproto.OFPG_ANY, actions=actions)
+                   for index, actions in entry.group_bucket_actions]
+        datapath.send_msg(parser.OFPGroupMod(datapath, command, ofproto.OFPGT_SELECT, entry.group_id, buckets))
+        entry.group_weights = weights
+
     def add_flow(self, datapath, priority, match, actions, idle_timeout, hard_timeout, 
                  buffer_id=None):
         ofproto = datapath.ofproto
@@ -344,6 +412,7 @@ class CPNRouting(app_manager.RyuApp):
                                              actions)]
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath,
+                                    cookie=setting.FlowCookie.CPN.value,
                                     idle_timeout=idle_timeout,
                                     hard_timeout = hard_timeout,
                                     buffer_id=buffer_id,
@@ -353,6 +422,7 @@ class CPNRouting(app_manager.RyuApp):
                                     instructions=inst)
         else:
             mod = parser.OFPFlowMod(datapath=datapath,
+                                    cookie=setting.FlowCookie.CPN.value,
                                     idle_timeout=idle_timeout,
                                     hard_timeout = hard_timeout,
                                     priority=priority,
@@ -362,6 +432,22 @@ class CPNRouting(app_manager.RyuApp):
         datapath.send_msg(mod)
 
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def _state_change_handler(self, ev):
+        """
+        交换机断开连接时清除该交换机的已下发流表与组表记录
+        """
+        dpid = ev.datapath.id
+        if dpid is None:
+            return
+        self.flow_reconciler.forget_datapath(dpid)
+        self.proactive_reconciler.forget_datapath(dpid)
+        # 组表随交换机重新连接可能已不存在, 重新安装; 连接流表已随交换机断开失效, 释放固定的连接
+        for (entry_dpid, service_id), entry in self.cpn_service_registry.entries.items():
+            if entry_dpid == dpid:
+                entry.reset_group()
+                entry.connections.clear()
+
     @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
     def flow_removed_handler(self, ev):
         """
@@ -370,29 +456,28 @@ class CPNRouting(app_manager.RyuApp):
         msg = ev.msg
         dp = msg.datapath
         match: ofproto_v1_3_parser.OFPMatch = msg.match
+        self.flow_reconciler.forget(dp.id, msg.priority, match)
+        self.proactive_reconciler.forget(dp.id, msg.priority, match)
+        # 主动下发的流表项不对应packet_in下发的服务条目与连接
+        if msg.priority == setting.CPN_PROACTIVE_FLOW_PRIORITY:
+            return
         if 'ipv4_dst' in match:
-            if 'tcp_dst' in match:
-                service_id = (str(match['ipv4_dst']), match['tcp_dst'])
-                if  dp.id in self.cpn_all_forwarding_table.keys() and \
-                    service_id in self.cpn_all_forwarding_table[dp.id].keys() and \
-                    isinstance(self.cpn_all_forwarding_table[dp.id][service_id].match, ofproto_v1_3_parser.OFPMatch) and \
-                    self.cpn_all_forwarding_table[dp.id][service_id].match['in_port'] == match['in_port'] and \
-                    self.cpn_all_forwarding_table[dp.id][service_id].match['eth_type'] == match['eth_type'] and \
-                    self.cpn_all_forwarding_table[dp.id][service_id].match['ip_proto'] == match['ip_proto']:
-
-                    self.cpn_all_forwarding_table[dp.id][service_id].to_be_delivered_flag = True
-                else:
+            if 'tcp_src' in match and 'tcp_dst' in match:
+                # 按连接分配的正向流表项 空闲超时后释放该连接
+                entry = self.cpn_service_registry.get_entry(dp.id, (str(match['ipv4_dst']), match['tcp_dst']))
+                if entry is None:
                     return
-            elif 'udp_dst' in match:
-                service_id = (str(match['ipv4_dst']), match['udp_dst'])
-                if  dp.id in self.cpn_all_forwarding_table.keys() and \
-                    service_id in self.cpn_all_forwarding_table[dp.id].keys() and \
-                    isinstance(self.cpn_all_forwarding_table[dp.id][service_id].match, ofproto_v1_3_parser.OFPMatch) and \
-                    self.cpn_all_forwarding_table[dp.id][service_id].match['in_port'] == match['in_port'] and \
-                    self.cpn_all_forwarding_table[dp.id][service_id].match['eth_type'] == match['eth_type'] and \
-                    self.cpn_all_forwarding_table[dp.id][service_id].match['ip_proto'] == match['ip_proto']:
-
-                    self.cpn_all_forwarding_table[dp.id][service_id].to_be_delivered_flag = True
+                entry.release_connection((str(match['ipv4_src']), match['tcp_src']))
+            elif 'tcp_dst' in match or 'udp_dst' in match:
+                port = match['tcp_dst'] if 'tcp_dst' in match else match['udp_dst']
+                entry = self.cpn_service_registry.get_entry(dp.id, (str(match['ipv4_dst']), port))
+                if  entry is not None and \
+                    isinstance(entry.match, ofproto_v1_3_parser.OFPMatch) and \
+                    entry.match['in_port'] == match['in_port'] and \
+                    entry.match['eth_type'] == match['eth_type'] and \
+                    entry.match['ip_proto'] == match['ip_proto']:
+
+                    entry.to_be_delivered_flag = True
                 else:
                     return
         else:
@@ -408,29 +493,31 @@ class CPNRouting(app_manager.RyuApp):
                             msg.idle_timeout, msg.hard_timeout,
                             msg.packet_count, msg.byte_count, msg.match)
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def _packet_in_handler(self, ev):
+    def is_cpn_packet(self, classified: ClassifiedPacket) -> bool:
+        """
+            目的地址是任播IP 即是在请求CPN服务
+        """
+        return classified.dst_ip in self.cpn_service_registry.anycast_ips
+
+    def _packet_in_handler(self, ev, classified: ClassifiedPacket):
         """
             处理主机向CPN anycast IP 发起的 ARP请求
+            报文由 awareness 的分发器转交, ARP只使用分类时读取的字段, IPv4报文才完整解析
         """
         msg = ev.msg
         datapath = msg.datapath
         parser = datapath.ofproto_parser
         ofproto = datapath.ofproto
         in_port = msg.match['in_port']
-        pkt = packet.Packet(msg.data)
-        # 解析以太网数据包
-        eth_pkt = pkt.get_protocols(ethernet.ethernet)[0]
-        eth_type = eth_pkt.ethertype
+        eth_type = classified.eth_type
 
-        # 初始化cpn_ip_list
-        cpn_ip_list = [item[0] for item in self.service_id_dict.keys()]
+        # 所有服务的任播IP集合
+        cpn_ip_list = self.cpn_service_registry.anycast_ips
         if eth_type == ether_types.ETH_TYPE_ARP:
-            arp_pkt = pkt.get_protocol(arp.arp)
-            arp_src_ip = arp_pkt.src_ip
-            arp_dst_ip = arp_pkt.dst_ip
-            arp_src_mac = arp_pkt.src_mac
-            arp_opcode = arp_pkt.opcode
+            arp_src_ip = classified.src_ip
+            arp_dst_ip = classified.dst_ip
+            arp_src_mac = classified.src_mac
+            arp_opcode = classified.arp_opcode
             # 判断arp类型是ARP请求
             if arp_opcode == arp.ARP_REQUEST:
                 # 控制判断该ARP请求 的目的IP地址是 AnyCastIP 即是在请求CPN服务
@@ -447,6 +534,8 @@ class CPNRouting(app_manager.RyuApp):
                     self._send_packet_to_port(datapath, in_port, data)
         elif eth_type == ether_types.ETH_TYPE_IP:
             # 解析ip报文
+            pkt = classified.packet
+            eth_pkt = pkt.get_protocols(ethernet.ethernet)[0]
             ip_pkt = pkt.get_protocol(ipv4.ipv4)
             
             # 控制判断该IP数据包的目的IP地址是 AnyCastIP 即是在请求CPN服务
@@ -457,6 +546,9 @@ class CPNRouting(app_manager.RyuApp):
                 actions = None
                 match_back = None
                 actions_back = None
+                idle_timeout, hard_timeout = setting.FlowEntry_IDLET_IMEOUT, setting.FlowEntry_HARD_TIMOUT
+                # 是否把下发的流表作为服务条目的流表记录(供周期性更新使用)
+                record_entry_match = True
                 if ip_pkt.proto == inet.IPPROTO_ICMP: # 判断是ICMP报文
                     icmp_pkt = pkt.get_protocol(icmp.icmp)
                     # 判断接受到的icmp报文是echo request报文
@@ -467,25 +559,82 @@ class CPNRouting(app_manager.RyuApp):
                         # 报文处理结束
                         return
                 elif ip_pkt.proto == inet.IPPROTO_TCP:
-                    # 判断CPN转发表是否初始化了 如果没有则返回
-                    if len(self.cpn_all_forwarding_table) == 0:
-                        return
-                    # 记录该交换机维护的算力应用列表
-                    # 先判断记录是否存在
-                    if datapath.id in self.switch_maintained_cpn_service.keys():
-                        self.switch_maintained_cpn_service[datapath.id].add((ip_pkt.dst, self.sim_net_setting.prime_app_instance_tcp_port))
-                    else:
-                        self.switch_maintained_cpn_service[datapath.id] = set()
-                        self.switch_maintained_cpn_service[datapath.id].add((ip_pkt.dst, self.sim_net_setting.prime_app_instance_tcp_port))
                     # -- (1) 条目一: 当匹配service_id时候 将目的IP地址按概率改写为某个算力实例地址, 并要求交换机继续转发本此收到的数据包
                     # -- (2) 条目二: 当TCP或UDP请求的目的地址是本交换机直连地址, 且源目的地址 匹配 记录的最新转发算力应用实例, 
                     # 且(该条目优先级最高), 则将该源地址改写为AnyCastIP
                     pkt_tcp = pkt.get_protocol(tcp.tcp)
                     service_id = (ip_pkt.dst, pkt_tcp.dst_port)
-                    
+                    # 查找本交换机上该服务的路由条目 服务未注册或本交换机不是该服务的接入交换机时返回
+                    entry = self.cpn_service_registry.get_entry(datapath.id, service_id)
+                    if entry is None:
+                        return
+                    # 记录该交换机维护的算力应用列表
+                    self.switch_maintained_cpn_service.setdefault(datapath.id, set()).add(service_id)
+
+                    if entry.type_of_transport_layer_proto == 'TCP' and \
+                       setting.global_cpn_steering_mode == CPNSteeringMode.CONNECTION:
+                        # 按连接分配: 每个新TCP连接按最新策略选取一次服务实例, 流表项匹配tcp_src, 空闲超时前固定该实例
+                        dst_ip_port, is_new = entry.pin_connection((ip_pkt.src, pkt_tcp.src_port),
+                                                                   self.get_service_policy(entry.service))
+                        if is_new:
+                            self.record_service_instance_update(dst_ip_port[0])
+                        match = parser.OFPMatch(in_port=in_port,
+                                                eth_type=ether.ETH_TYPE_IP,
+                                                ip_proto=inet.IPPROTO_TCP,
+                                                ipv4_src=ip_pkt.src,
+                                                ipv4_dst=ip_pkt.dst,
+                                                tcp_src=pkt_tcp.src_port,
+                                                tcp_dst=pkt_tcp.dst_port)
+                        eth_dst = self.network_awareness.get_host_mac(dst_ip_port[0])
+                        output = self.get_output_port(dpid=datapath.id, inport=in_port, ip_src=ip_pkt.src, ip_dst=dst_ip_port[0])
+                        actions = [parser.OFPActionSetField(eth_dst=eth_dst),
+                                parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
+                                parser.OFPActionSetField(tcp_dst=dst_ip_port[1]),
+                                parser.OFPActionOutput(output)]
+                        match_back = parser.OFPMatch(eth_type=ether.ETH_TYPE_IP,
+                                                    ip_proto=inet.IPPROTO_TCP,
+                                                    ipv4_src=dst_ip_port[0],
+                                                    ipv4_dst=ip_pkt.src,
+                                                    tcp_src=dst_ip_port[1],
+                                                    tcp_dst=pkt_tcp.src_port)
+                        actions_back = [parser.OFPActionSetField(eth_src=setting.CPN_SERICE_REQUEST_MAC),
+                                        parser.OFPActionSetField(ipv4_src=ip_pkt.dst),
+                                        parser.OFPActionSetField(tcp_src=pkt_tcp.dst_port),
+                                        parser.OFPActionOutput(in_port)]
+                        idle_timeout, hard_timeout = setting.CPN_CONNECTION_IDLE_TIMEOUT, 0
+                        record_entry_match = False
+                        add_flow_flag = True
+                    elif entry.type_of_transport_layer_proto == 'TCP' and \
+                       setting.global_cpn_steering_mode == CPNSteeringMode.GROUP:
+                        # 组表模式: 客户端请求交给SELECT组表按桶权重选取服务实例
+                        if entry.group_id is None and not self.install_service_group(datapath, entry, in_port, ip_pkt.src):
+                            return
+                        match = parser.OFPMatch(in_port=in_port,
+                                                eth_type=ether.ETH_TYPE_IP,
+                                                ip_proto=inet.IPPROTO_TCP,
+                                                ipv4_src=ip_pkt.src,
+                                                ipv4_dst=ip_pkt.dst,
+                                                tcp_dst=pkt_tcp.dst_port)
+                        actions = [parser.OFPActionGroup(entry.group_id)]
+                        # 每个服务实例一条回程流表 将源地址改写为任播地址
+                        for instance_ip, instance_port in entry.service_instance_list:
+                            match_back = parser.OFPMatch(eth_type=ether.ETH_TYPE_IP,
+                                                        ip_proto=inet.IPPROTO_TCP,
+                                                        ipv4_src=instance_ip,
+                                                        ipv4_dst=ip_pkt.src,
+                                                        tcp_src=instance_port)
+                            actions_back = [parser.OFPActionSetField(eth_src=setting.CPN_SERICE_REQUEST_MAC),
+                                            parser.OFPActionSetField(ipv4_src=ip_pkt.dst),
+                                            parser.OFPActionSetField(tcp_src=pkt_tcp.dst_port),
+                                            parser.OFPActionOutput(in_port)]
+                            self.add_flow(datapath, match=match_back, actions=actions_back,
+                                    idle_timeout=idle_timeout, hard_timeout=hard_timeout, priority=0x9000)
+                        match_back = None
+                        record_entry_match = False
+                        add_flow_flag = True
                     # 判断service_id 判断是否是否需要更新流表
-                    if self.cpn_all_forwarding_table[datapath.id][service_id].type_of_transport_layer_proto == 'TCP' and \
-                       self.cpn_all_forwarding_table[datapath.id][service_id].to_be_delivered_flag:
+                    elif entry.type_of_transport_layer_proto == 'TCP' and \
+                       entry.to_be_delivered_flag:
                         match = parser.OFPMatch(in_port=in_port,
                                                 eth_type=ether.ETH_TYPE_IP,
                                                 ip_proto=inet.IPPROTO_TCP,
@@ -493,17 +642,12 @@ class CPNRouting(app_manager.RyuApp):
                                                 ipv4_dst=ip_pkt.dst,
                                                 # tcp_src=pkt_tcp.src_port,
                                                 tcp_dst=pkt_tcp.dst_port)
-                        # 更新路由策略
-                        global_forwarding_policy = self.cpn_routing_algo.update_forwarding_policy()
-                        # 更新转发地址
-                        self.cpn_all_forwarding_table[datapath.id][service_id].update_newest_service_instance_id(global_forwarding_policy)
-                        dst_ip_port = self.cpn_all_forwarding_table[datapath.id][service_id].newest_service_instance_id
-                        self.record_service_instance_update_times[dst_ip_port[0]] +=1
-                        eth_dst = None
+                        # 读取服务的最新策略 更新转发地址
+                        entry.update_newest_service_instance_id(self.get_service_policy(entry.service))
+                        dst_ip_port = entry.newest_service_instance_id
+                        self.record_service_instance_update(dst_ip_port[0])
                         # 查找目的IP地址的目的MAC地址
-                        for ip_mac_item in self.network_awareness.access_table.values():
-                            if ip_mac_item[0] == dst_ip_port[0]:
-                                eth_dst = ip_mac_item[1]
+                        eth_dst = self.network_awareness.get_host_mac(dst_ip_port[0])
                         output = self.get_output_port(dpid=datapath.id, inport=in_port, ip_src=ip_pkt.src, ip_dst=dst_ip_port[0])
                         actions = [parser.OFPActionSetField(eth_dst=eth_dst),
                                 parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
@@ -521,34 +665,27 @@ class CPNRouting(app_manager.RyuApp):
                                         parser.OFPActionOutput(in_port)]
                         add_flow_flag = True
                 elif ip_pkt.proto == inet.IPPROTO_UDP:
-                    # 记录该交换机维护的算力应用列表
-                    # 先判断记录是否存在
-                    if datapath.id in self.switch_maintained_cpn_service.keys():
-                        self.switch_maintained_cpn_service[datapath.id].add((ip_pkt.dst, self.sim_net_setting.prime_app_instance_tcp_port))
-                    else:
-                        self.switch_maintained_cpn_service[datapath.id] = set()
-                        self.switch_maintained_cpn_service[datapath.id].add((ip_pkt.dst, self.sim_net_setting.prime_app_instance_tcp_port))
                     pkt_udp = pkt.get_protocol(udp.udp)
                     service_id = (ip_pkt.dst, pkt_udp.dst_port)
-                    if self.cpn_all_forwarding_table[datapath.id][service_id].type_of_transport_layer_proto == 'UDP'and \
-                       self.cpn_all_forwarding_table[datapath.id][service_id].to_be_delivered_flag:
+                    entry = self.cpn_service_registry.get_entry(datapath.id, service_id)
+                    if entry is None:
+                        return
+                    # 记录该交换机维护的算力应用列表
+                    self.switch_maintained_cpn_service.setdefault(datapath.id, set()).add(service_id)
+                    if entry.type_of_transport_layer_proto == 'UDP'and \
+                       entry.to_be_delivered_flag:
                         match = parser.OFPMatch(in_port=in_port,
                                                 eth_type=ether.ETH_TYPE_IP,
                                                 ip_proto=inet.IPPROTO_UDP,
-                                                ipv4_src=pkt_udp.src,
-                                                ipv4_dst=pkt_udp.dst,
+                                                ipv4_src=ip_pkt.src,
+                                                ipv4_dst=ip_pkt.dst,
                                                 # udp_src=pkt_udp.src_port,
                                                 udp_dst=pkt_udp.dst_port)
-                        # 更新路由策略
-                        global_forwarding_policy = self.cpn_routing_algo.update_forwarding_policy()
-                        # 更新转发地址
-                        self.cpn_all_forwarding_table[datapath.id][service_id].update_newest_service_instance_id(global_forwarding_policy)
-                        dst_ip_port = self.cpn_all_forwarding_table[datapath.id][service_id].newest_service_instance_id
-                        eth_dst = None
+                        # 读取服务的最新策略 更新转发地址
+                        entry.update_newest_service_instance_id(self.get_service_policy(entry.service))
+                        dst_ip_port = entry.newest_service_instance_id
                         # 查找目的IP地址的目的MAC地址
-                        for ip_mac_item in self.network_awareness.access_table.values():
-                            if ip_mac_item[0] == dst_ip_port[0]:
-                                eth_dst = ip_mac_item[1]
+                        eth_dst = self.network_awareness.get_host_mac(dst_ip_port[0])
                         output = self.get_output_port(dpid=datapath.id, inport=in_port, ip_src=ip_pkt.src, ip_dst=dst_ip_port[0])
                         actions = [parser.OFPActionSetField(eth_dst=eth_dst),
                                 parser.OFPActionSetField(ipv4_dst=dst_ip_port[0]),
@@ -570,14 +707,18 @@ class CPNRouting(app_manager.RyuApp):
                 if add_flow_flag:
                     # priority 高于默认优先级 0x8000
                     self.add_flow(datapath, match=match, actions=actions,
-                            idle_timeout=setting.FlowEntry_IDLET_IMEOUT, hard_timeout=setting.FlowEntry_HARD_TIMOUT, priority=0x9000)
-                    self.add_flow(datapath, match=match_back, actions=actions_back,
-                            idle_timeout=setting.FlowEntry_IDLET_IMEOUT, hard_timeout=setting.FlowEntry_HARD_TIMOUT, priority=0x9000)
-                    # 更新控制器流表记录 确认流表已经更新 且记录匹配域
-                    self.cpn_all_forwarding_table[datapath.id][service_id].to_be_delivered_flag = False
-                    self.cpn_all_forwarding_table[datapath.id][service_id].match = match
-                    self.cpn_all_forwarding_table[datapath.id][service_id].match_back = match_back
-                    self.cpn_all_forwarding_table[datapath.id][service_id].updated_by_packet_in_msg_time = time.time()
+                            idle_timeout=idle_timeout, hard_timeout=hard_timeout, priority=0x9000)
+                    if match_back is not None:
+                        self.add_flow(datapath, match=match_back, actions=actions_back,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout, priority=0x9000)
+                    # 更新控制器流表记录 确认流表已经更新 且记录匹配域(按连接分配与组表模式的流表项不作为服务条目的流表记录)
+                    if record_entry_match:
+                        self.flow_reconciler.record(datapath.id, DesiredFlow(0x9000, match, actions, idle_timeout, hard_timeout))
+                        self.flow_reconciler.record(datapath.id, DesiredFlow(0x9000, match_back, actions_back, idle_timeout, hard_timeout))
+                        entry.to_be_delivered_flag = False
+                        entry.match = match
+                        entry.match_back = match_back
+                    entry.updated_by_packet_in_msg_time = time.time()
 
                     d = None
                     if msg.buffer_id == ofproto.OFP_NO_BUFFER:
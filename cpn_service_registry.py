@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Tuple, Dict, Set, Optional
+import numpy as np
+import setting
+from setting import SimNetworkSetUp
+from cpn_policy_sampler import AliasSampler
+
+"""
+CPN任播服务注册表: 服务(任播IP:端口) ——> 服务实例集合与策略矩阵, (dpid, service_id) ——> 服务路由条目
+"""
+class CPNService:
+    """
+    CPN任播服务, 每个服务拥有自己的服务实例集合与策略矩阵
+    service_id: (anycast-ip, port)
+    service_instance_list: List[(ip, port)] 服务实例, 对应策略矩阵的列
+    access_dpids: 接入交换机dpid列表, 对应策略矩阵的行
+    policy: 接入交换机数量 * 服务实例数量 的转发策略, 为None时使用策略引擎计算的全局策略
+    """
+    def __init__(self, service_id: Tuple[str, int], service_instance_list: List[Tuple[str, int]],
+                 access_dpids: List[int], description: str = '', type_of_transport_layer_proto: str = 'TCP',
+                 policy=None):
+        self.service_id = service_id
+        self.service_instance_list = list(service_instance_list)
+        self.access_dpids = list(access_dpids)
+        self.description = description
+        self.type_of_transport_layer_proto = type_of_transport_layer_proto
+        # 接入交换机dpid ——> 策略矩阵的行下标
+        self.row_index: Dict[int, int] = {dpid: i for i, dpid in enumerate(self.access_dpids)}
+        self.policy: np.ndarray = None
+        if policy is not None:
+            self.set_policy(policy)
+
+    def set_policy(self, policy):
+        policy = np.asarray(policy, dtype=float)
+        shape = (len(self.access_dpids), len(self.service_instance_list))
+        if policy.shape != shape:
+            raise ValueError('policy of service %s must have shape %s, got %s' % (self.service_id, shape, policy.shape))
+        self.policy = policy
+
+
+class CPNServiceForwardingEntry:
+    """
+    CPN服务条目 一条服务条目保存多个 待选服务实例ip+端口
+    cpn_service_id 暂且用 任播地址 表示
+    service_id: (anycast-ip:port)
+    """
+    def __init__(self, dpid: int, service_id: Tuple[str, int], type_of_transport_layer_proto: str = 'TCP', service_instance_list: List = [], forwarding_policy: List = [] ,
+                 setup: SimNetworkSetUp = None, service: CPNService = None):
+        # 记录本服务路由条目所属的 dpid
+        self.dpid = dpid
+        # 记录本服务路由条目所属的 service_id
+        self.service_id = service_id
+        # 本服务路由条目所需的四层协议
+        self.type_of_transport_layer_proto: str = type_of_transport_layer_proto
+        # 列表元素是 （IP-Port） tuple 元组
+        self.service_instance_list: List[Tuple[str, int]] = service_instance_list
+        # 转发策略
+        self.forwarding_policy: List[float] = forwarding_policy
+        # 最新设置的服务转发ID （IP-Port）
+        self.newest_service_instance_id: Tuple[str, int] = ()
+        # 标签位记录当前条目是否需要更新 默认需要更新
+        self.to_be_delivered_flag = True
+        # 记录此条目对应的交换机 Match类 (ofproto_v1_3_parser.OFPMatch)
+        self.match = None
+        # 记录此条目对应的交换机 反向条目 (ofproto_v1_3_parser.OFPMatch)
+        self.match_back = None
+        # 记录本路由条目上次由于 packet_in消息触发流表下发的时间
+        self.updated_by_packet_in_msg_time = None
+        # 全局设置类
+        self.setup = setup
+        # 本条目所属的服务, 决定策略矩阵中对应的行
+        self.service = service
+        # 按转发策略选取服务实例的别名表 只在转发策略变化时重建
+        self.sampler: AliasSampler = None
+        # 按连接分配时 已分配的TCP连接(客户端ip, tcp_src) ——> 服务实例(IP-Port), 连接流表项删除时移除
+        self.connections: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        # 组表模式 本条目在交换机上的SELECT组id, 各个桶对应的(服务实例下标, 动作列表), 以及已下发的桶权重
+        self.group_id: int = None
+        self.group_bucket_actions: List[Tuple[int, List]] = []
+        self.group_weights: np.ndarray = None
+        # 安装组表时的客户端入端口与地址, 用于计算通往服务实例的出端口 (主动下发时为None)
+        self.group_in_port: int = None
+        self.group_ip_src: str = None
+
+    @classmethod
+    def for_service(cls, dpid: int, service: CPNService, setup: SimNetworkSetUp = None) -> 'CPNServiceForwardingEntry':
+        return cls(dpid=dpid, service_id=service.service_id,
+                   type_of_transport_layer_proto=service.type_of_transport_layer_proto,
+                   service_instance_list=service.service_instance_list,
+                   setup=setup, service=service)
+
+    def set_service_instance_list(self, service_instance_list):
+        self.service_instance_list = service_instance_list
+
+    def set_forwarding_policy(self, forwarding_policy):
+        self.forwarding_policy = forwarding_policy
+
+    def update_newest_service_instance_id(self, global_forwarding_policy):
+        """
+        更新服务路由条目中的服务实例id, 按本条目对应的策略行通过别名表以O(1)选取服务实例
+        global_forwarding_policy: 本条目所属服务的转发策略 入口节点数量 * 服务实例数量 二维数组
+        """
+        policy_line = self.get_policy_line(global_forwarding_policy)
+        if self.sampler is None or not np.array_equal(policy_line, self.forwarding_policy):
+            # 转发策略更新 重建别名表
+            self.forwarding_policy = policy_line
+            self.sampler = AliasSampler(self.forwarding_policy)
+        index = self.sampler.sample()
+        self.newest_service_instance_id = self.service_instance_list[index]
+
+    def get_policy_line(self, global_forwarding_policy):
+        """
+        本条目在策略矩阵中对应的策略行
+        """
+        if self.service is not None:
+            return global_forwarding_policy[self.service.row_index[self.dpid]]
+        policy_line_index  = self.dpid - self.setup.numberOfPrimeApps - 1
+        return global_forwarding_policy[policy_line_index]
+
+    def get_bucket_weights(self, global_forwarding_policy) -> np.ndarray:
+        """
+        由策略行计算组表桶权重(非负整数), 与 service_instance_list 对齐
+        """
+        policy_line = np.asarray(self.get_policy_line(global_forwarding_policy), dtype=float)
+        total = np.sum(policy_line)
+        if not total > 0:
+            return np.zeros(len(policy_line), dtype=int)
+        return np.round(policy_line / total * setting.CPN_GROUP_BUCKET_WEIGHT_SCALE).astype(int)
+
+    def reset_group(self):
+        """
+        交换机断开连接后组表可能已不存在, 下一次使用时重新安装
+        """
+        self.group_id = None
+        self.group_bucket_actions = []
+        self.group_weights = None
+
+    def pin_connection(self, connection: Tuple[str, int], global_forwarding_policy) -> Tuple[Tuple[str, int], bool]:
+        """
+        为TCP连接(客户端ip, tcp_src)按转发策略选取服务实例, 同一连接再次上报时(例如SYN重传)返回已选取的实例
+        return: (服务实例, 是否为新连接)
+        """
+        instance = self.connections.get(connection)
+        if instance is not None:
+            return instance, False
+        self.update_newest_service_instance_id(global_forwarding_policy)
+        instance = self.newest_service_instance_id
+        self.connections[connection] = instance
+        return instance, True
+
+    def release_connection(self, connection: Tuple[str, int]):
+        self.connections.pop(connection, None)
+
+
+class CPNServiceRegistry:
+    """
+    CPN任播服务注册表
+    - services: service_id ——> CPNService
+    - anycast_ips: 所有服务的任播IP集合, 用于packet_in中O(1)判断目的地址
+    - entries: (dpid, service_id) ——> CPNServiceForwardingEntry, 注册服务时为其每个接入交换机创建条目
+    policy_version: 任一服务的独立策略矩阵更新时加一
+    """
+    def __init__(self, setup: SimNetworkSetUp = None):
+        self.setup = setup
+        self.services: Dict[Tuple[str, int], CPNService] = {}
+        self.anycast_ips: Set[str] = set()
+        self.entries: Dict[Tuple[int, Tuple[str, int]], CPNServiceForwardingEntry] = {}
+        self.policy_version = 0
+
+    def __len__(self):
+        return len(self.services)
+
+    def register(self, service: CPNService) -> CPNService:
+        """
+        注册服务, 已存在相同service_id的服务时替换原服务及其条目
+        """
+        if service.service_id in self.services:
+            self.unregister(service.service_id)
+        self.services[service.service_id] = service
+        self.anycast_ips.add(service.service_id[0])
+        for dpid in service.access_dpids:
+            self.entries[(dpid, service.service_id)] = CPNServiceForwardingEntry.for_service(dpid, service, self.setup)
+        return service
+
+    def unregister(self, service_id: Tuple[str, int]):
+        service = self.services.pop(service_id, None)
+        if service is None:
+            return
+        for dpid in service.access_dpids:
+            self.entries.pop((dpid, service_id), None)
+        if all(other[0] != service_id[0] for other in self.services):
+            self.anycast_ips.discard(service_id[0])
+
+    def register_setup_services(self, setup: SimNetworkSetUp):
+        """
+        注册实验设置中的服务: 服务实例为全部prime app, 接入交换机为switchB, 使用策略引擎计算的全局策略
+        """
+        service_instance_list = [(ip, setup.prime_app_instance_tcp_port) for ip in setup.prime_apps_ip_list]
+        for service_id, description in setup.service_id_dict.items():
+            self.register(CPNService(service_id, service_instance_list, setup.switchB_dpid_list,
+                                     description=description))
+
+    def get_service(self, service_id: Tuple[str, int]) -> Optional[CPNService]:
+        return self.services.get(service_id)
+
+    def get_entry(self, dpid: int, service_id: Tuple[str, int]) -> Optional[CPNServiceForwardingEntry]:
+        return self.entries.get((dpid, service_id))
+
+    def set_policy(self, service_id: Tuple[str, int], policy):
+        self.services[service_id].set_policy(policy)
+        self.policy_version += 1
+
+    @property
+    def service_id_dict(self) -> Dict[Tuple[str, int], str]:
+        return {service_id: service.description for service_id, service in self.services.items()}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Dict, Optional
+import logging
+import os
+import subprocess
+import time
+import numpy as np
+import setting
+
+LOG = logging.getLogger(__name__)
+
+"""
+基于cgroup文件系统的容器CPU利用率采集
+"""
+class CgroupCPUCollector:
+    """
+    直接读取各个容器cgroup目录下的 cpu.stat(cgroup v2) 或 cpuacct.usage(cgroup v1) 计算CPU利用率,
+    利用两次采样的CPU时间差值计算利用率(百分数, 与 docker stats 的 CPUPerc 一致, 单核满载为100),
+    采样结果保存在环形缓冲区中, 读取时无需等待
+    n_containers: 容器数量, 容器名称依次为 name_prefix1 ... name_prefix{n}
+    cgroup_root: cgroup文件系统挂载点
+    name_prefix: 容器名称前缀
+    capacity: 环形缓冲区长度
+    container_cgroups: Dict[容器名称, cgroup目录], 直接指定容器的cgroup目录(例如指向伪造的cgroup目录树),
+                       未指定的容器通过 docker ps 查询容器id后在cgroup_root下查找
+    """
+    def __init__(self, n_containers: int, cgroup_root: str = setting.CGROUP_ROOT,
+                 name_prefix: str = setting.PRIME_APP_CONTAINER_PREFIX,
+                 capacity: int = setting.CPU_TELEMETRY_BUFFER_SIZE,
+                 container_cgroups: Dict[str, str] = None):
+        self.cgroup_root = cgroup_root
+        self.container_names: List[str] = [f"{name_prefix}{i + 1}" for i in range(n_containers)]
+        self.container_cgroups: Dict[str, str] = dict(container_cgroups) if container_cgroups else {}
+        self.capacity = capacity
+        # 环形缓冲区 容器数量 * capacity, 保存CPU利用率(百分数)
+        self.rates = np.zeros(shape=(n_containers, capacity), dtype=float)
+        # 环形缓冲区 保存每次采样的时间
+        self.timestamps = np.zeros(shape=capacity, dtype=float)
+        # 已保存的采样数量 与 下一次写入的位置
+        self.count = 0
+        self.index = 0
+        self._last_usage = np.full(n_containers, np.nan)
+        self._last_time: Optional[float] = None
+        self._last_resolve_time: Optional[float] = None
+
+    def resolve_cgroups(self, force=False):
+        """
+        查找尚未知道cgroup目录的容器, docker ps 只在有容器未解析时调用, 且调用间隔不小于 CPU_TELEMETRY_RESOLVE_INTERVAL
+        """
+        unresolved = [name for name in self.container_names if name not in self.container_cgroups]
+        if not unresolved:
+            return
+        now = time.monotonic()
+        if not force and self._last_resolve_time is not None and \
+           now - self._last_resolve_time < setting.CPU_TELEMETRY_RESOLVE_INTERVAL:
+            return
+        self._last_resolve_time = now
+        cmd = ['docker', 'ps', '--no-trunc', '--format', '{{.ID}} {{.Names}}']
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.SubprocessError):
+            LOG.debug('cannot list docker containers')
+            return
+        name_to_id = {}
+        for line in result.stdout.strip().split('\n'):
+            if line:
+                container_id, name = line.split(' ', 1)
+                name_to_id[name] = container_id
+        for name in unresolved:
+            if name in name_to_id:
+                path = self.find_cgroup_dir(self.cgroup_root, name_to_id[name])
+                if path:
+                    self.container_cgroups[name] = path
+
+    @staticmethod
+    def find_cgroup_dir(cgroup_root: str, container_id: str) -> Optional[str]:
+        """
+        按 systemd/cgroupfs 驱动 与 cgroup v1/v2 的常见布局查找容器cgroup目录
+        """
+        candidates = [os.path.join(cgroup_root, 'system.slice', f'docker-{container_id}.scope'),
+                      os.path.join(cgroup_root, 'docker', container_id),
+                      os.path.join(cgroup_root, 'cpuacct', 'docker', container_id),
+                      os.path.join(cgroup_root, 'cpu,cpuacct', 'docker', container_id),
+                      os.path.join(cgroup_root, 'cpuacct', 'system.slice', f'docker-{container_id}.scope')]
+        for path in candidates:
+            if os.path.isdir(path):
+                return path
+        return None
+
+    @staticmethod
+    def read_usage_ns(cgroup_dir: str) -> float:
+        """
+        读取cgroup累计CPU时间(ns), 读取失败返回nan
+        """
+        try:
+            with open(os.path.join(cgroup_dir, 'cpu.stat'), 'r') as f:
+                for line in f:
+                    if line.startswith('usage_usec'):
+                        return float(line.split()[1]) * 1000
+        except OSError:
+            pass
+        try:
+            with open(os.path.join(cgroup_dir, 'cpuacct.usage'), 'r') as f:
+                return float(f.read().strip())
+        except (OSError, ValueError):
+            return np.nan
+
+    def sample(self, now: float = None):
+        """
+        采样一次所有容器的累计CPU时间, 与上一次采样做差得到CPU利用率并写入环形缓冲区
+        """
+        self.resolve_cgroups()
+        if now is None:
+            now = time.monotonic()
+        usage = np.full(len(self.container_names), np.nan)
+        for i, name in enumerate(self.container_names):
+            cgroup_dir = self.container_cgroups.get(name)
+            if cgroup_dir:
+                usage[i] = self.read_usage_ns(cgroup_dir)
+
+        if self._last_time is not None and now > self._last_time:
+            rates = (usage - self._last_usage) / ((now - self._last_time) * 1e9) * 100
+            # 无法计算的容器(新出现或读取失败) 利用率记为0
+            rates[~np.isfinite(rates)] = 0
+            rates = np.maximum(rates, 0)
+            self.rates[:, self.index] = rates
+            self.timestamps[self.index] = now
+            self.index = (self.index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        self._last_usage = usage
+        self._last_time = now
+
+    def latest_rates(self) -> np.ndarray:
+        """
+        返回最近一次采样的各容器CPU利用率(百分数), 尚无采样时返回全0
+        """
+        if self.count == 0:
+            return np.zeros(len(self.container_names), dtype=float)
+        return self.rates[:, (self.index - 1) % self.capacity].copy()
+
+    def mean_rates(self, window: int) -> np.ndarray:
+        """
+        返回最近 window 次采样的平均CPU利用率
+        """
+        n = min(window, self.count)
+        if n == 0:
+            return np.zeros(len(self.container_names), dtype=float)
+        columns = [(self.index - 1 - i) % self.capacity for i in range(n)]
+        return self.rates[:, columns].mean(axis=1)
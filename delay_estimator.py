@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Dict, Hashable, Iterable
+from collections import deque
+import numpy as np
+import setting
+
+"""
+时延样本的平滑估计: 每个对象(链路或交换机)保存最近N个样本, 剔除异常样本后做EWMA, 同时估计抖动
+"""
+class DelaySamples:
+    """
+    单个对象的时延样本
+    - window: 最近N个样本(包括被判为异常的样本, 使中位数能跟随时延的真实变化)
+    - ewma: 未被判为异常的样本的指数加权平均
+    - jitter: 相邻样本差值绝对值的指数加权平均 (RFC 3550 到达间隔抖动, 增益1/16)
+    """
+    __slots__ = ('window', 'ewma', 'jitter', 'last', 'n_samples', 'n_outliers')
+
+    def __init__(self, window: int):
+        self.window = deque(maxlen=window)
+        self.ewma: float = None
+        self.jitter = 0.0
+        self.last: float = None
+        self.n_samples = 0
+        self.n_outliers = 0
+
+    def median(self) -> float:
+        return float(np.median(self.window)) if self.window else np.nan
+
+
+class DelayEstimator:
+    """
+    按对象(key)维护时延估计
+    window: 中位数窗口长度
+    alpha: EWMA中新样本的权重
+    outlier_factor: 窗口内样本不少于3个时, 偏离中位数超过 outlier_factor*MAD 的样本不进入EWMA
+    min_deviation: MAD的下限(s), 避免时延非常稳定时把正常波动判为异常
+    """
+    def __init__(self, window: int = setting.DELAY_SAMPLE_WINDOW,
+                 alpha: float = setting.DELAY_EWMA_ALPHA,
+                 outlier_factor: float = setting.DELAY_OUTLIER_FACTOR,
+                 min_deviation: float = setting.DELAY_OUTLIER_MIN_DEVIATION):
+        self.window = window
+        self.alpha = alpha
+        self.outlier_factor = outlier_factor
+        self.min_deviation = min_deviation
+        self.samples: Dict[Hashable, DelaySamples] = {}
+
+    def add(self, key: Hashable, sample: float) -> float:
+        """
+        加入一个样本 return: 加入后的时延估计
+        """
+        stats = self.samples.get(key)
+        if stats is None:
+            stats = self.samples[key] = DelaySamples(self.window)
+        stats.n_samples += 1
+        if stats.last is not None:
+            stats.jitter += (abs(sample - stats.last) - stats.jitter) / 16
+        stats.last = sample
+        outlier = False
+        if len(stats.window) >= 3:
+            window = np.fromiter(stats.window, dtype=float, count=len(stats.window))
+            median = np.median(window)
+            mad = max(float(np.median(np.abs(window - median))), self.min_deviation)
+            outlier = abs(sample - median) > self.outlier_factor * mad
+        stats.window.append(sample)
+        if outlier:
+            stats.n_outliers += 1
+        elif stats.ewma is None:
+            stats.ewma = sample
+        else:
+            stats.ewma += self.alpha * (sample - stats.ewma)
+        return stats.ewma if stats.ewma is not None else sample
+
+    def estimate(self, key: Hashable, default: float = np.nan) -> float:
+        stats = self.samples.get(key)
+        if stats is None or stats.ewma is None:
+            return default
+        return stats.ewma
+
+    def median(self, key: Hashable, default: float = np.nan) -> float:
+        stats = self.samples.get(key)
+        if stats is None or not stats.window:
+            return default
+        return stats.median()
+
+    def jitter(self, key: Hashable, default: float = np.nan) -> float:
+        stats = self.samples.get(key)
+        if stats is None or stats.last is None:
+            return default
+        return stats.jitter
+
+    def estimates(self, keys: Iterable[Hashable], default: float = np.nan) -> np.ndarray:
+        return np.fromiter((self.estimate(key, default) for key in keys), dtype=float)
+
+    def forget(self, key: Hashable):
+        self.samples.pop(key, None)
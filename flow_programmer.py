@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Tuple, Dict, Set, Callable
+import logging
+from ryu.controller.controller import Datapath
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_4
+from ryu.ofproto.ofproto_parser import MsgBase
+import setting
+
+LOG = logging.getLogger(__name__)
+
+"""
+流表项的批量下发与安装确认
+"""
+class FlowBatch:
+    """
+    一次路径安装需要下发的消息, 按datapath分组并保持添加顺序
+    """
+    def __init__(self):
+        self.datapaths: Dict[int, Datapath] = {}
+        self.msgs: Dict[int, List[MsgBase]] = {}
+
+    def add(self, datapath: Datapath, msg: MsgBase):
+        self.datapaths.setdefault(datapath.id, datapath)
+        self.msgs.setdefault(datapath.id, []).append(msg)
+
+    def __len__(self):
+        return sum(len(msgs) for msgs in self.msgs.values())
+
+
+class PendingCommit:
+    """
+    等待barrier回复的一次提交
+    waiting: 尚未收到回复的 (dpid, barrier xid)
+    """
+    def __init__(self, on_complete: Callable[[], None] = None):
+        self.waiting: Set[Tuple[int, int]] = set()
+        self.on_complete = on_complete
+        self.timer = None
+        self.done = False
+
+
+class FlowProgrammer:
+    """
+    按datapath批量下发FlowMod:
+    - 每个datapath的全部消息和其后的 OFPBarrierRequest 序列化后拼接, 只调用一次 datapath.send
+    - datapath协商的版本不低于OF1.4时, 消息放入一个原子有序的bundle中提交
+    - 所有datapath的barrier回复到达后执行回调(例如发送packet-out), 超过timeout仍未全部到达时同样执行回调
+    timeout: 等待barrier回复的超时时间(s)
+    """
+    def __init__(self, timeout: float = setting.FLOW_BARRIER_TIMEOUT):
+        self.timeout = timeout
+        self.bundle_id = 0
+        # (dpid, barrier xid) ——> 等待该barrier回复的提交
+        self.pending: Dict[Tuple[int, int], PendingCommit] = {}
+        self.n_commits = 0
+        self.n_timeouts = 0
+
+    def new_batch(self) -> FlowBatch:
+        return FlowBatch()
+
+    def commit(self, batch: FlowBatch, on_complete: Callable[[], None] = None) -> PendingCommit:
+        """
+        下发batch中的全部消息, 所有消息在交换机上生效后执行on_complete
+        """
+        self.n_commits += 1
+        commit = PendingCommit(on_complete)
+        for dpid, msgs in batch.msgs.items():
+            datapath = batch.datapaths[dpid]
+            if datapath.ofproto.OFP_VERSION >= ofproto_v1_4.OFP_VERSION:
+                msgs = self._bundle(datapath, msgs)
+            barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+            datapath.send(self._serialize(datapath, msgs + [barrier]))
+            key = (dpid, barrier.xid)
+            self.pending[key] = commit
+            commit.waiting.add(key)
+        if not commit.waiting:
+            self._complete(commit)
+        else:
+            commit.timer = hub.spawn_after(self.timeout, self._expire, commit)
+        return commit
+
+    def barrier_reply(self, dpid: int, xid: int) -> bool:
+        """
+        处理barrier回复, 不是由本模块发出的barrier返回False
+        """
+        commit = self.pending.pop((dpid, xid), None)
+        if commit is None:
+            return False
+        commit.waiting.discard((dpid, xid))
+        if not commit.waiting:
+            self._complete(commit)
+        return True
+
+    def forget_datapath(self, dpid: int):
+        """
+        datapath断开连接时不再等待其barrier回复
+        """
+        for key in [key for key in self.pending if key[0] == dpid]:
+            self.barrier_reply(*key)
+
+    def _expire(self, commit: PendingCommit):
+        commit.timer = None
+        if commit.done:
+            return
+        self.n_timeouts += 1
+        LOG.info('barrier reply timeout: %s', sorted(commit.waiting))
+        for key in commit.waiting:
+            self.pending.pop(key, None)
+        commit.waiting.clear()
+        self._complete(commit)
+
+    def _complete(self, commit: PendingCommit):
+        if commit.done:
+            return
+        commit.done = True
+        if commit.timer is not None:
+            hub.kill(commit.timer)
+            commit.timer = None
+        if commit.on_complete is not None:
+            commit.on_complete()
+
+    @staticmethod
+    def _serialize(datapath: Datapath, msgs: List[MsgBase]) -> bytes:
+        bufs = []
+        for msg in msgs:
+            if msg.xid is None:
+                datapath.set_xid(msg)
+            msg.serialize()
+            bufs.append(msg.buf)
+        return b''.join(bufs)
+
+    def _bundle(self, datapath: Datapath, msgs: List[MsgBase]) -> List[MsgBase]:
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        self.bundle_id = (self.bundle_id + 1) & 0xffffffff
+        flags = ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED
+        bundle = [parser.OFPBundleCtrlMsg(datapath, self.bundle_id, ofproto.OFPBCT_OPEN_REQUEST, flags, [])]
+        bundle += [parser.OFPBundleAddMsg(datapath, self.bundle_id, flags, msg, []) for msg in msgs]
+        bundle.append(parser.OFPBundleCtrlMsg(datapath, self.bundle_id, ofproto.OFPBCT_COMMIT_REQUEST, flags, []))
+        return bundle
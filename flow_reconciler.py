@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Tuple, Dict, NamedTuple
+import logging
+from ryu.controller.controller import Datapath
+from ryu.ofproto import ofproto_v1_3_parser
+from flow_programmer import FlowBatch
+
+LOG = logging.getLogger(__name__)
+
+"""
+比较期望流表状态与已下发流表状态, 只下发需要变化的流表项
+"""
+class DesiredFlow(NamedTuple):
+    """
+    期望存在于交换机上的一条流表项
+    """
+    priority: int
+    match: ofproto_v1_3_parser.OFPMatch
+    actions: List
+    idle_timeout: int = 0
+    hard_timeout: int = 0
+
+
+class FlowReconciler:
+    """
+    记录每个交换机上已下发的流表项 (priority, match) ——> actions
+    reconcile 时比较期望流表与已下发流表:
+    - 不存在相同 (priority, match) 的流表项: 发送 OFPFC_ADD
+    - 存在但动作不同: 发送 OFPFC_MODIFY_STRICT, 只修改该流表项的指令, 不重置计数
+    - 完全相同: 不发送
+    - remove_stale 为True时, 已下发但不在期望流表中的流表项: 发送 OFPFC_DELETE_STRICT
+    mods_sent/mods_avoided 记录最近一轮(begin_tick之后)发送与省去的FlowMod数量, total_* 为累计值
+    flags: 下发流表项使用的标记, 例如 OFPFF_SEND_FLOW_REM, 流表项删除时调用 forget 同步已下发状态
+    cookie: 下发流表项使用的cookie, 见 setting.FlowCookie
+    """
+    def __init__(self, flags: int = 0, cookie: int = 0):
+        self.flags = flags
+        self.cookie = cookie
+        # dpid ——> Dict[(priority, match key), actions key]
+        self.installed: Dict[int, Dict[Tuple, Tuple]] = {}
+        # dpid ——> Dict[(priority, match key), 已下发的流表项] 用于删除不再需要的流表项
+        self.installed_flows: Dict[int, Dict[Tuple, DesiredFlow]] = {}
+        self.mods_sent = 0
+        self.mods_avoided = 0
+        self.total_mods_sent = 0
+        self.total_mods_avoided = 0
+
+    @staticmethod
+    def match_key(priority: int, match: ofproto_v1_3_parser.OFPMatch) -> Tuple:
+        return (priority, tuple(sorted((field, str(value)) for field, value in match.items())))
+
+    @staticmethod
+    def actions_key(actions: List) -> Tuple:
+        return tuple(str(action) for action in actions)
+
+    def begin_tick(self):
+        self.mods_sent = 0
+        self.mods_avoided = 0
+
+    def reconcile(self, datapath: Datapath, flows: List[DesiredFlow], batch: FlowBatch = None,
+                  remove_stale: bool = False) -> int:
+        """
+        使交换机上的流表与期望流表flows一致, batch不为None时FlowMod加入batch批量发送
+        remove_stale: flows 为该交换机的全部期望流表, 删除其余已下发的流表项
+        return: 发送的FlowMod数量
+        """
+        installed = self.installed.setdefault(datapath.id, {})
+        installed_flows = self.installed_flows.setdefault(datapath.id, {})
+        ofproto = datapath.ofproto
+        sent = 0
+        desired = set()
+        for flow in flows:
+            key = self.match_key(flow.priority, flow.match)
+            desired.add(key)
+            actions = self.actions_key(flow.actions)
+            if key not in installed:
+                command = ofproto.OFPFC_ADD
+            elif installed[key] != actions:
+                command = ofproto.OFPFC_MODIFY_STRICT
+            else:
+                self.mods_avoided += 1
+                self.total_mods_avoided += 1
+                continue
+            self._send(datapath, self._build_flow_mod(datapath, flow, command), batch)
+            installed[key] = actions
+            installed_flows[key] = flow
+            sent += 1
+        if remove_stale:
+            for key in [key for key in installed if key not in desired]:
+                del installed[key]
+                flow = installed_flows.pop(key, None)
+                if flow is None:
+                    continue
+                self._send(datapath, self._build_flow_mod(datapath, flow, ofproto.OFPFC_DELETE_STRICT), batch)
+                sent += 1
+        self.mods_sent += sent
+        self.total_mods_sent += sent
+        return sent
+
+    def record(self, dpid: int, flow: DesiredFlow):
+        """
+        记录由其他途径(例如packet_in处理)下发的流表项
+        """
+        key = self.match_key(flow.priority, flow.match)
+        self.installed.setdefault(dpid, {})[key] = self.actions_key(flow.actions)
+        self.installed_flows.setdefault(dpid, {})[key] = flow
+
+    def forget(self, dpid: int, priority: int, match: ofproto_v1_3_parser.OFPMatch):
+        """
+        流表项已从交换机删除(超时或被删除)
+        """
+        key = self.match_key(priority, match)
+        self.installed.get(dpid, {}).pop(key, None)
+        self.installed_flows.get(dpid, {}).pop(key, None)
+
+    def forget_datapath(self, dpid: int):
+        """
+        交换机断开连接, 重新连接后流表可能为空, 下一次 reconcile 重新下发全部流表项
+        """
+        self.installed.pop(dpid, None)
+        self.installed_flows.pop(dpid, None)
+
+    @staticmethod
+    def _send(datapath: Datapath, mod, batch: FlowBatch = None):
+        if batch is not None:
+            batch.add(datapath, mod)
+        else:
+            datapath.send_msg(mod)
+
+    def _build_flow_mod(self, datapath: Datapath, flow: DesiredFlow, command):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, flow.actions)]
+        # 删除时 out_port/out_group 取ANY, 否则只删除输出到指定端口/组的流表项
+        return parser.OFPFlowMod(datapath=datapath,
+                                 command=command,
+                                 cookie=self.cookie,
+                                 out_port=ofproto.OFPP_ANY,
+                                 out_group=ofproto.OFPG_ANY,
+                                 idle_timeout=flow.idle_timeout,
+                                 hard_timeout=flow.hard_timeout,
+                                 priority=flow.priority,
+                                 flags=self.flags,
+                                 match=flow.match,
+                                 instructions=inst)
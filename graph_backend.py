@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Tuple, Dict, Optional, Iterable
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+import setting
+from setting import PathEvaType
+
+"""
+交换机拓扑的CSR(压缩稀疏行)存储, 供路径查询与链路属性的批量读写使用
+"""
+# 边属性 ——> 尚未测量时的默认值
+# hop: 链路跳数权重1; delay: 未测量的链路不可用; bw/lldpdelay: 未测量记为nan, 读取时跳过
+DEFAULT_EDGE_ATTRS: Dict[str, float] = {
+    setting.WEIGHT_MODEL[PathEvaType.HOP.value]: 1.0,
+    PathEvaType.DELAY.value: np.inf,
+    PathEvaType.BANDWIDTH.value: np.nan,
+    PathEvaType.LLDPDELAY.value: np.nan,
+}
+
+
+class CSRGraph:
+    """
+    以CSR数组保存交换机之间的有向链路(不含自环), 每种边属性保存为与边下标对齐的权重数组
+    - nodes: 按dpid排序的交换机列表, node_index: dpid ——> 节点下标
+    - indptr/indices: CSR结构, 节点i的出边下标为 indptr[i]:indptr[i+1], indices为出边终点的节点下标
+    - edge_src/edge_dst: 边下标 ——> 起点/终点节点下标
+    - reverse: 边下标 ——> 反向链路的边下标, 不存在时为-1
+    - weights: 属性名 ——> 权重数组
+    链路权重的批量更新直接写入数组, 最短路径使用scipy csgraph的Dijkstra计算
+    attrs: 边属性 ——> 默认值
+    """
+    def __init__(self, attrs: Dict[str, float] = None):
+        self.attrs: Dict[str, float] = dict(attrs) if attrs is not None else dict(DEFAULT_EDGE_ATTRS)
+        self.nodes: List[int] = []
+        self.node_index: Dict[int, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int32)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.edge_src = np.zeros(0, dtype=np.int32)
+        self.edge_dst = np.zeros(0, dtype=np.int32)
+        self.reverse = np.zeros(0, dtype=np.int64)
+        # (src-dpid, dst-dpid) ——> 边下标
+        self.edge_index: Dict[Tuple[int, int], int] = {}
+        self.weights: Dict[str, np.ndarray] = {attr: np.zeros(0, dtype=float) for attr in self.attrs}
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.edge_src)
+
+    def rebuild(self, nodes: Iterable[int], links: Iterable[Tuple[int, int]]):
+        """
+        按最新的交换机与链路重建CSR结构, 仍然存在的链路保留原有的属性值
+        """
+        nodes = sorted(set(nodes))
+        node_index = {dpid: i for i, dpid in enumerate(nodes)}
+        edges = sorted({(node_index[src], node_index[dst]) for (src, dst) in links
+                        if src != dst and src in node_index and dst in node_index})
+        n, m = len(nodes), len(edges)
+        edge_src = np.fromiter((e[0] for e in edges), dtype=np.int32, count=m)
+        edge_dst = np.fromiter((e[1] for e in edges), dtype=np.int32, count=m)
+        indptr = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(edge_src, minlength=n), out=indptr[1:])
+        edge_index = {(nodes[u], nodes[v]): i for i, (u, v) in enumerate(edges)}
+        reverse = np.fromiter((edge_index.get((nodes[v], nodes[u]), -1) for (u, v) in edges),
+                              dtype=np.int64, count=m)
+
+        # 复制仍然存在的链路的属性值
+        old_ids = np.fromiter((self.edge_index.get((nodes[u], nodes[v]), -1) for (u, v) in edges),
+                              dtype=np.int64, count=m)
+        kept = old_ids >= 0
+        weights = {}
+        for attr, default in self.attrs.items():
+            values = np.full(m, default, dtype=float)
+            values[kept] = self.weights[attr][old_ids[kept]]
+            weights[attr] = values
+
+        # 一次性替换所有数组, 读取方不会看到新旧混合的状态
+        self.nodes, self.node_index, self.edge_index = nodes, node_index, edge_index
+        self.indptr, self.indices, self.edge_src, self.edge_dst = indptr, edge_dst, edge_src, edge_dst
+        self.reverse = reverse
+        self.weights = weights
+
+    def edge_id(self, src: int, dst: int) -> Optional[int]:
+        return self.edge_index.get((src, dst))
+
+    def path_edge_ids(self, path: List[int]) -> Optional[np.ndarray]:
+        """
+        路径path经过的边下标数组, 路径中存在不在图中的链路时返回None
+        """
+        ids = np.empty(max(len(path) - 1, 0), dtype=np.int64)
+        for i in range(len(path) - 1):
+            eid = self.edge_index.get((path[i], path[i + 1]))
+            if eid is None:
+                return None
+            ids[i] = eid
+        return ids
+
+    def links(self) -> List[Tuple[int, int]]:
+        return [(self.nodes[u], self.nodes[v]) for u, v in zip(self.edge_src, self.edge_dst)]
+
+    def get_weight(self, attr: str, src: int, dst: int, default=None):
+        eid = self.edge_index.get((src, dst))
+        if eid is None:
+            return default
+        return self.weights[attr][eid]
+
+    def set_weight(self, attr: str, src: int, dst: int, value: float) -> bool:
+        """
+        设置单条链路的属性值, 链路不存在时返回False
+        """
+        eid = self.edge_index.get((src, dst))
+        if eid is None:
+            return False
+        self.weights[attr][eid] = value
+        return True
+
+    def set_weights(self, attr: str, values, edge_ids=None):
+        """
+        批量设置链路属性: edge_ids为None时values按边下标对齐覆盖整个数组
+        """
+        if edge_ids is None:
+            self.weights[attr][:] = values
+        else:
+            self.weights[attr][edge_ids] = values
+
+    def node_values(self, values: Dict[int, float], default=np.nan) -> np.ndarray:
+        """
+        将 dpid ——> 值 的字典转换为按节点下标对齐的数组
+        """
+        return np.fromiter((values.get(dpid, default) for dpid in self.nodes), dtype=float, count=self.n_nodes)
+
+    def matrix(self, attr: str) -> csr_matrix:
+        """
+        以属性attr为权重的邻接矩阵, nan与inf的链路视为不存在
+        """
+        weights = self.weights[attr]
+        usable = np.isfinite(weights)
+        if usable.all():
+            return csr_matrix((weights, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+        return csr_matrix((weights[usable], (self.edge_src[usable], self.edge_dst[usable])),
+                          shape=(self.n_nodes, self.n_nodes))
+
+    def shortest_path(self, src: int, dst: int, attr: str) -> Optional[List[int]]:
+        """
+        按属性attr计算src到dst的最短路径, 不可达时返回None
+        """
+        if src not in self.node_index or dst not in self.node_index:
+            return None
+        if src == dst:
+            return [src]
+        i, j = self.node_index[src], self.node_index[dst]
+        dist, predecessors = dijkstra(self.matrix(attr), directed=True, indices=i, return_predecessors=True)
+        if not np.isfinite(dist[j]):
+            return None
+        path = [j]
+        while path[-1] != i:
+            path.append(predecessors[path[-1]])
+        return [self.nodes[k] for k in reversed(path)]
+
+    def path_bottleneck(self, path: List[int], attr: str, default: float) -> float:
+        """
+        路径path上属性attr的最小值(例如瓶颈带宽), 忽略未测量(nan)的链路; 没有可用的链路时返回default
+        """
+        if len(path) < 2:
+            return default
+        ids = self.path_edge_ids(path)
+        if ids is None:
+            return default
+        values = self.weights[attr][ids]
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return default
+        return min(float(values.min()), default)
+
+
+class EdgeWeightBuffer:
+    """
+    CSRGraph 边属性attr的双缓冲写入:
+    - back: 写入方填充的后台数组, 与边下标对齐
+    - publish: 以一次引用赋值替换 graph.weights[attr], 原前台数组成为下一次写入的后台数组
+    读取方持有的数组引用在下一次 publish 之前不会被修改; 拓扑变化(边下标变化)后重新分配两个数组
+    """
+    def __init__(self, graph: CSRGraph, attr: str):
+        self.graph = graph
+        self.attr = attr
+        self.edge_index: Dict[Tuple[int, int], int] = None
+        self.buffers: List[np.ndarray] = []
+
+    def back(self) -> np.ndarray:
+        graph = self.graph
+        if self.edge_index is not graph.edge_index:
+            self.edge_index = graph.edge_index
+            self.buffers = [np.full(graph.n_edges, graph.attrs[self.attr]) for _ in range(2)]
+        return self.buffers[1]
+
+    def publish(self):
+        if self.edge_index is not self.graph.edge_index:
+            # 写入期间拓扑发生变化, 丢弃本次写入
+            return
+        front, back = self.buffers
+        self.graph.weights[self.attr] = back
+        self.buffers = [back, front]
+
+
+def changed_edges(old: np.ndarray, new: np.ndarray, rel_threshold: float, abs_threshold: float) -> np.ndarray:
+    """
+    权重变化超过 max(abs_threshold, rel_threshold*|原权重|) 或 是否可用(有限值)发生变化的链路
+    """
+    old_finite, new_finite = np.isfinite(old), np.isfinite(new)
+    both = old_finite & new_finite
+    changed = old_finite != new_finite
+    changed[both] = np.abs(new[both] - old[both]) > np.maximum(abs_threshold, rel_threshold * np.abs(old[both]))
+    return changed
+
+
+def predecessor_path(nodes: List[int], predecessors: np.ndarray, i: int, j: int) -> Optional[List[int]]:
+    """
+    按前驱矩阵回溯节点下标i到j的路径, 不可达时返回None
+    """
+    return row_path(nodes, predecessors[i], i, j)
+
+
+def row_path(nodes: List[int], row: np.ndarray, i: int, j: int) -> Optional[List[int]]:
+    """
+    按源节点i的一行前驱节点回溯i到j的路径, 不可达时返回None
+    """
+    if i == j:
+        return [nodes[i]]
+    if row[j] < 0:
+        return None
+    path = [j]
+    while path[-1] != i:
+        path.append(row[path[-1]])
+    return [nodes[k] for k in reversed(path)]
+
+
+class DelayPathCache:
+    """
+    按链路属性attr(默认时延)计算的全源最短路径缓存, 每个源交换机保存一行Dijkstra前驱节点, 查询时按前驱回溯路径
+    refresh 比较当前链路权重与上次计算时使用的权重:
+    - 拓扑变化: 重新计算所有源
+    - 有链路权重变小(或由不可用变为可用)且变化超过阈值: 任意路径都可能变短, 重新计算所有源
+    - 只有链路权重变大且变化超过阈值: 只重新计算最短路径树经过这些链路的源
+    变化不超过阈值的链路保留计算时使用的权重, 避免小幅波动累积后不再触发更新
+    计算完成后一次性替换 state, 读取方不会看到新旧混合的结果
+    rel_threshold/abs_threshold: 权重变化超过 max(abs_threshold, rel_threshold*原权重) 视为变化
+    """
+    def __init__(self, attr: str = PathEvaType.DELAY.value,
+                 rel_threshold: float = setting.DELAY_PATH_REL_THRESHOLD,
+                 abs_threshold: float = setting.DELAY_PATH_ABS_THRESHOLD):
+        self.attr = attr
+        self.rel_threshold = rel_threshold
+        self.abs_threshold = abs_threshold
+        # (nodes, node_index, edge_index, 前驱矩阵, 计算时使用的链路权重)
+        self.state: Tuple[List[int], Dict[int, int], Dict[Tuple[int, int], int], np.ndarray, np.ndarray] = None
+        self.version = 0
+        self.n_recomputed_sources = 0
+
+    def refresh(self, graph: CSRGraph) -> int:
+        """
+        按graph的最新链路权重更新缓存 return: 重新计算的源交换机数量
+        """
+        weights = graph.weights[self.attr].copy()
+        n = graph.n_nodes
+        state = self.state
+        if state is None or state[2] is not graph.edge_index:
+            sources = np.arange(n)
+            used_weights = weights
+            predecessors = np.full((n, n), -9999, dtype=np.int32)
+        else:
+            old_weights = state[4]
+            changed = changed_edges(old_weights, weights, self.rel_threshold, self.abs_threshold)
+            if not changed.any():
+                return 0
+            # 由不可用变为可用, 或者权重变小
+            decreased = changed & ~(weights >= old_weights) & np.isfinite(weights)
+            if decreased.any():
+                sources = np.arange(n)
+            else:
+                # 最短路径树经过变大链路(u->v)的源: predecessors[s, v] == u
+                increased = np.flatnonzero(changed)
+                predecessors = state[3]
+                uses = predecessors[:, graph.edge_dst[increased]] == graph.edge_src[increased]
+                sources = np.flatnonzero(uses.any(axis=1))
+            used_weights = state[4].copy()
+            used_weights[changed] = weights[changed]
+            predecessors = state[3].copy()
+        if len(sources) and graph.n_edges:
+            _, rows = dijkstra(self._matrix(graph, used_weights), directed=True, indices=sources,
+                               return_predecessors=True)
+            predecessors[sources] = rows
+        # 一次性替换
+        self.state = (graph.nodes, graph.node_index, graph.edge_index, predecessors, used_weights)
+        self.version += 1
+        self.n_recomputed_sources += len(sources)
+        return len(sources)
+
+    @staticmethod
+    def _matrix(graph: CSRGraph, weights: np.ndarray) -> csr_matrix:
+        usable = np.isfinite(weights)
+        return csr_matrix((weights[usable], (graph.edge_src[usable], graph.edge_dst[usable])),
+                          shape=(graph.n_nodes, graph.n_nodes))
+
+    def get_path(self, src: int, dst: int) -> Optional[List[int]]:
+        """
+        src到dst的最短路径, 缓存未计算或不可达时返回None
+        """
+        state = self.state
+        if state is None:
+            return None
+        nodes, node_index, _, predecessors, _ = state
+        i, j = node_index.get(src), node_index.get(dst)
+        if i is None or j is None:
+            return None
+        return predecessor_path(nodes, predecessors, i, j)
+
+
+class WidestPathEngine:
+    """
+    按链路属性attr(默认带宽)计算所有交换机对之间的最宽路径(瓶颈带宽最大的路径)
+    瓶颈带宽相同的路径中选择跳数最少的一条:
+    - 双向链路取两个方向的较小值作为无向链路带宽, 未测量(nan)的链路记为0
+    - Kruskal按带宽从大到小合并连通分量, 合并两个分量时两分量之间所有节点对的瓶颈带宽即为该链路带宽
+    - 合并时在带宽不小于该值的所有链路组成的子图上, 从较小分量的节点按跳数计算到另一分量节点的最短路径,
+      两个方向的路径互为反向
+    refresh 只在拓扑变化或有链路带宽变化超过 max(abs_threshold, rel_threshold*原带宽) 时重新计算
+    计算完成后一次性替换 state, version 加1
+    """
+    def __init__(self, attr: str = PathEvaType.BANDWIDTH.value,
+                 rel_threshold: float = setting.BW_PATH_REL_THRESHOLD,
+                 abs_threshold: float = setting.BW_PATH_ABS_THRESHOLD):
+        self.attr = attr
+        self.rel_threshold = rel_threshold
+        self.abs_threshold = abs_threshold
+        # (nodes, node_index, edge_index, 路径, 瓶颈带宽矩阵, 计算时使用的链路带宽)
+        # 路径: 节点下标i ——> Dict[节点下标j, i到j的最宽路径(dpid列表)]
+        self.state: Tuple[List[int], Dict[int, int], Dict[Tuple[int, int], int],
+                          List[Dict[int, List[int]]], np.ndarray, np.ndarray] = None
+        self.version = 0
+
+    def refresh(self, graph: CSRGraph) -> bool:
+        """
+        按graph的最新链路带宽更新最宽路径 return: 是否重新计算
+        """
+        weights = np.nan_to_num(graph.weights[self.attr], nan=0.0)
+        state = self.state
+        if state is not None and state[2] is graph.edge_index and \
+                not changed_edges(state[5], weights, self.rel_threshold, self.abs_threshold).any():
+            return False
+        n = graph.n_nodes
+        reverse = graph.reverse
+        undirected = (reverse >= 0) & (graph.edge_src < graph.edge_dst)
+        edge_ids = np.flatnonzero(undirected)
+        bandwidth = np.minimum(weights[edge_ids], weights[reverse[edge_ids]])
+        src, dst = graph.edge_src[edge_ids], graph.edge_dst[edge_ids]
+
+        nodes = graph.nodes
+        capacity = np.full((n, n), np.nan)
+        np.fill_diagonal(capacity, setting.MAX_CAPACITY)
+        paths: List[Dict[int, List[int]]] = [{i: [nodes[i]]} for i in range(n)]
+        component = np.arange(n)
+        members: Dict[int, List[int]] = {i: [i] for i in range(n)}
+        order = np.argsort(-bandwidth, kind='stable')
+        merged, start = 0, 0
+        # 按带宽分组处理, 同一带宽的链路同时加入子图
+        while start < len(order) and merged < n - 1:
+            value = bandwidth[order[start]]
+            end = start + 1
+            while end < len(order) and bandwidth[order[end]] == value:
+                end += 1
+            subgraph = None
+            for e in order[start:end]:
+                a, b = component[src[e]], component[dst[e]]
+                if a == b:
+                    continue
+                if len(members[a]) < len(members[b]):
+                    a, b = b, a
+                group_a, group_b = members[a], members.pop(b)
+                capacity[np.ix_(group_a, group_b)] = value
+                capacity[np.ix_(group_b, group_a)] = value
+                if subgraph is None:
+                    kept = order[:end]
+                    subgraph = csr_matrix((np.ones(end), (src[kept], dst[kept])), shape=(n, n))
+                _, predecessors = dijkstra(subgraph, directed=False, unweighted=True,
+                                           indices=group_b, return_predecessors=True)
+                for row, i in zip(predecessors, group_b):
+                    for j in group_a:
+                        path = row_path(nodes, row, i, j)
+                        paths[i][j] = path
+                        paths[j][i] = path[::-1]
+                component[group_b] = a
+                group_a.extend(group_b)
+                merged += 1
+            start = end
+
+        # 一次性替换
+        self.state = (nodes, graph.node_index, graph.edge_index, paths, capacity, weights)
+        self.version += 1
+        return True
+
+    def get_path(self, src: int, dst: int) -> Optional[List[int]]:
+        state = self.state
+        if state is None:
+            return None
+        node_index, paths = state[1], state[3]
+        i, j = node_index.get(src), node_index.get(dst)
+        if i is None or j is None:
+            return None
+        return paths[i].get(j)
+
+    def get_capacity(self, src: int, dst: int) -> float:
+        """
+        src到dst最宽路径的瓶颈带宽, 不可达时为nan
+        """
+        state = self.state
+        if state is None:
+            return np.nan
+        node_index, capacity = state[1], state[4]
+        i, j = node_index.get(src), node_index.get(dst)
+        if i is None or j is None:
+            return np.nan
+        return float(capacity[i, j])
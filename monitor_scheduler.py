@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Dict
+import time
+import setting
+
+"""
+按交换机流量变化程度自适应调整统计信息的请求周期
+"""
+
+
+class AdaptivePollScheduler:
+    """
+    每个交换机有自己的请求周期:
+    - observe 报告的变化程度超过 threshold: 周期减半(不小于min_period), 并提前下一次请求
+    - 否则: 周期乘以 backoff(不大于max_period)
+    period: 新连接交换机的初始周期(s)
+    clock: 时间函数, 默认 time.monotonic
+    """
+    def __init__(self, period: float = setting.MONITOR_PERIOD,
+                 min_period: float = setting.MONITOR_MIN_PERIOD,
+                 max_period: float = setting.MONITOR_MAX_PERIOD,
+                 threshold: float = setting.MONITOR_VOLATILITY_THRESHOLD,
+                 backoff: float = setting.MONITOR_BACKOFF_FACTOR,
+                 clock=time.monotonic):
+        self.initial_period = min(max(period, min_period), max_period)
+        self.min_period = min_period
+        self.max_period = max_period
+        self.threshold = threshold
+        self.backoff = backoff
+        self.clock = clock
+        # dpid ——> 当前请求周期
+        self.periods: Dict[int, float] = {}
+        # dpid ——> 上一次/下一次请求时间
+        self.last_poll: Dict[int, float] = {}
+        self.next_poll: Dict[int, float] = {}
+
+    def period(self, dpid: int) -> float:
+        return self.periods.get(dpid, self.initial_period)
+
+    def due(self, dpid: int, now: float = None) -> bool:
+        """
+        dpid 是否应当在now请求统计信息, 返回True时记录本次请求并安排下一次请求
+        """
+        now = self.clock() if now is None else now
+        if self.next_poll.get(dpid, now) > now:
+            return False
+        period = self.periods.setdefault(dpid, self.initial_period)
+        self.last_poll[dpid] = now
+        self.next_poll[dpid] = now + period
+        return True
+
+    def next_due(self, now: float = None) -> float:
+        """
+        距离最早一次到期请求的时间(s), 没有交换机时返回 min_period
+        """
+        now = self.clock() if now is None else now
+        if not self.next_poll:
+            return self.min_period
+        return max(min(self.next_poll.values()) - now, 0.0)
+
+    def observe(self, dpid: int, volatility: float) -> float:
+        """
+        报告dpid最近一次统计的流量变化程度 return: 调整后的请求周期
+        """
+        period = self.period(dpid)
+        if volatility > self.threshold:
+            period = max(self.min_period, period / 2)
+        else:
+            period = min(self.max_period, period * self.backoff)
+        self.periods[dpid] = period
+        if dpid in self.last_poll:
+            self.next_poll[dpid] = self.last_poll[dpid] + period
+        return period
+
+    def forget(self, dpid: int):
+        self.periods.pop(dpid, None)
+        self.last_poll.pop(dpid, None)
+        self.next_poll.pop(dpid, None)
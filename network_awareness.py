@@ -28,10 +28,7 @@ from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import CONFIG_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import arp
+from ryu.lib.packet import ether_types
 from ryu.lib import hub
 
 from ryu.topology import event, switches
@@ -40,6 +37,11 @@ from ryu.topology.api import get_switch, get_link
 import numpy as np
 from typing import List, Tuple, Dict, Set
 import setting
+from path_store import IncrementalPathStore, ParallelPathEngine
+from graph_backend import CSRGraph, DelayPathCache
+from packet_classifier import PacketInDispatcher, ClassifiedPacket
+from arp_proxy import ArpProxy
+import path_store
 
 import matplotlib.pyplot as plt
 import networkx as nx
@@ -67,6 +69,11 @@ class NetworkAwareness(app_manager.RyuApp):
         self.link_to_port: Dict[Tuple[int, int], Tuple[int, int]] = {}          # (src_dpid,dst_dpid)->(src_port,dst_port)
         # access_table 以字典存储主机host的接入信息
         self.access_table: Dict[Tuple[int, int], Tuple[str, str]] = {}                # {(sw,port) :(host-ip, mac)}
+        # access_table 的反向索引, 由 register_access_info 维护
+        self.ip_to_location: Dict[str, Tuple[int, int]] = {}                   # {host-ip: (sw,port)}
+        self.ip_to_mac: Dict[str, str] = {}                                    # {host-ip: mac}
+        # 控制器代答ARP的 IP——>MAC 缓存(带有效期), 由 register_access_info 写入
+        self.arp_proxy = ArpProxy()
         # switch_port_table 以字典存储交换机端口列表
         self.switch_port_table: Dict[int, Set[int]] = {}  # dpip->set(port_num)
         # access_ports 以字典存储交换机外部端口列表
@@ -75,6 +82,8 @@ class NetworkAwareness(app_manager.RyuApp):
         self.interior_ports: Dict[int, Set[int]] = {}     # dpid->set(port_num)
 
         self.graph = nx.DiGraph()
+        # 与graph拓扑一致的CSR存储, 保存链路的 hop/delay/bw/lldpdelay 属性, 供路径查询与批量更新使用
+        self.csr_graph = CSRGraph()
         # pre_graph 上一次获取的图实例
         self.pre_graph = nx.DiGraph()
         # pre_access_table 上一次获取的主机接入信息
@@ -87,6 +96,19 @@ class NetworkAwareness(app_manager.RyuApp):
         # value: Dict[dst-dpid, List[path]]
         # path= List[dpid], path是由交换机dpid组成的元素列表例如[0, 1, 2, 3]
         self.shortest_paths: Dict[int, Dict[int, List[List[int]]]] = None
+        # 增量维护k最短路径, 拓扑变化时只重新计算受影响的源交换机
+        # PATH_ENGINE_WORKERS > 0 时按源交换机划分任务在进程池中并行计算, 等待结果时让出hub
+        path_engine = ParallelPathEngine(setting.PATH_ENGINE_WORKERS) if setting.PATH_ENGINE_WORKERS > 0 else None
+        self.path_store = IncrementalPathStore(k=CONF.k_paths, weight='weight', engine=path_engine,
+                                               wait=lambda: hub.sleep(0.01))
+        # 按链路时延计算的最短路径, 由时延探测线程在每轮测量后增量更新
+        self.delay_path_cache = DelayPathCache()
+        # 合并短时间内成批到达的拓扑事件, 只执行一次拓扑更新
+        self.topology_update_thread = None
+        self.topology_updating = False
+        # 所有应用共用的packet_in分发器: 报文只在这里接收并分类一次, 再交给感兴趣的应用处理
+        self.packet_in_dispatcher = PacketInDispatcher()
+        self.packet_in_dispatcher.observe(ether_types.ETH_TYPE_ARP, self._arp_learning_handler)
 
         # Start a green thread to discover network resource.
         self.discover_thread = hub.spawn(self._discover)
@@ -118,10 +140,16 @@ class NetworkAwareness(app_manager.RyuApp):
                 # print(f"self.graph.edges:{self.graph.edges(data=True)}")
                 for u, v, data in self.graph.edges(data=True):
                     # print(f"self.weight: {self.weight} , {u}———>{v}, graph data: {data}")
-                    if self.weight not in data.keys():
+                    # 时延与带宽属性保存在csr_graph中, 自环不显示
+                    if self.weight == setting.WEIGHT_MODEL['hop']:
+                        weight_value = data.get(self.weight)
+                    elif u == v:
+                        continue
+                    else:
+                        weight_value = self.csr_graph.get_weight(self.weight, u, v)
+                    if weight_value is None:
                         label = False
                         break
-                    weight_value = data[self.weight]
                     
                     if self.weight == setting.WEIGHT_MODEL['hop']:
                         # edge_labels[(u, v)] = f"({u}->{v}) hop:{weight_value}"  # 将节点和权重标签放在一起显示
@@ -183,11 +211,13 @@ class NetworkAwareness(app_manager.RyuApp):
         """
             Get host location info:(datapath, port) according to host ip.
         """
-        for key in self.access_table.keys():
-            if self.access_table[key][0] == host_ip:
-                return key
-        # self.logger.info("%s location is not found." % host_ip)
-        return None
+        return self.ip_to_location.get(host_ip)
+
+    def get_host_mac(self, host_ip):
+        """
+            Get host mac according to host ip.
+        """
+        return self.ip_to_mac.get(host_ip)
 
     def get_switches(self):
         return self.switches
@@ -206,6 +236,10 @@ class NetworkAwareness(app_manager.RyuApp):
                     self.graph.add_edge(src, dst, weight=0)
                 elif (src, dst) in link_list:
                     self.graph.add_edge(src, dst, weight=1)
+        # 删除已经不存在的链路
+        for (src, dst) in list(self.graph.edges()):
+            if src != dst and (src, dst) not in link_list:
+                self.graph.remove_edge(src, dst)
         return self.graph
 
     def create_port_map(self, switch_list):
@@ -226,9 +260,11 @@ class NetworkAwareness(app_manager.RyuApp):
             Get links`srouce port to dst port  from link_list,
             link_to_port:(src_dpid,dst_dpid)->(src_port,dst_port)
         """
+        current_links = set()
         for link in link_list:
             src = link.src
             dst = link.dst
+            current_links.add((src.dpid, dst.dpid))
             self.link_to_port[
                 (src.dpid, dst.dpid)] = (src.port_no, dst.port_no)
 
@@ -237,6 +273,10 @@ class NetworkAwareness(app_manager.RyuApp):
                 self.interior_ports[link.src.dpid].add(link.src.port_no)
             if link.dst.dpid in self.switches:
                 self.interior_ports[link.dst.dpid].add(link.dst.port_no)
+        # 删除已经消失的链路
+        for link in list(self.link_to_port.keys()):
+            if link not in current_links:
+                del self.link_to_port[link]
 
     def create_access_ports(self):
         """
@@ -252,18 +292,7 @@ class NetworkAwareness(app_manager.RyuApp):
             Great K shortest paths of src to dst.
         """
         # weight参数定义边属性的名称，该属性值用于计算最短路径
-        generator = nx.shortest_simple_paths(graph, source=src,
-                                             target=dst, weight=weight)
-        shortest_paths = []
-        try:
-            for path in generator:
-                if k <= 0:
-                    break
-                shortest_paths.append(path)
-                k -= 1
-            return shortest_paths
-        except:
-            self.logger.debug("No path between %s and %s" % (src, dst))
+        return path_store.k_shortest_paths(graph, src, dst, weight=weight, k=k)
 
     def all_k_shortest_paths(self, graph, weight='weight', k=1):
         """
@@ -293,7 +322,26 @@ class NetworkAwareness(app_manager.RyuApp):
     def get_topology(self, ev):
         """
             Get topology info and calculate shortest paths.
+            拓扑事件往往成批到达, TOPOLOGY_DEBOUNCE_PERIOD 内到达的事件合并为一次拓扑更新
         """
+        if self.topology_update_thread is None:
+            self.topology_update_thread = hub.spawn_after(setting.TOPOLOGY_DEBOUNCE_PERIOD,
+                                                          self._update_topology)
+
+    def _update_topology(self):
+        # 更新期间到达的新事件会重新调度一次更新
+        self.topology_update_thread = None
+        if self.topology_updating:
+            # 上一次更新还在等待并行计算结果, 稍后再更新
+            self.get_topology(None)
+            return
+        self.topology_updating = True
+        try:
+            self._do_update_topology()
+        finally:
+            self.topology_updating = False
+
+    def _do_update_topology(self):
         switch_list = get_switch(self.topology_api_app, None)
         self.create_port_map(switch_list)
         self.switches = self.switch_port_table.keys()
@@ -303,49 +351,53 @@ class NetworkAwareness(app_manager.RyuApp):
         self.create_access_ports()
         # 创建networkx实例
         self.get_graph(self.link_to_port.keys())
-        # 计算k条最短路径
-        self.shortest_paths = self.all_k_shortest_paths(
-            self.graph, weight='weight', k=CONF.k_paths)
+        self.csr_graph.rebuild(self.graph.nodes(), self.link_to_port.keys())
+        # 增量计算k条最短路径, 只重新计算受拓扑变化影响的源交换机
+        self.path_store.update(self.graph)
+        self.shortest_paths = self.path_store.paths
+        if CONF.weight == 'delay':
+            self.delay_path_cache.refresh(self.csr_graph)
 
     def register_access_info(self, dpid, in_port, ip, mac):
         """
             Register access host info into access table.
         """
         if in_port in self.access_ports[dpid]:
-            if (dpid, in_port) in self.access_table:
-                if self.access_table[(dpid, in_port)] == (ip, mac):
-                    return
-                else:
-                    self.access_table[(dpid, in_port)] = (ip, mac)
-                    return
-            else:
-                self.access_table.setdefault((dpid, in_port), None)
-                self.access_table[(dpid, in_port)] = (ip, mac)
+            location = (dpid, in_port)
+            # 主机每次发送ARP都刷新代答缓存的有效期
+            self.arp_proxy.learn(ip, mac)
+            old_host = self.access_table.get(location)
+            if old_host == (ip, mac):
                 return
+            # 该端口之前接入的是其他主机, 删除旧主机的索引
+            if old_host is not None and self.ip_to_location.get(old_host[0]) == location:
+                del self.ip_to_location[old_host[0]]
+                self.ip_to_mac.pop(old_host[0], None)
+                if old_host[0] != ip:
+                    self.arp_proxy.forget(old_host[0])
+            # 主机迁移到了新的端口, 删除旧的接入信息
+            old_location = self.ip_to_location.get(ip)
+            if old_location is not None and old_location != location:
+                self.access_table.pop(old_location, None)
+            self.access_table[location] = (ip, mac)
+            self.ip_to_location[ip] = location
+            self.ip_to_mac[ip] = mac
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
         """
-            Hanle the packet in packet, and register the access info.
+            Classify the packet in packet once and dispatch it to the interested apps.
         """
-        msg = ev.msg
-        datapath = msg.datapath
+        self.packet_in_dispatcher.dispatch(ev)
 
-        parser = datapath.ofproto_parser
-        in_port = msg.match['in_port']
-        pkt = packet.Packet(msg.data)
-
-        eth_type = pkt.get_protocols(ethernet.ethernet)[0].ethertype
-        arp_pkt = pkt.get_protocol(arp.arp)
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-
-        if arp_pkt:
-            arp_src_ip = arp_pkt.src_ip
-            arp_dst_ip = arp_pkt.dst_ip
-            mac = arp_pkt.src_mac
-            # print(f"arp_pkt_in src_ip:{arp_src_ip} dst_ip{arp_dst_ip} src_mac{mac}" )
-            # Record the access info
-            self.register_access_info(datapath.id, in_port, arp_src_ip, mac)
+    def _arp_learning_handler(self, ev, pkt: ClassifiedPacket):
+        """
+            Register the access info of the ARP sender.
+        """
+        msg = ev.msg
+        # print(f"arp_pkt_in src_ip:{pkt.src_ip} dst_ip{pkt.dst_ip} src_mac{pkt.src_mac}" )
+        # Record the access info
+        self.register_access_info(msg.datapath.id, msg.match['in_port'], pkt.src_ip, pkt.src_mac)
         
 
 
@@ -27,8 +27,9 @@ from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import hub
-from ryu.topology.switches import Switches
+from ryu.topology.switches import Switches, Port, PortData
 from ryu.topology.switches import LLDPPacket
+from ryu.lib.packet import ether_types
 from ryu.ofproto import ofproto_v1_0
 from ryu.ofproto import ofproto_v1_2
 from ryu.ofproto import ofproto_v1_3
@@ -36,6 +37,8 @@ from ryu.ofproto import ofproto_v1_4
 
 
 import networkx as nx
+import numpy as np
+import struct
 import time
 import setting
 from setting import StatsType, PathEvaType
@@ -43,12 +46,18 @@ from setting import StatsType, PathEvaType
 from typing import List, Tuple, Dict, Set
 from network_awareness import NetworkAwareness
 import network_awareness
+from packet_classifier import ClassifiedPacket
+from delay_estimator import DelayEstimator
 
 
 LOG = logging.getLogger(__name__)
 
 CONF = cfg.CONF
 
+# echo请求的数据: 标识 + 序号, 发送时间记录在控制器本地
+ECHO_PAYLOAD = struct.Struct('!4sI')
+ECHO_MAGIC = b'CPNe'
+
 
 class NetworkDelayDetector(app_manager.RyuApp):
     """
@@ -78,6 +87,12 @@ class NetworkDelayDetector(app_manager.RyuApp):
         # key: dpid
         # value: time(s)
         self.echo_latency: Dict[int, float] = {}
+        # echo时延样本的平滑估计 key: dpid
+        self.echo_estimator = DelayEstimator()
+        # 已发送尚未收到回复的echo请求 (dpid, 序号) ——> 发送时的单调时钟时间
+        self.echo_pending: Dict[Tuple[int, int], float] = {}
+        self.echo_seq = 0
+        self.echo_timeouts = 0
 
         # 记录LLDP数据报文总时间 即
         # 0. controller 向所有交换机下发流表： 当接收到目的MAC地址为最近相邻交换机的LLDP报文时，不缓存该LLDP报文，全部上传给控制器(switches.py中实现)
@@ -90,6 +105,13 @@ class NetworkDelayDetector(app_manager.RyuApp):
         # key: Tuple[src-dpid, dst-dpid] 标识链路
         # value: float 存储链路时延
         self.cssc_link_lldp_delay: Dict[Tuple[int, int], float] = {}
+        # LLDP时延样本的平滑估计 key: Tuple[src-dpid, dst-dpid]
+        self.lldp_estimator = DelayEstimator()
+        # switches模块端口的索引 (dpid, port_no) ——> Port, switches模块的端口数量变化时重建
+        self.port_index: Dict[Tuple[int, int], Port] = {}
+        self.port_index_size = -1
+        # 只接收 awareness 分发的LLDP报文, 其他报文不再尝试按LLDP解析
+        self.awareness.packet_in_dispatcher.register(ether_types.ETH_TYPE_LLDP, self.packet_in_handler)
         self.measure_thread = hub.spawn(self._detector)
 
         self._init_switch_interior()
@@ -109,21 +131,29 @@ class NetworkDelayDetector(app_manager.RyuApp):
             if datapath.id in self.datapaths:
                 self.logger.debug('Unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
+                self.echo_estimator.forget(datapath.id)
+                self.echo_latency.pop(datapath.id, None)
 
     @set_ev_cls(ofp_event.EventOFPEchoReply, MAIN_DISPATCHER)
     def echo_reply_handler(self, ev):
         """
             Handle the echo reply msg, and get the latency of link.
         """
-        now_timestamp = time.time()
+        now_timestamp = time.monotonic()
         try:
-            latency = now_timestamp - eval(ev.msg.data)
-            self.echo_latency[ev.msg.datapath.id] = latency
-        except:
+            magic, seq = ECHO_PAYLOAD.unpack_from(ev.msg.data)
+        except (struct.error, TypeError):
+            return
+        dpid = ev.msg.datapath.id
+        # 按序号匹配请求, 多个请求同时在途时互不影响
+        send_timestamp = self.echo_pending.pop((dpid, seq), None)
+        if magic != ECHO_MAGIC or send_timestamp is None:
+            # 不是本模块发送的echo请求 或 已超时
             return
+        latency = max(now_timestamp - send_timestamp, 0)
+        self.echo_latency[dpid] = self.echo_estimator.add(dpid, latency)
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def packet_in_handler(self, ev):
+    def packet_in_handler(self, ev, pkt: ClassifiedPacket):
         """
             Parsing LLDP packet and get the delay of link.
         """
@@ -135,8 +165,7 @@ class NetworkDelayDetector(app_manager.RyuApp):
             # 控制器下发LLDP packet-out的目的交换机
             src_dpid, src_port_no = LLDPPacket.lldp_parse(msg.data)
         except LLDPPacket.LLDPUnknownFormat:
-            # This handler can receive all the packets which can be
-            # not-LLDP packet. Ignore it silently
+            # LLDP packets not sent by the switches app. Ignore it silently
             return
         
         # 记录向交换机发送LLDP数据报文的源交换机及其发送端口
@@ -150,19 +179,43 @@ class NetworkDelayDetector(app_manager.RyuApp):
                       msg.datapath.ofproto.OFP_VERSION)
             
         # 存储 cssc link时延
-        if (src_dpid, dst_dpid) in self.awareness.link_to_port.keys():
-            if self.sw_module is None:
-                self.sw_module = lookup_service_brick('switches')
-            for port in self.sw_module.ports.keys():
-                if src_dpid == port.dpid and src_port_no == port.port_no:
-                    send_timestamp = self.sw_module.ports[port].timestamp
-                    if send_timestamp:
-                        delay = max(recv_timestamp - send_timestamp, 0)
-                        self.cssc_link_lldp_delay[(src_dpid, dst_dpid)] = delay
-                        self._save_lldp_delay(src=src_dpid, dst=dst_dpid, lldpdelay=delay)
+        if (src_dpid, dst_dpid) in self.awareness.link_to_port:
+            port_data = self.get_port_data(src_dpid, src_port_no)
+            if port_data is not None and port_data.timestamp:
+                sample = max(recv_timestamp - port_data.timestamp, 0)
+                # 保存平滑后的时延, 异常样本不影响估计值
+                delay = self.lldp_estimator.add((src_dpid, dst_dpid), sample)
+                self.cssc_link_lldp_delay[(src_dpid, dst_dpid)] = delay
+                self._save_lldp_delay(src=src_dpid, dst=dst_dpid, lldpdelay=delay)
         else:
             LOG.debug(f'cannot find link{(src_dpid, dst_dpid)} in network awareness link_to_port dict')
 
+    def get_port_data(self, dpid, port_no) -> PortData:
+        """
+            switches模块记录的端口数据(含LLDP发送时间戳), 通过 (dpid, port_no) 索引查找
+        """
+        if self.sw_module is None:
+            self.sw_module = lookup_service_brick('switches')
+            if self.sw_module is None:
+                return None
+        ports = self.sw_module.ports
+        port = self.port_index.get((dpid, port_no))
+        if port is None and len(ports) != self.port_index_size:
+            self.port_index = {(port.dpid, port.port_no): port for port in ports.keys()}
+            self.port_index_size = len(ports)
+            port = self.port_index.get((dpid, port_no))
+        if port is None:
+            return None
+        return ports.get(port)
+
+    def get_link_jitter(self, src, dst):
+        """
+            链路时延抖动: 正反两个方向LLDP时延样本抖动的平均值, 没有样本时返回nan
+        """
+        jitters = [self.lldp_estimator.jitter((src, dst)), self.lldp_estimator.jitter((dst, src))]
+        jitters = [jitter for jitter in jitters if not np.isnan(jitter)]
+        return sum(jitters) / len(jitters) if jitters else np.nan
+
     def _init_switch_interior(self):
         for node in self.awareness.graph.nodes:
             self.self.awareness.graph[node][node][PathEvaType.DELAY] = setting.SWITCH_INTERIOR_DELAY
@@ -176,8 +229,9 @@ class NetworkDelayDetector(app_manager.RyuApp):
             self._send_echo_request()
             self.create_link_delay()
             try:
-                self.awareness.shortest_paths = {}
-                self.logger.debug("Refresh the shortest_paths")
+                # 只重新计算经过时延变化超过阈值的链路的路径, 计算完成后整体替换, packet_in 不会遇到空缓存
+                n_sources = self.awareness.delay_path_cache.refresh(self.awareness.csr_graph)
+                self.logger.debug("Refresh the delay paths of %d sources", n_sources)
             except:
                 self.awareness = lookup_service_brick('awareness')
             if setting.TOSHOW:
@@ -187,17 +241,41 @@ class NetworkDelayDetector(app_manager.RyuApp):
     def _send_echo_request(self):
         """
             Seng echo request msg to datapath.
+            一轮探测均匀分布在 ECHO_PROBE_WINDOW 内: 交换机较少时相邻请求间隔 ECHO_REQUEST_INTERVAL,
+            交换机较多时分批发送, 批次间隔不小于 ECHO_MIN_INTERVAL
         """
-        for datapath in self.datapaths.values():
-            parser = datapath.ofproto_parser
-            echo_req = parser.OFPEchoRequest(datapath, data=bytes("%.12f" % time.time(), encoding="utf8" ))
-            datapath.send_msg(echo_req)
-            # Important! Don't send echo request together, Because it will
-            # generate a lot of echo reply almost in the same time.
-            # which will generate a lot of delay of waiting in queue
-            # when processing echo reply in echo_reply_handler.
+        self._expire_echo_requests()
+        datapaths = list(self.datapaths.values())
+        if not datapaths:
+            return
+        # Important! Don't send echo request together, Because it will
+        # generate a lot of echo reply almost in the same time.
+        # which will generate a lot of delay of waiting in queue
+        # when processing echo reply in echo_reply_handler.
+        interval = min(setting.ECHO_REQUEST_INTERVAL, setting.ECHO_PROBE_WINDOW / len(datapaths))
+        n_batches = len(datapaths)
+        if interval < setting.ECHO_MIN_INTERVAL:
+            interval = setting.ECHO_MIN_INTERVAL
+            n_batches = max(int(setting.ECHO_PROBE_WINDOW / interval), 1)
+        batch_size = -(-len(datapaths) // n_batches)
+        for start in range(0, len(datapaths), batch_size):
+            for datapath in datapaths[start:start + batch_size]:
+                self._send_echo(datapath)
+            hub.sleep(interval)
+
+    def _send_echo(self, datapath):
+        self.echo_seq = (self.echo_seq + 1) & 0xffffffff
+        parser = datapath.ofproto_parser
+        echo_req = parser.OFPEchoRequest(datapath, data=ECHO_PAYLOAD.pack(ECHO_MAGIC, self.echo_seq))
+        self.echo_pending[(datapath.id, self.echo_seq)] = time.monotonic()
+        datapath.send_msg(echo_req)
 
-            hub.sleep(setting.ECHO_REQUEST_INTERVAL)
+    def _expire_echo_requests(self):
+        deadline = time.monotonic() - setting.ECHO_REPLY_TIMEOUT
+        expired = [key for key, timestamp in self.echo_pending.items() if timestamp < deadline]
+        for key in expired:
+            del self.echo_pending[key]
+        self.echo_timeouts += len(expired)
 
     def get_delay(self, src, dst):
         """
@@ -212,41 +290,39 @@ class NetworkDelayDetector(app_manager.RyuApp):
                         <----reply_delay
             delay = (forward delay + reply delay - src datapath's echo latency
         """
-        try:
-            fwd_delay = self.awareness.graph[src][dst][PathEvaType.LLDPDELAY.value]
-            re_delay = self.awareness.graph[dst][src][PathEvaType.LLDPDELAY.value]
-            src_latency = self.echo_latency[src]
-            dst_latency = self.echo_latency[dst]
-            
-            delay = (fwd_delay + re_delay - src_latency - dst_latency)/2
-            return max(delay, 0)
-        except:
+        csr_graph = self.awareness.csr_graph
+        fwd_delay = csr_graph.get_weight(PathEvaType.LLDPDELAY.value, src, dst, default=np.nan)
+        re_delay = csr_graph.get_weight(PathEvaType.LLDPDELAY.value, dst, src, default=np.nan)
+        src_latency = self.echo_latency.get(src, np.nan)
+        dst_latency = self.echo_latency.get(dst, np.nan)
+        delay = (fwd_delay + re_delay - src_latency - dst_latency)/2
+        if np.isnan(delay):
             return float('inf')
+        return max(delay, 0)
 
     def _save_lldp_delay(self, src=0, dst=0, lldpdelay=0):
-        try:
-            self.awareness.graph[src][dst][PathEvaType.LLDPDELAY.value] = lldpdelay
-        except:
-            if self.awareness is None:
-                self.awareness = lookup_service_brick('awareness')
+        if self.awareness is None:
+            self.awareness = lookup_service_brick('awareness')
             return
+        self.awareness.csr_graph.set_weight(PathEvaType.LLDPDELAY.value, src, dst, lldpdelay)
 
     def create_link_delay(self):
         """
-            Create link delay data, and save it into graph object.
+            Create link delay data, and save it into the csr graph of awareness.
+            按边下标一次计算所有链路的时延, 缺少测量值的链路时延为inf
         """
-        try:
-            for src in self.awareness.graph:
-                for dst in self.awareness.graph[src]:
-                    if src == dst:
-                        self.awareness.graph[src][dst][PathEvaType.DELAY.value] = 0
-                        continue
-                    delay = self.get_delay(src, dst)
-                    self.awareness.graph[src][dst][PathEvaType.DELAY.value] = delay
-        except:
-            if self.awareness is None:
-                self.awareness = lookup_service_brick('awareness')
+        if self.awareness is None:
+            self.awareness = lookup_service_brick('awareness')
             return
+        csr_graph = self.awareness.csr_graph
+        lldp_delay = csr_graph.weights[PathEvaType.LLDPDELAY.value]
+        echo_latency = csr_graph.node_values(self.echo_latency)
+        has_reverse = csr_graph.reverse >= 0
+        re_delay = np.full(csr_graph.n_edges, np.nan)
+        re_delay[has_reverse] = lldp_delay[csr_graph.reverse[has_reverse]]
+        delay = (lldp_delay + re_delay - echo_latency[csr_graph.edge_src] - echo_latency[csr_graph.edge_dst]) / 2
+        delay = np.where(np.isnan(delay), np.inf, np.maximum(delay, 0))
+        csr_graph.set_weights(PathEvaType.DELAY.value, delay)
 
     # def show_delay_statis(self):
     #     if setting.TOSHOW and self.awareness is not None:
@@ -261,7 +337,7 @@ class NetworkDelayDetector(app_manager.RyuApp):
         if setting.TOSHOW and self.awareness is not None:
             print("\n src   dst      delay")
             print("---------------------------")
-            for src in self.awareness.graph:
-                for dst in self.awareness.graph[src]:
-                    delay = self.awareness.graph[src][dst][PathEvaType.DELAY.value]
-                    print("%s<-->%s : %s" % (src, dst, delay))
\ No newline at end of file
+            csr_graph = self.awareness.csr_graph
+            delays = csr_graph.weights[PathEvaType.DELAY.value]
+            for (src, dst), delay in zip(csr_graph.links(), delays):
+                print("%s<-->%s : %s" % (src, dst, delay))
@@ -15,7 +15,7 @@
 # limitations under the License.
 
 from __future__ import division
-import copy
+import time
 from operator import attrgetter
 from ryu import cfg
 from ryu.base import app_manager
@@ -38,6 +38,10 @@ from network_awareness import NetworkAwareness
 import network_awareness
 from typing import List, Tuple, Dict, Set
 import networkx as nx
+import numpy as np
+from graph_backend import CSRGraph, EdgeWeightBuffer, WidestPathEngine
+from stats_buffer import StatsRingBuffer
+from monitor_scheduler import AdaptivePollScheduler
 
 CONF = cfg.CONF
 
@@ -59,27 +63,25 @@ class NetworkMonitor(app_manager.RyuApp):
         # 记录与控制器连接的Datapath dpid——>Datapath class
         self.datapaths: Dict[int, Datapath] = {}
 
-        # 保存端口统计信息
-        # Dict[key, value]
-        # key: Tuple[dpid, port_no] 标识唯一端口
-        # value: List[Tuple[tx_bytes rx_bytes, rx_errors, duration_sec, duration_nsec]] 存储端口统计信息
-        self.port_stats: Dict[Tuple[int, int], List[Tuple[int, int, int, int, int]]] = {}
-
-        # 保存端口速率信息
-        # Dict[key, value]
+        # 保存端口统计信息与端口速率 环形缓冲区
         # key: Tuple[dpid, port_no] 标识唯一端口
-        # value: List[float] 存储端口统计信息 speed bytes/s
-        self.port_speed: Dict[Tuple[int, int], List[float]] = {}
+        # 每个端口保存最近 STATS_HISTORY_LENGTH 次的 tx_bytes+rx_bytes, 统计时长(s) 以及速率 speed bytes/s
+        self.port_stats: StatsRingBuffer = StatsRingBuffer()
 
-        # 保存流统计信息 Dict[dpid, Dict[key, value]] 
+        # 保存流统计信息与流速率 Dict[dpid, 环形缓冲区]
         # key：Tuple[in_port, ipv4_dst, out_port] 用于标识流
-        # value: List[Tuple[packet_count, byte_count, duration_sec, duration_nsec]]用于存储流统计消息列表
-        self.flow_stats:  Dict[int, Dict[Tuple[int, str, int], List[Tuple[int, int, int, int]]]]  = {}
+        # 每条流保存最近 STATS_HISTORY_LENGTH 次的 byte_count, 统计时长(s) 以及速率 speed bytes/s
+        self.flow_stats: Dict[int, StatsRingBuffer] = {}
+        # 多段流统计回复中已出现的流, 回复结束后删除不再出现的流的记录
+        self.flow_stats_seen: Dict[int, Set[Tuple[int, str, int]]] = {}
 
-        # 保存流速率信息 Dict[dpid, Dict[key, value]] 
-        # key：Tuple[in_port, ipv4_dst, out_port] 用于标识流
-        # value: List[speed]用于存储流统计消息列表 speed： bytes/s
-        self.flow_speed: Dict[int, Dict[Tuple[int, str, int], List[float]]]  = {}
+        # 按应用汇总的流统计信息与速率 环形缓冲区
+        # key: Tuple[dpid, FlowCookie.name] 每个交换机上每个应用下发的全部流表项
+        self.aggregate_stats: StatsRingBuffer = StatsRingBuffer()
+        # 每个应用最近一次的流表项数量 Dict[dpid, Dict[FlowCookie.name, flow_count]]
+        self.aggregate_flow_count: Dict[int, Dict[str, int]] = {}
+        # 已发送未回复的汇总统计请求 Dict[dpid, Dict[xid, FlowCookie]], 汇总回复中不含cookie, 按xid对应
+        self.aggregate_requests: Dict[int, Dict[int, setting.FlowCookie]] = {}
 
 
         # 保存所有统计信息 
@@ -96,6 +98,9 @@ class NetworkMonitor(app_manager.RyuApp):
         # value：端口号——>(端口配置标签，端口状态，端口当前速率 curr_speed单位kbps)
         self.port_features: Dict[int, Dict[int, Tuple[str, str, int]]] = {}
 
+        # 每个交换机按端口速率变化程度自适应调整统计信息请求周期
+        self.poll_scheduler = AdaptivePollScheduler()
+
         # 保存剩余带宽信息
         # Dict[key, value]
         # key: dpid
@@ -105,9 +110,9 @@ class NetworkMonitor(app_manager.RyuApp):
         # 导入注册的ryu 应用： NetworkAwareness
         self.awareness: NetworkAwareness = lookup_service_brick('awareness')
 
-        # nx Graph类链路添加带宽属性
-        # self.graph[src_dpid][dst_dpid][PathEvaType.BANDWIDTH.value] = bandwidth
         self.graph: nx.Graph = self.awareness.graph
+        # 链路带宽的双缓冲: 每轮写入后台数组, 再整体替换 awareness.csr_graph 的 bw 属性数组
+        self.bw_buffer = EdgeWeightBuffer(self.awareness.csr_graph, PathEvaType.BANDWIDTH.value)
 
         # 保存原交换机到目的交换机的路径带宽
         # Dict[key, value]
@@ -121,10 +126,14 @@ class NetworkMonitor(app_manager.RyuApp):
         # value: Dict[dst-dpid, Path]
         # Path: List[dpid]  
         self.best_paths: Dict[int, Dict[int, List[int]]] = None
+        # 按带宽计算的最宽路径, 链路带宽变化超过阈值时才重新计算
+        self.widest_path_engine = WidestPathEngine()
+        # (engine.version, 使用的k最短路径, capabilities, best_paths) 最近一次 get_best_path_by_bw 的结果
+        self.widest_paths: Tuple[int, Dict, Dict[int, Dict[int, float]], Dict[int, Dict[int, List[int]]]] = None
 
         # Start to green thread to monitor traffic and calculating
         # free bandwidth of links respectively.
-        # 定义两个协程 协程一：周期性请求端口和流的统计信息  协程二：周期性保存带宽信息到self.graph图类
+        # 定义两个协程 协程一：周期性请求端口和流的统计信息  协程二：周期性保存带宽信息到awareness.csr_graph
         self.monitor_thread = hub.spawn(self._monitor)
         self.save_freebandwidth_thread = hub.spawn(self._save_bw_graph)
 
@@ -139,50 +148,64 @@ class NetworkMonitor(app_manager.RyuApp):
             if not datapath.id in self.datapaths:
                 self.logger.debug('register datapath: %016x', datapath.id)
                 self.datapaths[datapath.id] = datapath
+                # 端口描述只在交换机连接时请求一次, 之后由 EventOFPPortStatus 更新
+                self.port_features.setdefault(datapath.id, {})
+                datapath.send_msg(datapath.ofproto_parser.OFPPortDescStatsRequest(datapath, 0))
         elif ev.state == DEAD_DISPATCHER:
             if datapath.id in self.datapaths:
                 self.logger.debug('unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
+                self.port_stats.forget([key for key in self.port_stats.keys() if key[0] == datapath.id])
+                self.flow_stats.pop(datapath.id, None)
+                self.flow_stats_seen.pop(datapath.id, None)
+                self.aggregate_stats.forget([key for key in self.aggregate_stats.keys() if key[0] == datapath.id])
+                self.aggregate_flow_count.pop(datapath.id, None)
+                self.aggregate_requests.pop(datapath.id, None)
+                self.poll_scheduler.forget(datapath.id)
 
     def _monitor(self):
         """
             Main entry method of monitoring traffic.
         """
+        self.stats[StatsType.FLOW.value] = {}
+        self.stats[StatsType.PORT.value] = {}
+        last_show = time.monotonic()
         while CONF.weight == 'bw':
-            self.stats[StatsType.FLOW.value] = {}
-            self.stats[StatsType.PORT.value] = {}
-            for dp in self.datapaths.values():
-                self.port_features.setdefault(dp.id, {})
-                # 请求端口和流的统计信息
-                self._request_stats(dp)
-                # refresh data.
-                self.capabilities = None
-                self.best_paths = None
-            hub.sleep(setting.MONITOR_PERIOD)
-            if self.stats[StatsType.FLOW.value] or self.stats[StatsType.PORT.value]:
-                if setting.TOSHOW:
+            now = time.monotonic()
+            for dp in list(self.datapaths.values()):
+                # 每个交换机按自己的周期请求端口和流的统计信息
+                if self.poll_scheduler.due(dp.id, now):
+                    self.port_features.setdefault(dp.id, {})
+                    self._request_stats(dp)
+                    # refresh data.
+                    self.capabilities = None
+                    self.best_paths = None
+            if setting.TOSHOW and now - last_show >= setting.MONITOR_PERIOD:
+                last_show = now
+                if self.stats[StatsType.FLOW.value] or self.stats[StatsType.PORT.value]:
                     self.show_stat(StatsType.FLOW.value)
                     self.show_stat(StatsType.PORT.value)
-                    hub.sleep(1)
+            # 统计回复可能提前下一次请求, 最多等待 MONITOR_MIN_PERIOD
+            hub.sleep(max(min(self.poll_scheduler.next_due(), setting.MONITOR_MIN_PERIOD), 0.1))
 
     def _save_bw_graph(self):
         """
-            Save bandwidth data into networkx graph object.
+            Save bandwidth data into the csr graph of awareness.
         """
         while CONF.weight == 'bw':
-            graph = self.create_bw_graph(self.free_bandwidth)
-            # 初始化图属性 设置主机内部连接带宽
-            for dpid in self.datapaths.keys():
-                self.graph[dpid][dpid][PathEvaType.BANDWIDTH.value] = setting.SWITCH_INTERIOR_BANDWIDTH
-            # 赋链路带宽值
-            for (src_dpid, dst_dpid) in self.awareness.link_to_port:
-                self.graph[src_dpid][dst_dpid][PathEvaType.BANDWIDTH.value] = graph[src_dpid][dst_dpid][PathEvaType.BANDWIDTH.value]
+            # 按边下标写入后台数组后整体替换, 交换机内部连接(自环)不参与瓶颈带宽计算
+            self.create_bw_weights(self.free_bandwidth, self.bw_buffer.back())
+            self.bw_buffer.publish()
             self.logger.debug("save_freebandwidth")
-            hub.sleep(setting.MONITOR_PERIOD)
+            hub.sleep(setting.MONITOR_MIN_PERIOD)
 
     def _request_stats(self, datapath: Datapath):
         """
             Sending request msg to datapath
+            每轮请求的回复大小不随流表规模增长:
+            - 端口统计信息 (计算剩余带宽)
+            - 每个应用(FlowCookie)一次汇总统计请求
+            - MONITOR_PER_FLOW_STATS 为True时, 只按cookie请求转发流表项的统计信息
         """
         self.logger.debug('send stats request: %016x', datapath.id)
         ofproto = datapath.ofproto
@@ -191,38 +214,39 @@ class NetworkMonitor(app_manager.RyuApp):
         else:
             parser = datapath.ofproto_parser
 
-        # 发送端口描述请求消息
-        req = parser.OFPPortDescStatsRequest(datapath, 0)
-        datapath.send_msg(req)
         # 发送端口统计信息请求消息
         req = parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY)
         datapath.send_msg(req)
-        # 发送流统计信息请求消息
-        req = parser.OFPFlowStatsRequest(datapath)
-        datapath.send_msg(req)
-
-    def get_min_bw_of_links(self, graph, path, min_bw):
+        # 发送按应用汇总的流统计信息请求消息, 上一轮未回复的请求不再等待
+        pending = self.aggregate_requests[datapath.id] = {}
+        for cookie in setting.FlowCookie:
+            req = parser.OFPAggregateStatsRequest(datapath, 0, ofproto.OFPTT_ALL,
+                                                  ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                                  cookie.value, setting.FLOW_COOKIE_MASK, parser.OFPMatch())
+            datapath.send_msg(req)
+            pending[req.xid] = cookie
+        # 发送转发流表项的流统计信息请求消息
+        if setting.MONITOR_PER_FLOW_STATS:
+            req = parser.OFPFlowStatsRequest(datapath, 0, ofproto.OFPTT_ALL,
+                                             ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                             setting.FlowCookie.FORWARDING.value, setting.FLOW_COOKIE_MASK,
+                                             parser.OFPMatch())
+            datapath.send_msg(req)
+
+    def get_min_bw_of_links(self, graph: CSRGraph, path, min_bw):
         """
             获取链路path的瓶颈带宽, 即每跳链路的带宽的最小值
             Getting bandwidth of path. Actually, the mininum bandwidth
             of links is the bandwith, because it is the neck bottle of path.
         """
-        _len = len(path)
-        if _len > 1:
-            minimal_band_width = min_bw
-            for i in range(_len-1):
-                pre, curr = path[i], path[i+1]
-                if PathEvaType.BANDWIDTH.value in graph[pre][curr]:
-                    bw = graph[pre][curr][PathEvaType.BANDWIDTH.value]
-                    minimal_band_width = min(bw, minimal_band_width)
-                else:
-                    continue
-            return minimal_band_width
-        return min_bw
+        return graph.path_bottleneck(path, PathEvaType.BANDWIDTH.value, min_bw)
 
-    def get_best_path_by_bw(self, graph, paths)-> Tuple[Dict[int, Dict[int, float]], Dict[int, Dict[int, List[int]]]] :
+    def get_best_path_by_bw(self, graph: CSRGraph, paths)-> Tuple[Dict[int, Dict[int, float]], Dict[int, Dict[int, List[int]]]] :
         """
-            Get best path by comparing paths.
+            Get best path by widest-path engine.
+            graph: NetworkAwareness.csr_graph, 链路带宽保存在其 bw 属性数组中
+            paths: 按跳数计算的k最短路径, 瓶颈带宽为0(链路带宽尚未测量)的交换机对使用其中的第一条路径
+            链路带宽变化不超过阈值时直接返回上次计算的结果
             return: 
             - capabilities 保存原交换机到目的交换机的路径带宽
             # Dict[key, value]
@@ -234,67 +258,55 @@ class NetworkMonitor(app_manager.RyuApp):
             # value: Dict[dst-dpid, Path]
             # Path: List[dpid]  
         """
+        engine = self.widest_path_engine
+        engine.refresh(graph)
+        cached = self.widest_paths
+        if cached is not None and cached[0] == engine.version and cached[1] is paths:
+            self.capabilities, self.best_paths = cached[2], cached[3]
+            return cached[2], cached[3]
+
+        nodes, _, _, widest_paths, capacity, _ = engine.state
         capabilities = {}
-        best_paths = copy.deepcopy(paths)
-
-        # paths: Dict[key, value]
-        # key: src(源交换机dpid)
-        # value: Dict[dst-dpid, List[path]]
-        # path: List[dpid], path是由交换机dpid组成的元素列表例如[0, 1, 2, 3]
-        self.shortest_paths: Dict[int, Dict[int, List[List[int]]]] = None
-
-        for src in paths:
-            for dst in paths[src]:
-                if src == dst:
-                    best_paths[src][src] = [src]
-                    capabilities.setdefault(src, {src: setting.MAX_CAPACITY})
-                    capabilities[src][src] = setting.MAX_CAPACITY
-                    continue
-                max_bw_of_paths = 0
-                best_path = paths[src][dst][0]
-                for path in paths[src][dst]:
-                    min_bw = setting.MAX_CAPACITY
-                    min_bw = self.get_min_bw_of_links(graph, path, min_bw)
-                    if min_bw > max_bw_of_paths:
-                        max_bw_of_paths = min_bw
-                        best_path = path
-
-                best_paths[src][dst] = best_path
-                capabilities.setdefault(src, {dst: max_bw_of_paths})
-                capabilities[src][dst] = max_bw_of_paths
+        best_paths = {}
+        for i, src in enumerate(nodes):
+            src_capabilities = capabilities[src] = {}
+            src_paths = best_paths[src] = {}
+            hop_paths = paths.get(src, {}) if paths else {}
+            for j in np.flatnonzero(~np.isnan(capacity[i])).tolist():
+                dst = nodes[j]
+                bandwidth = float(capacity[i, j])
+                if bandwidth > 0:
+                    src_paths[dst] = widest_paths[i][j]
+                elif hop_paths.get(dst):
+                    src_paths[dst] = hop_paths[dst][0]
+                else:
+                    src_paths[dst] = widest_paths[i][j]
+                src_capabilities[dst] = bandwidth
+        self.widest_paths = (engine.version, paths, capabilities, best_paths)
         self.capabilities = capabilities
         self.best_paths = best_paths
         return capabilities, best_paths
 
-    def create_bw_graph(self, bw_dict):
+    def create_bw_weights(self, bw_dict, out: np.ndarray):
         """
-            Save bandwidth data into networkx graph object.
+            Save bandwidth of links into out, aligned with the edge ids of awareness.csr_graph.
+            链路带宽为源端口和目的端口剩余带宽的较小值; 交换机尚未统计时为0, 端口尚未统计时为nan
         """
-        try:
-            # 通过awareness应用获取 网络neworkx DiGraph类
-            graph = copy.deepcopy(self.graph)
-            link_to_port = self.awareness.link_to_port
-            for link in link_to_port:
-                (src_dpid, dst_dpid) = link
-                (src_port, dst_port) = link_to_port[link]
-                # 选取链路link 计算可用带宽
-                if src_dpid in bw_dict and dst_dpid in bw_dict:
-                    # 源端口可用带宽
-                    bw_src = bw_dict[src_dpid][src_port]
-                    # 目的端口可用带宽
-                    bw_dst = bw_dict[dst_dpid][dst_port]
-                    # 源端口和目的端口间的带宽
-                    bandwidth = min(bw_src, bw_dst)
-                    # add key:value of bandwidth into graph.
-                    graph[src_dpid][dst_dpid][PathEvaType.BANDWIDTH.value] = bandwidth
-                else:
-                    graph[src_dpid][dst_dpid][PathEvaType.BANDWIDTH.value] = 0
-            return graph
-        except:
-            self.logger.info("Create bw graph exception")
-            # if self.awareness is None:
-            #     self.awareness = lookup_service_brick('awareness')
-            return None
+        csr_graph = self.awareness.csr_graph
+        link_to_port = self.awareness.link_to_port
+        for edge_id, (src_dpid, dst_dpid) in enumerate(csr_graph.links()):
+            if src_dpid in bw_dict and dst_dpid in bw_dict:
+                ports = link_to_port.get((src_dpid, dst_dpid))
+                if ports is None:
+                    out[edge_id] = np.nan
+                    continue
+                (src_port, dst_port) = ports
+                # 源端口和目的端口间的带宽
+                out[edge_id] = min(bw_dict[src_dpid].get(src_port, np.nan),
+                                   bw_dict[dst_dpid].get(dst_port, np.nan))
+            else:
+                out[edge_id] = 0
+        return out
 
     def _save_freebandwidth(self, dpid, port_no, speed):
         # Calculate free bandwidth of port and save it.
@@ -307,20 +319,6 @@ class NetworkMonitor(app_manager.RyuApp):
         else:
             self.logger.info("Fail in getting port state")
 
-    def _save_stats(self, _dict, key, value, length):
-        if key not in _dict:
-            _dict[key] = []
-        _dict[key].append(value)
-
-        if len(_dict[key]) > length:
-            _dict[key].pop(0)
-
-    def _get_speed(self, now, pre, period):
-        if period:
-            return (now - pre) / (period)
-        else:
-            return 0
-
     def _get_free_bw(self, capacity, speed):
         # BW:Mbit/s
         return max(capacity/10**3 - speed * 8/10**6, 0)
@@ -342,36 +340,46 @@ class NetworkMonitor(app_manager.RyuApp):
         # OFPFlowStats 也在ofproto_v1 3_parser中被定义
         body: List[ofproto_v1_3_parser.OFPFlowStats]= ev.msg.body
         dpid: int = ev.msg.datapath.id
+        msg = ev.msg
         self.stats[StatsType.FLOW.value][dpid] = body
-        self.flow_stats.setdefault(dpid, {})
-        self.flow_speed.setdefault(dpid, {})
-        for stat in sorted([flow for flow in body if flow.priority == 1],
-                           key=lambda flow: (flow.match.get('in_port'),
-                                             flow.match.get('ipv4_dst'))):
+        flow_stats = self.flow_stats.setdefault(dpid, StatsRingBuffer())
+        # key ——> (byte_count, 时长), 同一个key重复出现时保留最后一条
+        values: Dict[Tuple[int, str, int], Tuple[int, float]] = {}
+        for stat in body:
+            if stat.priority != 1:
+                continue
             key = (stat.match['in_port'],  stat.match.get('ipv4_dst'),
                    stat.instructions[0].actions[0].port)
-            # duration_sec 时长（秒）
-            # duration_nsec 时长（纳秒）
-            value = (stat.packet_count, stat.byte_count,
-                     stat.duration_sec, stat.duration_nsec)
-            # length表示 保存的该流的最大记录数量
-            self._save_stats(self.flow_stats[dpid], key, value, length=5)
-
-            # Get flow's speed.
-            pre = 0
-            period = setting.MONITOR_PERIOD
-            tmp = self.flow_stats[dpid][key]
-            if len(tmp) > 1:
-                # 流key 倒数第二条统计消息记录中的字节数量
-                pre = tmp[-2][1]
-                period = self._get_period(tmp[-1][2], tmp[-1][3],
-                                          tmp[-2][2], tmp[-2][3])
-
+            # duration_sec 时长（秒） duration_nsec 时长（纳秒）
+            values[key] = (stat.byte_count, self._get_time(stat.duration_sec, stat.duration_nsec))
+        if values:
+            keys = list(values)
+            counters, times = zip(*values.values())
             # （最新统计的流字节量 - 上一次统计的流字节量） 除以统计时间
-            speed = self._get_speed(self.flow_stats[dpid][key][-1][1],
-                                    pre, period)
-
-            self._save_stats(self.flow_speed[dpid], key, speed, 5)
+            flow_stats.update(keys, counters, times, self.poll_scheduler.period(dpid))
+        seen = self.flow_stats_seen.setdefault(dpid, set())
+        seen.update(values)
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            # 已删除或超时的流不再保留记录
+            flow_stats.forget([key for key in flow_stats.keys() if key not in seen])
+            seen.clear()
+
+    @set_ev_cls(ofp_event.EventOFPAggregateStatsReply, MAIN_DISPATCHER)
+    def _aggregate_stats_reply_handler(self, ev):
+        """
+            Save aggregate flow stats of one application and calculate its speed.
+        """
+        msg = ev.msg
+        dpid = msg.datapath.id
+        cookie = self.aggregate_requests.get(dpid, {}).pop(msg.xid, None)
+        if cookie is None:
+            return
+        # body: ``OFPAggregateStats`` instance
+        body: ofproto_v1_3_parser.OFPAggregateStats = msg.body
+        # 汇总统计不含时长, 按控制器收到回复的时间计算速率
+        self.aggregate_stats.update([(dpid, cookie.name)], [body.byte_count], [time.monotonic()],
+                                    self.poll_scheduler.period(dpid))
+        self.aggregate_flow_count.setdefault(dpid, {})[cookie.name] = body.flow_count
 
     @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
     def _port_stats_reply_handler(self, ev):
@@ -385,31 +393,33 @@ class NetworkMonitor(app_manager.RyuApp):
         self.stats[StatsType.PORT.value][dpid] = body
         self.free_bandwidth.setdefault(dpid, {})
 
-        for stat in sorted(body, key=attrgetter('port_no')):
-            port_no = stat.port_no
-            # EventOFPPortStatsReply 端口必须是非本地端口（因为Reply消息是从交换机产生的，非控制器产生的）
-            if port_no != ofproto_v1_3.OFPP_LOCAL:
-                key = (dpid, port_no)
-                value = (stat.tx_bytes, stat.rx_bytes, stat.rx_errors,
-                         stat.duration_sec, stat.duration_nsec)
-
-                self._save_stats(self.port_stats, key, value, 5)
-
-                # Get port speed.
-                pre = 0
-                period = setting.MONITOR_PERIOD
-                tmp = self.port_stats[key]
-                if len(tmp) > 1:
-                    pre = tmp[-2][0] + tmp[-2][1]
-                    period = self._get_period(tmp[-1][3], tmp[-1][4],
-                                              tmp[-2][3], tmp[-2][4])
-
-                speed = self._get_speed(
-                    self.port_stats[key][-1][0] + self.port_stats[key][-1][1],
-                    pre, period)
-
-                self._save_stats(self.port_speed, key, speed, 5)
-                self._save_freebandwidth(dpid, port_no, speed)
+        # EventOFPPortStatsReply 端口必须是非本地端口（因为Reply消息是从交换机产生的，非控制器产生的）
+        stats = [stat for stat in body if stat.port_no != ofproto_v1_3.OFPP_LOCAL]
+        if not stats:
+            return
+        port_nos = [stat.port_no for stat in stats]
+        keys = [(dpid, port_no) for port_no in port_nos]
+        speeds = self.port_stats.update(
+            keys,
+            [stat.tx_bytes + stat.rx_bytes for stat in stats],
+            [self._get_time(stat.duration_sec, stat.duration_nsec) for stat in stats],
+            self.poll_scheduler.period(dpid))
+        for port_no, speed in zip(port_nos, speeds.tolist()):
+            self._save_freebandwidth(dpid, port_no, speed)
+        self.poll_scheduler.observe(dpid, self._get_volatility(dpid, port_nos, keys, speeds))
+
+    def _get_volatility(self, dpid, port_nos, keys, speeds):
+        """
+            交换机端口速率的最大变化量, 相对端口容量(curr_speed kbps), 容量未知时相对当前速率
+        """
+        change = np.abs(self.port_stats.speed_change(keys))
+        features = self.port_features.get(dpid, {})
+        capacity = np.array([features.get(port_no, (None, None, 0))[2] * 10**3 / 8 for port_no in port_nos],
+                            dtype=float)
+        scale = np.where(capacity > 0, capacity, np.maximum(np.abs(speeds), 1.0))
+        volatility = change / scale
+        volatility = volatility[~np.isnan(volatility)]
+        return float(volatility.max()) if len(volatility) else 0.0
 
     @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
     def port_desc_stats_reply_handler(self, ev):
@@ -419,8 +429,15 @@ class NetworkMonitor(app_manager.RyuApp):
         msg = ev.msg
         # body  List of ``OFPPort`` instance
         body: List[ofproto_v1_3_parser.OFPPort] =  ev.msg.body
-        dpid = msg.datapath.id
-        ofproto = msg.datapath.ofproto
+        for p in body:
+            self._save_port_feature(msg.datapath, p)
+
+    def _save_port_feature(self, datapath: Datapath, p: ofproto_v1_3_parser.OFPPort):
+        """
+            Save the description of one port, from port desc reply or port status message.
+        """
+        dpid = datapath.id
+        ofproto = datapath.ofproto
 
         config_dict = {ofproto.OFPPC_PORT_DOWN: "Down",
                        ofproto.OFPPC_NO_RECV: "No Recv",
@@ -431,33 +448,21 @@ class NetworkMonitor(app_manager.RyuApp):
                       ofproto.OFPPS_BLOCKED: "Blocked",
                       ofproto.OFPPS_LIVE: "Live"}
 
-        ports = []
-        # hw-addr MAC地址
-        for p in body:
-            ports.append('port_no=%d hw_addr=%s name=%s config=0x%08x '
-                         'state=0x%08x curr=0x%08x advertised=0x%08x '
-                         'supported=0x%08x peer=0x%08x curr_speed=%d '
-                         'max_speed=%d' %
-                         (p.port_no, p.hw_addr,
-                          p.name, p.config,
-                          p.state, p.curr, p.advertised,
-                          p.supported, p.peer, p.curr_speed,
-                          p.max_speed))
-            # 判断端口的配置标签
-            if p.config in config_dict:
-                config = config_dict[p.config]
-            else:
-                config = "up"
-            # 判断端口状态
-            if p.state in state_dict:
-                state = state_dict[p.state]
-            else:
-                state = "up"
+        # 判断端口的配置标签
+        if p.config in config_dict:
+            config = config_dict[p.config]
+        else:
+            config = "up"
+        # 判断端口状态
+        if p.state in state_dict:
+            state = state_dict[p.state]
+        else:
+            state = "up"
 
-            port_feature = (config, state, p.curr_speed)
-            self.port_features[dpid][p.port_no] = port_feature
-            print('---------------------------------port curr_speed---------------------------------')
-            print(f"dpid: {dpid} port_no:{p.port_no} port_speed: {p.curr_speed}")
+        port_feature = (config, state, p.curr_speed)
+        self.port_features.setdefault(dpid, {})[p.port_no] = port_feature
+        print('---------------------------------port curr_speed---------------------------------')
+        print(f"dpid: {dpid} port_no:{p.port_no} port_speed: {p.curr_speed}")
 
     @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
     def _port_status_handler(self, ev):
@@ -465,7 +470,7 @@ class NetworkMonitor(app_manager.RyuApp):
             Handle the port status changed event.
             EventOFPPortStatus: 交换机向控制器通告端口状态 传递OFPort类实例(msg.desc)
             以及指示端口发生变化的三种情况: ADD端口增加, DELETE端口删除, MODIFY端口状态更新
-            此函数在端口放生变化时打印变化消息
+            此函数在端口放生变化时打印变化消息, 并按msg.desc更新端口特征信息(不再周期性请求端口描述)
         """
         msg = ev.msg
         reason = msg.reason
@@ -482,6 +487,13 @@ class NetworkMonitor(app_manager.RyuApp):
         else:
             print ("switch%d: Illeagal port state %s %s" % (port_no, reason))
 
+        if reason == ofproto.OFPPR_DELETE:
+            self.port_features.get(dpid, {}).pop(port_no, None)
+            self.free_bandwidth.get(dpid, {}).pop(port_no, None)
+            self.port_stats.forget([(dpid, port_no)])
+        elif reason in reason_dict:
+            self._save_port_feature(msg.datapath, msg.desc)
+
     def show_stat(self, type: StatsType):
         '''
             Show statistics info according to data type.
@@ -506,10 +518,10 @@ class NetworkMonitor(app_manager.RyuApp):
                         stat.match['in_port'], stat.match['ipv4_dst'],
                         stat.instructions[0].actions[0].port,
                         stat.packet_count, stat.byte_count,
-                        abs(self.flow_speed[dpid][
+                        abs(self.flow_stats[dpid].latest_speed(
                             (stat.match.get('in_port'),
                             stat.match.get('ipv4_dst'),
-                            stat.instructions[0].actions[0].port)][-1])))
+                            stat.instructions[0].actions[0].port)))))
             print ('\n')
 
         if(type == StatsType.PORT.value):
@@ -529,15 +541,14 @@ class NetworkMonitor(app_manager.RyuApp):
                             dpid, stat.port_no,
                             stat.rx_packets, stat.rx_bytes, stat.rx_errors,
                             stat.tx_packets, stat.tx_bytes, stat.tx_errors,
-                            abs(self.port_speed[(dpid, stat.port_no)][-1]),
+                            abs(self.port_stats.latest_speed((dpid, stat.port_no))),
                             self.port_features[dpid][stat.port_no][2],
                             self.port_features[dpid][stat.port_no][0],
                             self.port_features[dpid][stat.port_no][1]))
             print ('\n')
 
         if CONF.weight == 'bw':
-            for u, v, data in self.graph.edges(data=True):
-                if CONF.weight not in data.keys():
-                    self._save_bw_graph()
-                    return
-                print(f"{u}——>{v} bw: {data['bw']}")
\ No newline at end of file
+            csr_graph = self.awareness.csr_graph
+            bandwidth = csr_graph.weights[PathEvaType.BANDWIDTH.value]
+            for (u, v), bw in zip(csr_graph.links(), bandwidth):
+                print(f"{u}——>{v} bw: {bw}")
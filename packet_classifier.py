@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Tuple, Dict, Callable, Optional
+import logging
+import socket
+import struct
+from ryu.lib.packet import packet
+from ryu.lib.packet import ether_types
+
+LOG = logging.getLogger(__name__)
+
+"""
+packet_in 报文的快速分类与分发: 只读取以太网类型/ARP/IPv4头部的固定偏移字段, 完整解析按需进行且最多一次
+"""
+ETH_HEADER_LEN = 14
+VLAN_HEADER_LEN = 4
+_ETH_TYPE = struct.Struct('!H')
+# ARP: 操作码, 发送方MAC, 发送方IP, (跳过目标MAC), 目标IP
+_ARP_FIELDS = struct.Struct('!6xH6s4s6x4s')
+# IPv4: 协议号, 源IP, 目的IP
+_IPV4_FIELDS = struct.Struct('!9xB2x4s4s')
+
+
+class ClassifiedPacket:
+    """
+    packet_in 报文的分类结果
+    - eth_type: 以太网类型(跳过一层VLAN标签)
+    - ARP报文: arp_opcode, src_mac(发送方MAC), src_ip, dst_ip
+    - IPv4报文: ip_proto, src_ip, dst_ip
+    - packet: 完整解析的 ryu Packet, 第一次访问时才解析
+    """
+    __slots__ = ('msg', 'data', 'eth_type', 'ip_proto', 'arp_opcode', 'src_mac', 'src_ip', 'dst_ip', '_packet')
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.data: bytes = msg.data
+        self.eth_type: int = None
+        self.ip_proto: int = None
+        self.arp_opcode: int = None
+        self.src_mac: str = None
+        self.src_ip: str = None
+        self.dst_ip: str = None
+        self._packet: packet.Packet = None
+        self._peek()
+
+    def _peek(self):
+        data = self.data
+        if len(data) < ETH_HEADER_LEN:
+            return
+        offset = ETH_HEADER_LEN
+        eth_type, = _ETH_TYPE.unpack_from(data, 12)
+        if eth_type == ether_types.ETH_TYPE_8021Q and len(data) >= ETH_HEADER_LEN + VLAN_HEADER_LEN:
+            eth_type, = _ETH_TYPE.unpack_from(data, 16)
+            offset += VLAN_HEADER_LEN
+        self.eth_type = eth_type
+        if eth_type == ether_types.ETH_TYPE_ARP and len(data) >= offset + _ARP_FIELDS.size:
+            opcode, src_mac, src_ip, dst_ip = _ARP_FIELDS.unpack_from(data, offset)
+            self.arp_opcode = opcode
+            self.src_mac = ':'.join('%02x' % b for b in src_mac)
+            self.src_ip = socket.inet_ntoa(src_ip)
+            self.dst_ip = socket.inet_ntoa(dst_ip)
+        elif eth_type == ether_types.ETH_TYPE_IP and len(data) >= offset + _IPV4_FIELDS.size:
+            proto, src_ip, dst_ip = _IPV4_FIELDS.unpack_from(data, offset)
+            self.ip_proto = proto
+            self.src_ip = socket.inet_ntoa(src_ip)
+            self.dst_ip = socket.inet_ntoa(dst_ip)
+
+    @property
+    def packet(self) -> packet.Packet:
+        if self._packet is None:
+            self._packet = packet.Packet(self.data)
+        return self._packet
+
+
+# 处理函数: (ev, 分类结果)
+PacketInHandler = Callable[[object, ClassifiedPacket], None]
+# 判断是否由该处理函数处理: 分类结果 ——> bool
+PacketInFilter = Callable[[ClassifiedPacket], bool]
+
+
+class PacketInDispatcher:
+    """
+    按以太网类型把 packet_in 报文分发给感兴趣的应用
+    - observer: 收到该类型的所有报文(例如ARP学习主机位置), 不影响后续分发
+    - handler: 按priority从高到低, 报文交给第一个 accept 返回True(或accept为None)的处理函数
+    """
+    def __init__(self):
+        self.observers: Dict[int, List[PacketInHandler]] = {}
+        # 以太网类型 ——> List[(priority, accept, handler)]
+        self.handlers: Dict[int, List[Tuple[int, Optional[PacketInFilter], PacketInHandler]]] = {}
+        self.n_dispatched = 0
+        self.n_unhandled = 0
+
+    def observe(self, eth_type: int, observer: PacketInHandler):
+        self.observers.setdefault(eth_type, []).append(observer)
+
+    def register(self, eth_type: int, handler: PacketInHandler, accept: PacketInFilter = None, priority: int = 0):
+        handlers = self.handlers.setdefault(eth_type, [])
+        handlers.append((priority, accept, handler))
+        # 相同优先级保持注册顺序
+        handlers.sort(key=lambda item: -item[0])
+
+    def dispatch(self, ev) -> ClassifiedPacket:
+        pkt = ClassifiedPacket(ev.msg)
+        for observer in self.observers.get(pkt.eth_type, ()):
+            observer(ev, pkt)
+        for _, accept, handler in self.handlers.get(pkt.eth_type, ()):
+            if accept is None or accept(pkt):
+                self.n_dispatched += 1
+                handler(ev, pkt)
+                return pkt
+        self.n_unhandled += 1
+        return pkt
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Tuple, Dict, Set, Optional, Callable
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import networkx as nx
+import setting
+
+LOG = logging.getLogger(__name__)
+
+"""
+最短路径的计算与增量维护
+"""
+def k_shortest_paths(graph: nx.DiGraph, src: int, dst: int, weight='weight', k=1) -> Optional[List[List[int]]]:
+    """
+        Great K shortest paths of src to dst.
+        不存在路径时返回None
+    """
+    generator = nx.shortest_simple_paths(graph, source=src,
+                                         target=dst, weight=weight)
+    shortest_paths = []
+    try:
+        for path in generator:
+            if k <= 0:
+                break
+            shortest_paths.append(path)
+            k -= 1
+        return shortest_paths
+    except (nx.NetworkXNoPath, nx.NodeNotFound):
+        LOG.debug("No path between %s and %s" % (src, dst))
+        return None
+
+
+def source_k_shortest_paths(graph: nx.DiGraph, src: int, weight='weight', k=1) -> Tuple[Dict[int, List[List[int]]], Dict[int, float]]:
+    """
+        计算源交换机src到所有交换机的k最短路径
+        return: (paths, dist)
+        - paths: Dict[dst-dpid, List[path]], 不可达的dst对应None
+        - dist: Dict[dpid, float] src到各个可达交换机的最短距离
+    """
+    dist = nx.single_source_dijkstra_path_length(graph, src, weight=weight)
+    paths: Dict[int, List[List[int]]] = {src: [[src] for i in range(k)]}
+    for dst in graph.nodes():
+        if dst == src:
+            continue
+        if dst not in dist:
+            paths[dst] = None
+            continue
+        paths[dst] = k_shortest_paths(graph, src, dst, weight=weight, k=k)
+    return paths, dist
+
+
+def _compute_sources(nodes: List[int], edges: List[Tuple[int, int, float]], sources: List[int], weight, k):
+    """
+        进程池工作函数: 由紧凑的边列表重建图, 计算一组源交换机的k最短路径
+    """
+    graph = nx.DiGraph()
+    graph.add_nodes_from(nodes)
+    graph.add_weighted_edges_from(edges, weight=weight)
+    return {src: source_k_shortest_paths(graph, src, weight=weight, k=k) for src in sources}
+
+
+class ParallelPathEngine:
+    """
+    按源交换机划分计算任务, 在进程池中并行计算k最短路径
+    只向工作进程发送节点列表和 (src, dst, weight) 边列表
+    n_workers: 工作进程数量
+    chunks_per_worker: 每个工作进程分到的任务块数量, 块越多负载越均衡
+    """
+    def __init__(self, n_workers: int = setting.PATH_ENGINE_WORKERS, chunks_per_worker: int = 4):
+        self.n_workers = n_workers
+        self.chunks_per_worker = chunks_per_worker
+        # 使用spawn启动工作进程, 避免子进程继承控制器的协程与套接字状态
+        self.executor = ProcessPoolExecutor(max_workers=n_workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+
+    def compute(self, graph: nx.DiGraph, sources, weight='weight', k=1,
+                wait: Callable[[], None] = None) -> Dict[int, Tuple[Dict[int, List[List[int]]], Dict[int, float]]]:
+        """
+        并行计算sources中每个源交换机的k最短路径
+        wait: 等待工作进程时调用的让出函数, 在ryu中传入 lambda: hub.sleep(x) 以免阻塞eventlet hub
+        return: Dict[src-dpid, (paths, dist)]
+        """
+        sources = list(sources)
+        if not sources:
+            return {}
+        nodes = list(graph.nodes())
+        edges = [(u, v, data.get(weight, 1)) for u, v, data in graph.edges(data=True)]
+        n_chunks = min(len(sources), self.n_workers * self.chunks_per_worker)
+        chunks = [sources[i::n_chunks] for i in range(n_chunks)]
+        futures = [self.executor.submit(_compute_sources, nodes, edges, chunk, weight, k) for chunk in chunks]
+        results = {}
+        for future in futures:
+            if wait is not None:
+                while not future.done():
+                    wait()
+            results.update(future.result())
+        return results
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class IncrementalPathStore:
+    """
+    增量维护所有交换机对之间的k最短路径
+    每次拓扑变化时比较新旧边集合, 只重新计算受影响的源交换机:
+    - 边被删除或权重变大: 已保存路径经过该边的源交换机
+    - 边被添加或权重变小: 能到达该边起点, 且经该边的路径可能比已保存的第k条路径更短的源交换机
+    - 新加入的交换机, 以及能经新边到达新交换机的源交换机
+    k: 每对交换机保存的路径数量
+    weight: 计算路径使用的边属性
+    engine: 可选的并行计算引擎, 受影响的源交换机数量不少于 PATH_ENGINE_MIN_SOURCES 时使用
+    wait: 等待并行计算结果时调用的让出函数
+    """
+    def __init__(self, k=1, weight='weight', engine: ParallelPathEngine = None, wait: Callable[[], None] = None):
+        self.k = k
+        self.weight = weight
+        self.engine = engine
+        self.wait = wait
+        # Dict[src-dpid, Dict[dst-dpid, List[path]]] 与 NetworkAwareness.shortest_paths 结构相同
+        self.paths: Dict[int, Dict[int, List[List[int]]]] = {}
+        # 上一次计算时的边及其权重(不含自环)
+        self._edges: Dict[Tuple[int, int], float] = {}
+        self._nodes: Set[int] = set()
+        # src-dpid ——> 到各交换机的最短距离
+        self._dist: Dict[int, Dict[int, float]] = {}
+        # src-dpid ——> 已保存路径所经过的边
+        self._used_edges: Dict[int, Set[Tuple[int, int]]] = {}
+        # src-dpid ——> 已保存路径中最长路径的代价, 不足k条路径时为inf
+        self._max_cost: Dict[int, float] = {}
+
+    def update(self, graph: nx.DiGraph) -> Set[int]:
+        """
+        根据图的最新状态更新路径, 返回重新计算了路径的源交换机集合
+        """
+        edges = {(u, v): data.get(self.weight, 1) for u, v, data in graph.edges(data=True) if u != v}
+        nodes = set(graph.nodes())
+        removed_edges = {e for e, w in self._edges.items() if e not in edges or edges[e] > w}
+        added_edges = {e for e, w in edges.items() if e not in self._edges or w < self._edges[e]}
+        removed_nodes = self._nodes - nodes
+        added_nodes = nodes - self._nodes
+
+        for node in removed_nodes:
+            for store in (self.paths, self._dist, self._used_edges, self._max_cost):
+                store.pop(node, None)
+        affected = set(added_nodes)
+        for src in nodes - added_nodes:
+            if src not in self.paths or self._is_affected(src, removed_edges, added_edges, added_nodes, edges):
+                affected.add(src)
+            else:
+                for node in removed_nodes:
+                    self.paths[src].pop(node, None)
+                # 未受影响的源交换机无法到达新加入的交换机
+                for node in added_nodes:
+                    self.paths[src][node] = None
+                    self._max_cost[src] = float('inf')
+
+        self._edges = edges
+        self._nodes = nodes
+        self.recompute(graph, affected)
+        return affected
+
+    def recompute(self, graph: nx.DiGraph, sources):
+        if self.engine is not None and len(sources) >= setting.PATH_ENGINE_MIN_SOURCES:
+            results = self.engine.compute(graph, sources, weight=self.weight, k=self.k, wait=self.wait)
+            for src, (paths, dist) in results.items():
+                self.set_source_paths(src, paths, dist)
+            return
+        for src in sources:
+            paths, dist = source_k_shortest_paths(graph, src, weight=self.weight, k=self.k)
+            self.set_source_paths(src, paths, dist)
+
+    def set_source_paths(self, src: int, paths: Dict[int, List[List[int]]], dist: Dict[int, float]):
+        """
+        保存源交换机src的路径, 同时更新判断该源是否受拓扑变化影响所需的辅助信息
+        """
+        used_edges = set()
+        max_cost = 0
+        for dst, dst_paths in paths.items():
+            if dst == src:
+                continue
+            if not dst_paths or len(dst_paths) < self.k:
+                max_cost = float('inf')
+            for path in dst_paths or []:
+                cost = 0
+                for i in range(len(path) - 1):
+                    used_edges.add((path[i], path[i + 1]))
+                    cost += self._edges.get((path[i], path[i + 1]), 1)
+                max_cost = max(max_cost, cost)
+        self.paths[src] = paths
+        self._dist[src] = dist
+        self._used_edges[src] = used_edges
+        self._max_cost[src] = max_cost
+
+    def _is_affected(self, src, removed_edges, added_edges, added_nodes, edges) -> bool:
+        if self._used_edges.get(src, set()) & removed_edges:
+            return True
+        dist = self._dist.get(src, {})
+        max_cost = self._max_cost.get(src, float('inf'))
+        for (u, v) in added_edges:
+            # 能到达该边起点, 且该边通向新交换机或可能产生更短的路径
+            if u in dist and (v in added_nodes or dist[u] + edges[(u, v)] < max_cost):
+                return True
+        return False
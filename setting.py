@@ -11,6 +11,28 @@ MONITOR_PERIOD = 20			 		# For monitoring traffic
 # 5
 DELAY_DETECTING_PERIOD = 10			# For detecting link delay.
 
+# 每个交换机的统计请求周期(s)在 [MONITOR_MIN_PERIOD, MONITOR_MAX_PERIOD] 内自适应调整, 初始为 MONITOR_PERIOD
+# 端口速率变化量(相对端口容量, 容量未知时相对当前速率)超过 MONITOR_VOLATILITY_THRESHOLD 时周期减半, 否则乘以 MONITOR_BACKOFF_FACTOR
+MONITOR_MIN_PERIOD = 2
+MONITOR_MAX_PERIOD = 60
+MONITOR_VOLATILITY_THRESHOLD = 0.1
+MONITOR_BACKOFF_FACTOR = 1.5
+
+# 每个端口/流保存的最大统计记录数量
+STATS_HISTORY_LENGTH = 5
+
+# 是否按流请求转发流表项(FlowCookie.FORWARDING)的统计信息, False时每个应用只请求一次汇总统计
+MONITOR_PER_FLOW_STATS = False
+
+# 合并拓扑事件的时间窗口(s), 窗口内的拓扑事件只触发一次路径更新
+TOPOLOGY_DEBOUNCE_PERIOD = 0.5
+
+# 并行计算k最短路径的工作进程数量, 0表示在控制器进程中串行计算
+PATH_ENGINE_WORKERS = 0
+
+# 需要重新计算的源交换机数量不少于该值时才使用并行计算
+PATH_ENGINE_MIN_SOURCES = 16
+
 # 60
 GENERATE_GRAPH_PIC_PERIOD = 60	 #生成拓扑图片
 
@@ -20,12 +42,46 @@ MAX_CAPACITY = 281474976710655		# Max capacity of link
 # 0.05
 ECHO_REQUEST_INTERVAL = 0.5        # Delay detector parameters
 
+# 时延估计: 中位数窗口的样本数量, EWMA中新样本的权重
+DELAY_SAMPLE_WINDOW = 8
+DELAY_EWMA_ALPHA = 0.3
+
+# 偏离窗口中位数超过 该系数*MAD 的时延样本视为异常, MAD的下限(s)
+DELAY_OUTLIER_FACTOR = 3
+DELAY_OUTLIER_MIN_DEVIATION = 0.001
+
+# 一轮echo探测均匀分布在该时间窗口内(s), 每轮探测耗时不随交换机数量增长
+ECHO_PROBE_WINDOW = DELAY_DETECTING_PERIOD / 2
+
+# 相邻两批echo请求的最小间隔(s), 交换机较多时每批发送多个请求
+ECHO_MIN_INTERVAL = 0.001
+
+# 超过该时间(s)仍未收到回复的echo请求不再等待
+ECHO_REPLY_TIMEOUT = DELAY_DETECTING_PERIOD
+
+# 链路时延变化超过 max(绝对阈值(s), 相对阈值*原时延) 时, 才重新计算受影响的按时延最短路径
+DELAY_PATH_REL_THRESHOLD = 0.2
+DELAY_PATH_ABS_THRESHOLD = 0.001
+
+# 链路剩余带宽变化超过 max(绝对阈值(Mbit/s), 相对阈值*原带宽) 时, 才重新计算按带宽的最宽路径
+BW_PATH_REL_THRESHOLD = 0.1
+BW_PATH_ABS_THRESHOLD = 1
+
 SWITCH_INTERIOR_BANDWIDTH = 1       # 交换机内部端口互联带宽
 
 SWITCH_INTERIOR_DELAY = 0       # 交换机内部端口互联时延
 
 CPN_SERICE_REQUEST_MAC = 'f0:00:00:00:00:01' # 服务任博MAC地址
 
+# 控制器代答ARP的 IP——>MAC 缓存有效期(s), 过期后ARP请求转发给目的主机以刷新缓存
+ARP_PROXY_CACHE_TTL = 300
+
+# 同一目的IP两次泛洪ARP请求的最小间隔(s)
+ARP_FLOOD_INTERVAL = 1
+
+# 所有目的IP合计每秒最多泛洪的ARP请求数量
+ARP_FLOOD_RATE = 50
+
 # 流表项空闲时间，如值为 10，表示若某条流表在最近 10s 内没有被匹配过则删除
 # 30 300
 FlowEntry_IDLET_IMEOUT = 600
@@ -33,9 +89,55 @@ FlowEntry_IDLET_IMEOUT = 600
 # 流表项存活时间，如值为 10，则从该流表被安装经过 10s 后无论被使用情况如何，立即被删除
 FlowEntry_HARD_TIMOUT = 3600
 
+# 批量下发流表后等待barrier回复的超时时间(s), 超时后仍然发送packet-out
+FLOW_BARRIER_TIMEOUT = 1
+
+# 主动下发模式: 拓扑与主机接入信息已知后, 预先下发 接入交换机(switchB)<——>prime app 的目的地址流表以及CPN任播改写流表,
+# 首个请求不再经过控制器
+PROACTIVE_FLOW_INSTALL = False
+
+# 主动下发检查拓扑与主机接入变化的周期(s)
+PROACTIVE_INSTALL_PERIOD = 5
+
+# 主动下发的目的地址流表优先级, 高于packet_in触发下发的流表(1)
+PROACTIVE_FLOW_PRIORITY = 2
+
+# 主动下发的CPN任播改写流表优先级, 低于packet_in触发下发的CPN流表(0x9000), 两者匹配域不同, 互不覆盖
+CPN_PROACTIVE_FLOW_PRIORITY = 0x8000
+
 # CPN策略路由的周期性更新策略
 CPN_POCLICY_UPDATE_PERIOD = 4
 
+# 各primeApp rps负载能力 与 各cpNode 请求到达率的JSON文件路径
+PRIME_APP_RPS_JSON_PATH = '/home/wwz/ryu/ryu/app/network_awareness/prime_app_rps.json'
+CPN_NODE_RPS_JSON_PATH = '/home/wwz/ryu/ryu/app/network_awareness/cpn_node_rps.json'
+
+# 两次检查rps JSON文件是否变化的最小间隔(s)
+RPS_FILE_CHECK_INTERVAL = 1
+
+# 转发策略缓存的最大条目数
+POLICY_CACHE_SIZE = 64
+
+# 后台策略引擎计算并发布转发策略的周期(s)
+CPN_POLICY_ENGINE_PERIOD = 1
+
+# cgroup文件系统挂载点 与 应用容器名称前缀
+CGROUP_ROOT = '/sys/fs/cgroup'
+PRIME_APP_CONTAINER_PREFIX = 'mn.primeApp'
+
+# 容器CPU利用率采样周期(s) 与 环形缓冲区长度
+CPU_TELEMETRY_PERIOD = 1
+CPU_TELEMETRY_BUFFER_SIZE = 32
+
+# 查找未知容器cgroup目录的最小间隔(s)
+CPU_TELEMETRY_RESOLVE_INTERVAL = 10
+
+# sinkhorn 每隔多少次迭代检查一次收敛误差
+SINKHORN_CHECK_PERIOD = 10
+
+# 代价矩阵与边缘分布的相对变化小于该值时, sinkhorn 使用上一次的对偶势热启动
+SINKHORN_WARM_START_TOL = 0.1
+
 # Dict[key, value]
 # key: 启动最短路径应用时设置的weight
 # value: 存储在network graph的边数据中的索引
@@ -81,6 +183,29 @@ global_cpn_routing_algo_choice = CPNRoutingAlgoName.OT_POLICY_ALGO
 # global_cpn_routing_algo_choice = CPNRoutingAlgoName.CFN_DYNAMIC_FEEDBACK_ALGO
 
 
+class CPNSteeringMode(Enum):
+    """
+    枚举类型定义CPN任播请求分配到服务实例的粒度
+    """
+    # 每个(交换机, 服务)一条流表, 周期性按策略改写目的实例
+    SERVICE = 'service'
+    # 每个TCP连接(客户端ip, tcp_src)按策略选取一次实例, 空闲超时前不再改变
+    CONNECTION = 'connection'
+    # 每个(交换机, 服务)一个SELECT组表, 按策略设置桶权重, 由交换机在数据平面按权重分配
+    GROUP = 'group'
+
+# 全局任播分配粒度选择 (默认保持原有的按服务分配)
+global_cpn_steering_mode = CPNSteeringMode.SERVICE
+# global_cpn_steering_mode = CPNSteeringMode.CONNECTION
+# global_cpn_steering_mode = CPNSteeringMode.GROUP
+
+# 按连接分配时 连接流表项的空闲超时时间(s), 连接结束后流表项尽快删除
+CPN_CONNECTION_IDLE_TIMEOUT = 30
+
+# 组表桶权重(uint16)的缩放系数, 桶权重 = round(策略概率 * 该系数)
+CPN_GROUP_BUCKET_WEIGHT_SCALE = 1000
+
+
 class PathEvaType(Enum):
     """
     枚举类型定义最短路径的评估类型
@@ -103,6 +228,21 @@ class StatsType(Enum):
     PORT = 'port'
 
 
+class FlowCookie(Enum):
+    """
+    枚举类型定义流表项cookie的高8位, 标识下发该流表项的应用
+    统计请求按 cookie/FLOW_COOKIE_MASK 只查询需要的流表项
+    """
+    # ShortestForwarding 按packet_in下发的三层转发流表项
+    FORWARDING = 0x0100000000000000
+    # ShortestForwarding 预先下发的转发流表项
+    PROACTIVE = 0x0200000000000000
+    # CPNRouting 下发的任播流表项
+    CPN = 0x0300000000000000
+
+FLOW_COOKIE_MASK = 0xff00000000000000
+
+
 class SimNetworkSetUp():
     """
     仿真实验的网络设置
@@ -184,7 +324,7 @@ class SimNetworkSetUp():
         # 从 JSON 文件读取字典 获取各个primeApp的 rps负载能力(该数据是上一次的测试的数据,
         # 这就意味着当改变相关数据时候就应该测试一次prime_app_rps)
         temp_prime_app_rps: Dict[str, float] = {}
-        with open('/home/wwz/ryu/ryu/app/network_awareness/prime_app_rps.json', 'r') as json_file:
+        with open(PRIME_APP_RPS_JSON_PATH, 'r') as json_file:
             temp_prime_app_rps: Dict[str, float] = json.load(json_file)
         prime_app_rps_value = np.array(list(temp_prime_app_rps.values()))
         sum_prime_app_rps = np.sum(prime_app_rps_value)
@@ -199,7 +339,7 @@ class SimNetworkSetUp():
         print(f'cpn_node_rps{self.cpn_node_rps}')
         cpn_node_rps_dict = {f'cpNode{i+1}': self.cpn_node_rps[i] for i in range(self.numberOfCPNodes)}
         # 将字典保存为 JSON 文件
-        with open('/home/wwz/ryu/ryu/app/network_awareness/cpn_node_rps.json', 'w') as json_file:
+        with open(CPN_NODE_RPS_JSON_PATH, 'w') as json_file:
             json.dump(cpn_node_rps_dict, json_file, indent=4)
         # 设置cpn节点 node capacity
         temp_cpn_node =  (CPU_PERIOD*(1-MAX_CPU_UTIL)-MIN_CPU_PERIOD_FOR_DOCKER*self.numberOfCPNodes)*temp/sum_value
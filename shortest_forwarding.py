@@ -28,14 +28,16 @@ from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import CONFIG_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
 from ryu.lib.packet import arp
+from ryu.lib.packet import ether_types
+from ryu.lib import hub
 
 from ryu.topology import event, switches
 from ryu.topology.api import get_switch, get_link
 
+from flow_programmer import FlowProgrammer, FlowBatch
+from packet_classifier import ClassifiedPacket
+from flow_reconciler import FlowReconciler, DesiredFlow
 import network_awareness
 import network_monitor
 import network_delay_detector
@@ -76,10 +78,23 @@ class ShortestForwarding(app_manager.RyuApp):
         self.datapaths: Dict[int, Datapath] = {}
         # CONF.weight: hop, bw, delay
         self.weight = setting.WEIGHT_MODEL[CONF.weight]
+        # 按datapath批量下发一条路径的流表项, 所有流表项生效后再发送packet-out
+        self.flow_programmer = FlowProgrammer()
 
         # 网络设置类
-        service_id_dict = setting.SimNetworkSetUp().service_id_dict
-        self.cpn_ip_list = [item[0] for item in service_id_dict.keys()]
+        self.sim_net_setting = setting.SimNetworkSetUp()
+        service_id_dict = self.sim_net_setting.service_id_dict
+        self.cpn_ip_list: Set[str] = {item[0] for item in service_id_dict.keys()}
+
+        # 主动下发模式 (dpid, 目的ip) ——> 出端口, 记录已计算的目的地址流表
+        self.proactive_ports: Dict[Tuple[int, str], int] = {}
+        self.proactive_reconciler = FlowReconciler(cookie=setting.FlowCookie.PROACTIVE.value)
+        if setting.PROACTIVE_FLOW_INSTALL:
+            self.proactive_thread = hub.spawn(self._proactive_install)
+
+        # 由 awareness 的packet_in分发器转交ARP与IPv4报文
+        self.awareness.packet_in_dispatcher.register(ether_types.ETH_TYPE_ARP, self._packet_in_handler)
+        self.awareness.packet_in_dispatcher.register(ether_types.ETH_TYPE_IP, self._packet_in_handler)
 
     @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
     def _state_change_handler(self, ev):
@@ -95,35 +110,35 @@ class ShortestForwarding(app_manager.RyuApp):
             if datapath.id in self.datapaths:
                 self.logger.debug('unregister datapath: %016x', datapath.id)
                 del self.datapaths[datapath.id]
+                self.flow_programmer.forget_datapath(datapath.id)
+                self.proactive_reconciler.forget_datapath(datapath.id)
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def _packet_in_handler(self, ev):
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        self.flow_programmer.barrier_reply(ev.msg.datapath.id, ev.msg.xid)
+
+    def _packet_in_handler(self, ev, pkt: ClassifiedPacket):
         '''
             In packet_in handler, we need to learn access_table by ARP.
             Therefore, the first packet from UNKOWN host MUST be ARP.
+            报文已由 awareness 分类, 只使用分类时读取的地址字段, 不再完整解析
         '''
         msg = ev.msg
-        datapath = msg.datapath
-        in_port = msg.match['in_port']
-        pkt = packet.Packet(msg.data)
-        arp_pkt = pkt.get_protocol(arp.arp)
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
 
-        if isinstance(arp_pkt, arp.arp):
+        if pkt.arp_opcode is not None:
             # 避免处理 CPN ip
-            if arp_pkt.dst_ip not in self.cpn_ip_list:
+            if pkt.dst_ip not in self.cpn_ip_list:
                 self.logger.debug("ARP processing")
-                self.arp_forwarding(msg, arp_pkt.src_ip, arp_pkt.dst_ip)
+                self.arp_forwarding(msg, pkt.src_ip, pkt.dst_ip, arp_opcode=pkt.arp_opcode, src_mac=pkt.src_mac)
 
-        if isinstance(ip_pkt, ipv4.ipv4):
+        elif pkt.ip_proto is not None:
             self.logger.debug("IPV4 processing")
-            if len(pkt.get_protocols(ethernet.ethernet)):
-                eth_type = pkt.get_protocols(ethernet.ethernet)[0].ethertype
-                self.shortest_forwarding(msg, eth_type, ip_pkt.src, ip_pkt.dst)
+            self.shortest_forwarding(msg, pkt.eth_type, pkt.src_ip, pkt.dst_ip)
     
-    def add_flow(self, dp, p, match, actions, idle_timeout=0, hard_timeout=0):
+    def add_flow(self, dp, p, match, actions, idle_timeout=0, hard_timeout=0, batch: FlowBatch = None):
         """
             Send a flow entry to datapath.
+            batch不为None时只加入批量下发的batch, 由 flow_programmer 统一发送
         """
         ofproto = dp.ofproto
         parser = dp.ofproto_parser
@@ -132,19 +147,35 @@ class ShortestForwarding(app_manager.RyuApp):
                                              actions)]
 
         mod = parser.OFPFlowMod(datapath=dp, priority=p,
+                                cookie=setting.FlowCookie.FORWARDING.value,
                                 idle_timeout=idle_timeout,
                                 hard_timeout=hard_timeout,
                                 match=match, instructions=inst)
-        dp.send_msg(mod)
+        if batch is not None:
+            batch.add(dp, mod)
+        else:
+            dp.send_msg(mod)
 
-    def arp_forwarding(self, msg, src_ip, dst_ip):
-        """ Send ARP packet to the destination host,
+    def arp_forwarding(self, msg, src_ip, dst_ip, arp_opcode=arp.ARP_REQUEST, src_mac=None):
+        """ Answer the ARP request from the proxy cache if possible,
+            else send ARP packet to the destination host,
             if the dst host record is existed,
             else, flow it to the unknow access port.
         """
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        # 缓存中有目的主机的MAC时 由控制器直接应答ARP请求(免费ARP除外)
+        if arp_opcode == arp.ARP_REQUEST and src_mac is not None and src_ip != dst_ip:
+            dst_mac = self.awareness.arp_proxy.lookup(dst_ip)
+            if dst_mac is not None:
+                data = self.awareness.arp_proxy.build_reply(dst_ip, dst_mac, src_ip, src_mac)
+                out = self._build_packet_out(datapath, ofproto.OFP_NO_BUFFER,
+                                             ofproto.OFPP_CONTROLLER,
+                                             msg.match['in_port'], data)
+                datapath.send_msg(out)
+                self.logger.debug("Proxy ARP reply for %s", dst_ip)
+                return
         # resulet: (dpid, port) 
         result = self.awareness.get_host_location(dst_ip)
         if result:  # host record in access table.
@@ -159,7 +190,11 @@ class ShortestForwarding(app_manager.RyuApp):
             self.logger.debug("Reply ARP to knew host")
         else:
             # 如果network awareness模块未感知到该目的主机IP的信息则再次让与目的主机连接的交换机转发该ARP报文给控制器
-            self.flood(msg)
+            # 同一目的IP的重复请求与超出速率的请求不再泛洪
+            if self.awareness.arp_proxy.allow_flood(dst_ip):
+                self.flood(msg)
+            else:
+                self.logger.debug("ARP flood for %s suppressed", dst_ip)
     
     def _build_packet_out(self, datapath, buffer_id, src_port, dst_port, data):
         """
@@ -185,18 +220,20 @@ class ShortestForwarding(app_manager.RyuApp):
             Flood ARP packet to the access port
             which has no record of host.
         """
-        datapath = msg.datapath
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-
-        for dpid in self.awareness.access_ports:
-            for port in self.awareness.access_ports[dpid]:
-                if (dpid, port) not in self.awareness.access_table.keys():
-                    datapath = self.datapaths[dpid]
-                    out = self._build_packet_out(
-                        datapath, ofproto.OFP_NO_BUFFER,
-                        ofproto.OFPP_CONTROLLER, port, msg.data)
-                    datapath.send_msg(out)
+        # 每个交换机只发送一条packet-out, 输出到该交换机所有未记录主机的接入端口
+        for dpid, ports in self.awareness.access_ports.items():
+            datapath = self.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            actions = [parser.OFPActionOutput(port) for port in ports
+                       if (dpid, port) not in self.awareness.access_table]
+            if not actions:
+                continue
+            out = parser.OFPPacketOut(datapath=datapath, buffer_id=ofproto.OFP_NO_BUFFER,
+                                      in_port=ofproto.OFPP_CONTROLLER, actions=actions, data=msg.data)
+            datapath.send_msg(out)
         self.logger.debug("Flooding msg")
     
     def shortest_forwarding(self, msg, eth_type, ip_src, ip_dst):
@@ -261,15 +298,14 @@ class ShortestForwarding(app_manager.RyuApp):
         if weight == setting.WEIGHT_MODEL['hop']:
             return shortest_paths.get(src).get(dst)[0]
         elif weight == setting.WEIGHT_MODEL['delay']:
-            # If paths existed, return it, else calculate it and save it.
-            try:
-                paths = shortest_paths.get(src).get(dst)
-                return paths[0]
-            except:
-                paths = self.awareness.k_shortest_paths(graph, src, dst, weight=weight)
-                shortest_paths.setdefault(src, {})
-                shortest_paths[src].setdefault(dst, paths)
-                return paths[0]
+            # 读取按时延计算的路径缓存, 时延尚未测量完整时退回按跳数计算的路径
+            path = self.awareness.delay_path_cache.get_path(src, dst)
+            if path is not None:
+                return path
+            paths = shortest_paths.get(src, {}).get(dst)
+            if not paths:
+                paths = self.awareness.k_shortest_paths(graph, src, dst, weight=setting.WEIGHT_MODEL['hop'])
+            return paths[0] if paths else None
         elif weight == setting.WEIGHT_MODEL['bw']:
             # Because all paths will be calculate when call self.monitor.get_best_path_by_bw. 
             # So we just need to call it once in a period, and then, we can get path directly.
@@ -279,7 +315,7 @@ class ShortestForwarding(app_manager.RyuApp):
                 return path
             except:
                 # else, calculate it, and return.
-                result = self.monitor.get_best_path_by_bw(graph, shortest_paths)
+                result = self.monitor.get_best_path_by_bw(self.awareness.csr_graph, shortest_paths)
                 paths = result[1]
                 best_path = paths.get(src).get(dst)
                 return best_path
@@ -299,6 +335,8 @@ class ShortestForwarding(app_manager.RyuApp):
         out_port = first_dp.ofproto.OFPP_LOCAL
         # back_info: (eth_type, dst_ip, src_ip)
         back_info = (flow_info[0], flow_info[2], flow_info[1])
+        # 路径上所有流表项按datapath分组, 每个datapath一次发送并附带barrier
+        batch = self.flow_programmer.new_batch()
 
         # inter_link
         # 根据路径长度的不同执行不同的下发操作
@@ -312,8 +350,8 @@ class ShortestForwarding(app_manager.RyuApp):
                 if port and port_next:
                     src_port, dst_port = port[1], port_next[0]
                     datapath = datapaths[path[i]]
-                    self.send_flow_mod(datapath, flow_info, src_port, dst_port)
-                    self.send_flow_mod(datapath, back_info, dst_port, src_port)
+                    self.send_flow_mod(datapath, flow_info, src_port, dst_port, batch)
+                    self.send_flow_mod(datapath, back_info, dst_port, src_port, batch)
                     self.logger.debug("inter_link flow install")
         if len(path) > 1:
             # the last flow entry: tor -> host
@@ -321,28 +359,30 @@ class ShortestForwarding(app_manager.RyuApp):
                                                      path[-2], path[-1])
             if port_pair is None:
                 self.logger.info("Port is not found")
+                self.flow_programmer.commit(batch)
                 return
             src_port = port_pair[1]
 
             dst_port = self.get_port(flow_info[2], access_table)
             if dst_port is None:
                 self.logger.info("Last port is not found.")
+                self.flow_programmer.commit(batch)
                 return
 
             last_dp = datapaths[path[-1]]
-            self.send_flow_mod(last_dp, flow_info, src_port, dst_port)
-            self.send_flow_mod(last_dp, back_info, dst_port, src_port)
+            self.send_flow_mod(last_dp, flow_info, src_port, dst_port, batch)
+            self.send_flow_mod(last_dp, back_info, dst_port, src_port, batch)
 
             # the first flow entry
             port_pair = self.get_port_pair_from_link(link_to_port,
                                                      path[0], path[1])
             if port_pair is None:
                 self.logger.info("Port not found in first hop.")
+                self.flow_programmer.commit(batch)
                 return
             out_port = port_pair[0]
-            self.send_flow_mod(first_dp, flow_info, in_port, out_port)
-            self.send_flow_mod(first_dp, back_info, out_port, in_port)
-            self.send_packet_out(first_dp, buffer_id, in_port, out_port, data)
+            self.send_flow_mod(first_dp, flow_info, in_port, out_port, batch)
+            self.send_flow_mod(first_dp, back_info, out_port, in_port, batch)
 
         # src and dst on the same datapath
         else:
@@ -350,12 +390,14 @@ class ShortestForwarding(app_manager.RyuApp):
             if out_port is None:
                 self.logger.info("Out_port is None in same dp")
                 return
-            self.send_flow_mod(first_dp, flow_info, in_port, out_port)
-            self.send_flow_mod(first_dp, back_info, out_port, in_port)
-            self.send_packet_out(first_dp, buffer_id, in_port, out_port, data)
+            self.send_flow_mod(first_dp, flow_info, in_port, out_port, batch)
+            self.send_flow_mod(first_dp, back_info, out_port, in_port, batch)
 
+        # 下游流表项全部生效后再发送packet-out, 避免数据包先于流表到达下一跳而再次触发packet-in
+        self.flow_programmer.commit(
+            batch, on_complete=lambda: self.send_packet_out(first_dp, buffer_id, in_port, out_port, data))
 
-    def send_flow_mod(self, datapath, flow_info, src_port, dst_port):
+    def send_flow_mod(self, datapath, flow_info, src_port, dst_port, batch: FlowBatch = None):
         """
             Build flow entry, and send it to datapath.
         """
@@ -368,7 +410,8 @@ class ShortestForwarding(app_manager.RyuApp):
             ipv4_src=flow_info[1], ipv4_dst=flow_info[2])
 
         self.add_flow(datapath, 1, match, actions,
-                      idle_timeout=setting.FlowEntry_IDLET_IMEOUT, hard_timeout=setting.FlowEntry_HARD_TIMOUT)
+                      idle_timeout=setting.FlowEntry_IDLET_IMEOUT, hard_timeout=setting.FlowEntry_HARD_TIMOUT,
+                      batch=batch)
 
 
     def send_packet_out(self, datapath, buffer_id, src_port, dst_port, data):
@@ -380,17 +423,104 @@ class ShortestForwarding(app_manager.RyuApp):
         if out:
             datapath.send_msg(out)
 
+    def _proactive_install(self):
+        while True:
+            hub.sleep(setting.PROACTIVE_INSTALL_PERIOD)
+            self.proactive_install()
+
+    def proactive_install(self):
+        """
+            主动下发目的地址流表(只匹配 eth_type + ipv4_dst):
+            - 每个接入交换机(switchB) ——> 每个prime app
+            - 每个prime app所在交换机 ——> 接入交换机上的主机
+            每个目的地址在每个交换机上最多一条流表, 只下发与已下发流表不同的流表项
+        """
+        graph = self.awareness.graph
+        if graph.number_of_nodes() == 0:
+            return
+        setup = self.sim_net_setting
+        app_locations = {}
+        for ip in setup.prime_apps_ip_list:
+            location = self.awareness.get_host_location(ip)
+            if location:
+                app_locations[ip] = location
+        if not app_locations:
+            return
+        access_dpids = [dpid for dpid in setup.switchB_dpid_list if dpid in graph]
+        app_dpids = sorted({location[0] for location in app_locations.values()})
+        client_locations = {ip: location for location, (ip, mac) in self.awareness.access_table.items()
+                            if location[0] in access_dpids and ip not in app_locations}
+
+        ports: Dict[Tuple[int, str], int] = {}
+        for ip, location in app_locations.items():
+            for dpid, port in self.destination_tree(location, access_dpids).items():
+                ports[(dpid, ip)] = port
+        for ip, location in client_locations.items():
+            for dpid, port in self.destination_tree(location, app_dpids).items():
+                ports[(dpid, ip)] = port
+        self.proactive_ports = ports
+
+        flows: Dict[int, List[DesiredFlow]] = {}
+        for (dpid, ip), port in ports.items():
+            datapath = self.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            parser = datapath.ofproto_parser
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=ip)
+            flows.setdefault(dpid, []).append(
+                DesiredFlow(setting.PROACTIVE_FLOW_PRIORITY, match, [parser.OFPActionOutput(port)]))
+        self.proactive_reconciler.begin_tick()
+        batch = self.flow_programmer.new_batch()
+        # 包括已没有期望流表的交换机, 删除不再需要的目的地址流表(例如主机迁移后)
+        for dpid in set(flows) | set(self.proactive_reconciler.installed):
+            datapath = self.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            self.proactive_reconciler.reconcile(datapath, flows.get(dpid, []), batch, remove_stale=True)
+        if len(batch):
+            self.flow_programmer.commit(batch)
+        self.logger.debug("proactive install: %d flow mods sent, %d avoided",
+                          self.proactive_reconciler.mods_sent, self.proactive_reconciler.mods_avoided)
+
+    def destination_tree(self, location, sources) -> Dict[int, int]:
+        """
+            以目的主机location(sw, port)为根的最短路径树, 覆盖从sources出发的路径
+            return: dpid ——> 通往目的主机的出端口
+        """
+        dst_sw, host_port = location
+        try:
+            # 所有交换机到dst_sw的最短路径, 各路径的后缀一致, 按目的地址转发不会形成环路
+            paths = nx.shortest_path(self.awareness.graph, target=dst_sw, weight='weight')
+        except (nx.NodeNotFound, nx.NetworkXError):
+            return {}
+        tree = {dst_sw: host_port}
+        for src in sources:
+            path = paths.get(src)
+            if path is None:
+                continue
+            for u, v in zip(path[:-1], path[1:]):
+                if u in tree:
+                    break
+                port_pair = self.awareness.link_to_port.get((u, v))
+                if port_pair is None:
+                    break
+                tree[u] = port_pair[0]
+        return tree
+
+    def proactive_port(self, dpid, dst_ip):
+        """
+            主动下发模式下交换机dpid通往dst_ip的出端口, 未计算时返回None
+        """
+        return self.proactive_ports.get((dpid, dst_ip))
+
     def get_port(self, dst_ip, access_table):
         """
             Get access port if dst host.
-            access_table: {(sw,port) :(ip, mac)}
+            access_table: {(sw,port) :(ip, mac)}, 实际通过awareness的 ip->(sw,port) 索引查找
         """
-        if access_table:
-            if len(access_table):
-                for key in access_table.keys():
-                    if dst_ip == access_table[key][0]:
-                        dst_port = key[1]
-                        return dst_port
+        location = self.awareness.get_host_location(dst_ip)
+        if location:
+            return location[1]
         return None
 
     def get_port_pair_from_link(self, link_to_port, src_dpid, dst_dpid):
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import List, Dict, Hashable, Iterable
+import numpy as np
+import setting
+
+"""
+端口/流统计信息的定长环形缓冲区: 每个对象(端口或流)占一行, 计数器/时间/速率按行保存在NumPy数组中
+一次统计回复中所有对象的速率由一次向量化差分计算
+"""
+
+
+class StatsRingBuffer:
+    """
+    - index: key ——> 行号, 行号在 forget 后回收复用
+    - counter: 字节计数, time: 统计时长(s), speed: 速率(bytes/s), 形状均为 (行数, length)
+    - head: 每行下一次写入的位置, count: 每行已保存的记录数(不超过length)
+    length: 每个对象保存的最大记录数量
+    capacity: 初始行数, 不足时按倍数扩容
+    """
+    def __init__(self, length: int = setting.STATS_HISTORY_LENGTH, capacity: int = 64):
+        self.length = length
+        self.index: Dict[Hashable, int] = {}
+        self.free_rows: List[int] = []
+        self.counter = np.zeros((capacity, length), dtype=np.int64)
+        self.time = np.zeros((capacity, length), dtype=np.float64)
+        self.speed = np.zeros((capacity, length), dtype=np.float64)
+        self.head = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.index
+
+    def keys(self) -> Iterable[Hashable]:
+        return self.index.keys()
+
+    def _grow(self, n_rows: int):
+        capacity = len(self.head)
+        while capacity < n_rows:
+            capacity *= 2
+        extra = capacity - len(self.head)
+        if extra <= 0:
+            return
+        self.counter = np.vstack([self.counter, np.zeros((extra, self.length), dtype=np.int64)])
+        self.time = np.vstack([self.time, np.zeros((extra, self.length), dtype=np.float64)])
+        self.speed = np.vstack([self.speed, np.zeros((extra, self.length), dtype=np.float64)])
+        self.head = np.concatenate([self.head, np.zeros(extra, dtype=np.int64)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+
+    def rows(self, keys: List[Hashable]) -> np.ndarray:
+        """
+        keys 对应的行号, 新对象分配行
+        """
+        index = self.index
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = index.get(key)
+            if row is None:
+                if self.free_rows:
+                    row = self.free_rows.pop()
+                else:
+                    row = len(index)
+                    self._grow(row + 1)
+                index[key] = row
+            rows[i] = row
+        return rows
+
+    def update(self, keys: List[Hashable], counters, times, default_period: float) -> np.ndarray:
+        """
+        写入一次统计回复, keys 不能重复
+        速率 = (本次计数 - 上次计数) / (本次时长 - 上次时长); 没有上次记录时上次计数记为0, 间隔为default_period
+        return: 与keys对齐的速率数组
+        """
+        rows = self.rows(keys)
+        counters = np.asarray(counters, dtype=np.int64)
+        times = np.asarray(times, dtype=np.float64)
+        head = self.head[rows]
+        last = (head - 1) % self.length
+        has_prev = self.count[rows] > 0
+        pre_counter = np.where(has_prev, self.counter[rows, last], 0)
+        period = np.where(has_prev, times - self.time[rows, last], default_period)
+        speed = np.zeros(len(rows), dtype=np.float64)
+        np.divide(counters - pre_counter, period, out=speed, where=period != 0)
+
+        self.counter[rows, head] = counters
+        self.time[rows, head] = times
+        self.speed[rows, head] = speed
+        self.head[rows] = (head + 1) % self.length
+        self.count[rows] = np.minimum(self.count[rows] + 1, self.length)
+        return speed
+
+    def latest_speed(self, key: Hashable, default: float = 0.0) -> float:
+        row = self.index.get(key)
+        if row is None or self.count[row] == 0:
+            return default
+        return float(self.speed[row, (self.head[row] - 1) % self.length])
+
+    def speed_change(self, keys: List[Hashable]) -> np.ndarray:
+        """
+        keys 最近两次速率之差, 记录不足三次时为nan (第一次速率没有上次记录, 不参与比较)
+        """
+        rows = np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys))
+        head = self.head[rows]
+        current = self.speed[rows, (head - 1) % self.length]
+        previous = self.speed[rows, (head - 2) % self.length]
+        return np.where(self.count[rows] >= 3, current - previous, np.nan)
+
+    def history(self, key: Hashable, field: str = 'speed') -> np.ndarray:
+        """
+        key 的历史记录(按时间先后), field: 'counter' 'time' 'speed'
+        """
+        row = self.index.get(key)
+        if row is None:
+            return np.zeros(0)
+        count, head = self.count[row], self.head[row]
+        order = (head - count + np.arange(count)) % self.length
+        return getattr(self, field)[row, order]
+
+    def forget(self, keys: Iterable[Hashable]):
+        for key in keys:
+            row = self.index.pop(key, None)
+            if row is not None:
+                self.head[row] = 0
+                self.count[row] = 0
+                self.free_rows.append(row)
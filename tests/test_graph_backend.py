@@ -0,0 +1,49 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from graph_backend import CSRGraph, WidestPathEngine
+
+
+def build_graph(links, bandwidth):
+    """
+    links: 无向链路列表, bandwidth: 与links对齐的链路带宽, 两个方向相同
+    """
+    graph = CSRGraph()
+    nodes = {u for link in links for u in link}
+    graph.rebuild(nodes, [(u, v) for u, v in links] + [(v, u) for u, v in links])
+    bw = np.zeros(graph.n_edges)
+    for (u, v), value in zip(links, bandwidth):
+        bw[graph.edge_index[(u, v)]] = value
+        bw[graph.edge_index[(v, u)]] = value
+    graph.set_weights('bw', bw)
+    return graph
+
+
+def test_equal_bandwidth_ring_takes_fewest_hops():
+    links = [(i, (i + 1) % 6) for i in range(6)]
+    engine = WidestPathEngine()
+    engine.refresh(build_graph(links, [10] * 6))
+    assert engine.get_path(0, 4) == [0, 5, 4]
+    assert engine.get_path(4, 0) == [4, 5, 0]
+    assert engine.get_path(0, 3) in ([0, 1, 2, 3], [0, 5, 4, 3])
+    assert engine.get_capacity(0, 4) == 10
+
+
+def test_widest_path_preferred_over_fewer_hops():
+    # 0-1-2-3 带宽10, 0-3 带宽1
+    links = [(0, 1), (1, 2), (2, 3), (0, 3)]
+    engine = WidestPathEngine()
+    engine.refresh(build_graph(links, [10, 10, 10, 1]))
+    assert engine.get_path(0, 3) == [0, 1, 2, 3]
+    assert engine.get_capacity(0, 3) == 10
+
+
+def test_fewest_hops_among_paths_with_same_bottleneck():
+    # 0到4的瓶颈带宽为5: 长路径 0-1-2-3-4 与短路径 0-5-4 (短路径上另一条链路更宽)
+    links = [(0, 1), (1, 2), (2, 3), (3, 4), (0, 5), (5, 4)]
+    engine = WidestPathEngine()
+    engine.refresh(build_graph(links, [20, 20, 20, 5, 5, 30]))
+    assert engine.get_capacity(0, 4) == 5
+    assert engine.get_path(0, 4) == [0, 5, 4]
+    assert engine.get_path(0, 3) == [0, 1, 2, 3]